@@ -0,0 +1,52 @@
+'''
+Micro-benchmark of the batched tank record decoder against per-field parse_ascii_floating_point.
+
+Run from the project root with: python -m benchmarks.bench_decoder
+'''
+import random
+import struct
+import timeit
+
+from util.DataLoader.data_loader import DataLoader, FLOAT_FIELDS
+
+TANKS = 12
+ROUNDS = 2000
+
+
+def build_data_section(tanks: int) -> str:
+    '''Builds the tank records of an i20100 response with random readings'''
+    records = []
+    for tank in range(1, tanks + 1):
+        values = [random.uniform(0, 12000) for _ in FLOAT_FIELDS]
+        fields = ''.join(struct.pack('>f', value).hex().upper() for value in values)
+        records.append(f"{tank:02d}1000007{fields}")
+    return ''.join(records)
+
+
+def per_field(dl: DataLoader, content: str) -> list:
+    '''Decodes the records one field at a time the way the parser used to'''
+    tanks = []
+    for start in range(0, len(content), 65):
+        record = content[start:start + 65]
+        tank_data = {'tank_number': record[0:2], 'product_number': record[2:3], 'tank_status': record[3:7]}
+        for index, field in enumerate(FLOAT_FIELDS):
+            tank_data[field] = dl.parse_ascii_floating_point(record[9 + index * 8:17 + index * 8])
+        tanks.append(tank_data)
+    return tanks
+
+
+def main():
+    '''Runs the benchmark and prints the results'''
+    dl = DataLoader()
+    content = build_data_section(TANKS)
+    assert [tank.to_dict() for tank in dl.parse_data_section(content)] == per_field(dl, content)
+    old = min(timeit.repeat(lambda: per_field(dl, content), number=ROUNDS, repeat=5))
+    new = min(timeit.repeat(lambda: dl.parse_data_section(content), number=ROUNDS, repeat=5))
+    print(f"{TANKS} tanks x {ROUNDS} responses")
+    print(f"per-field decoder: {old / ROUNDS * 1e6:8.1f} us per response")
+    print(f"batched decoder:   {new / ROUNDS * 1e6:8.1f} us per response")
+    print(f"speed-up:          {old / new:8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
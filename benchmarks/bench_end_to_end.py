@@ -0,0 +1,148 @@
+'''
+End-to-end benchmark of the poller against emulated TLS consoles.
+
+Starts one emulated console per site on localhost in separate processes, points a site file at them
+and runs main() over it. Reports the sweep wall time, per-site latency percentiles, CPU time and
+peak memory so regressions can be measured.
+
+Run from the project root with: python -m benchmarks.bench_end_to_end --sites 300 --latency 0.05
+'''
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import resource
+import socket
+import tempfile
+import time
+from typing import List
+
+import main as poller_main
+from conf import Settings
+from util.Emulator.tls_emulator import serve_emulators
+from util.Enums.mode import Mode
+from util.Enums.run_mode import RunMode
+from util.Enums.transport import Transport
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    '''Nearest-rank percentile of a list of values'''
+    if len(values) == 0:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def wait_for_port(host: str, port: int, timeout: float = 10) -> None:
+    '''Waits until something is listening on the port'''
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Emulator on port {port} did not start")
+
+
+def start_emulators(args: argparse.Namespace) -> List[multiprocessing.Process]:
+    '''Starts the emulated consoles split across args.emulator_processes processes'''
+    ports = list(range(args.base_port, args.base_port + args.sites))
+    options = {
+        'tanks': args.tanks,
+        'latency': args.latency,
+        'bandwidth': args.bandwidth,
+        'drop_rate': args.drop_rate,
+        'malformed_rate': args.malformed_rate,
+        'drift': args.drift,
+        'seed': 0
+    }
+    processes = [multiprocessing.Process(target=serve_emulators, daemon=True,
+                                         args=('127.0.0.1', ports[index::args.emulator_processes]),
+                                         kwargs=options)
+                 for index in range(args.emulator_processes)]
+    for process in processes:
+        process.start()
+    for port in ports[-args.emulator_processes:]:
+        wait_for_port('127.0.0.1', port)
+    return processes
+
+
+def cpu_time() -> float:
+    '''CPU seconds used by this process and its finished children'''
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def parse_args() -> argparse.Namespace:
+    '''Parses the command line'''
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sites', type=int, default=200)
+    parser.add_argument('--tanks', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds before each reply")
+    parser.add_argument('--bandwidth', type=int, default=None, help="bytes per second per connection")
+    parser.add_argument('--drop-rate', type=float, default=0.0)
+    parser.add_argument('--malformed-rate', type=float, default=0.0)
+    parser.add_argument('--drift', type=float, default=5.0, help="how far readings move between requests")
+    parser.add_argument('--commands', default='i20100', help="comma separated commands sent to every site")
+    parser.add_argument('--transport', choices=[transport.value for transport in Transport],
+                        default=Settings.DEFAULT_TRANSPORT.value)
+    parser.add_argument('--concurrency', type=int, default=Settings.MAX_CONCURRENT_SITES)
+    parser.add_argument('--mode', choices=['once', 'sharded'], default='once')
+    parser.add_argument('--workers', type=int, default=Settings.WORKER_PROCESSES)
+    parser.add_argument('--sweeps', type=int, default=3)
+    parser.add_argument('--base-port', type=int, default=18000)
+    parser.add_argument('--emulator-processes', type=int, default=2)
+    return parser.parse_args()
+
+
+def main():
+    '''Runs the benchmark and prints the results'''
+    args = parse_args()
+    logging.basicConfig(level=logging.CRITICAL)
+    emulators = start_emulators(args)
+    with tempfile.TemporaryDirectory() as folder:
+        sites = [{'Location': f'Site {index}', 'Host': '127.0.0.1', 'Port': args.base_port + index,
+                  'Command': 'i20100', 'Commands': args.commands.split(',')}
+                 for index in range(args.sites)]
+        with open(f'{folder}/sites.json', mode='w', encoding='utf-8') as f:
+            json.dump(sites, f)
+        Settings.MODE = Mode.PROD
+        Settings.RUN_MODE = RunMode.SHARDED if args.mode == 'sharded' else RunMode.ONCE
+        Settings.DATA_FOLDER = folder
+        Settings.PROD_FILE = 'sites.json'
+        Settings.EXPORT_FOLDER = folder
+        Settings.JSON_EXPORT_FOLDER = folder
+        Settings.HISTORY_FILE = f'{folder}/history.db'
+        Settings.FLEET_EXPORT_FILE = f'{folder}/fleet.ndjson'
+        Settings.METRICS_FILE = f'{folder}/metrics.json'
+        Settings.CHANGE_CACHE_FILE = f'{folder}/last_readings.json'
+        Settings.HEALTH_FILE = f'{folder}/site_health.json'
+        Settings.MAX_CONCURRENT_SITES = args.concurrency
+        Settings.DEFAULT_TRANSPORT = Transport(args.transport)
+        Settings.WORKER_PROCESSES = args.workers
+        print(f"{args.sites} sites x {args.tanks} tanks, mode {args.mode}, concurrency {args.concurrency}, "
+              f"transport {args.transport}")
+        for sweep in range(1, args.sweeps + 1):
+            cpu_start = cpu_time()
+            start = time.perf_counter()
+            summary = asyncio.run(poller_main.main())
+            elapsed = time.perf_counter() - start
+            cpu = cpu_time() - cpu_start
+            durations = list(summary.durations.values())
+            print(f"sweep {sweep}: {elapsed:6.2f}s wall  {cpu:6.2f}s cpu  "
+                  f"{summary.success_count}/{summary.total} ok  "
+                  f"latency p50 {percentile(durations, 0.5) * 1000:7.1f}ms  "
+                  f"p90 {percentile(durations, 0.9) * 1000:7.1f}ms  "
+                  f"p99 {percentile(durations, 0.99) * 1000:7.1f}ms  "
+                  f"max {max(durations, default=0) * 1000:7.1f}ms")
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"peak memory: {peak:.1f} MiB")
+    for emulator in emulators:
+        emulator.terminate()
+
+
+if __name__ == '__main__':
+    main()
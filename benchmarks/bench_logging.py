@@ -0,0 +1,107 @@
+'''
+Benchmark of the cost of logging on a sweep.
+
+Runs main() against emulated TLS consoles with the log level at WARNING, INFO and DEBUG, with log
+records handed to the listener thread (LOG_QUEUE) and written directly from the event loop. Console
+output goes to /dev/null and the log file to a temporary folder, so only the cost of logging is
+measured, not the terminal.
+
+Run from the project root with: python -m benchmarks.bench_logging --sites 200
+'''
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import statistics
+import tempfile
+import time
+
+import main as poller_main
+from benchmarks.bench_end_to_end import cpu_time, start_emulators
+from conf import Settings
+from util.Enums.mode import Mode
+from util.Enums.run_mode import RunMode
+from util.Logging.log_pipeline import LogPipeline
+
+CONFIGURATIONS = (('WARNING', True), ('INFO', True), ('DEBUG', True), ('INFO', False), ('DEBUG', False))
+
+
+def parse_args() -> argparse.Namespace:
+    '''Parses the command line'''
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sites', type=int, default=200)
+    parser.add_argument('--tanks', type=int, default=8)
+    parser.add_argument('--concurrency', type=int, default=Settings.MAX_CONCURRENT_SITES)
+    parser.add_argument('--sweeps', type=int, default=5)
+    parser.add_argument('--base-port', type=int, default=18500)
+    parser.add_argument('--emulator-processes', type=int, default=2)
+    args = parser.parse_args()
+    # Options start_emulators() expects from the end-to-end benchmark
+    args.latency, args.bandwidth, args.drop_rate, args.malformed_rate, args.drift = 0.0, None, 0.0, 0.0, 5.0
+    return args
+
+
+def run_sweeps(sweeps: int, level: str, use_queue: bool) -> tuple:
+    '''Wall and CPU seconds of each sweep and the number of lines logged'''
+    Settings.LOG_LEVEL = getattr(logging, level)
+    Settings.LOG_QUEUE = use_queue
+    walls, cpus = [], []
+    with open(os.devnull, mode='w', encoding='utf-8') as devnull, contextlib.redirect_stdout(devnull):
+        pipeline = LogPipeline.from_settings()
+        pipeline.start()
+        try:
+            for _ in range(sweeps):
+                cpu_start = cpu_time()
+                start = time.perf_counter()
+                asyncio.run(poller_main.main(pipeline))
+                walls.append(time.perf_counter() - start)
+                cpus.append(cpu_time() - cpu_start)
+        finally:
+            pipeline.stop()
+            root_logger = logging.getLogger()
+            for handler in list(root_logger.handlers):
+                root_logger.removeHandler(handler)
+    with open(pipeline.file, encoding='utf-8') as f:
+        lines = sum(1 for _ in f)
+    os.remove(pipeline.file)
+    return walls, cpus, lines
+
+
+def main():
+    '''Runs the benchmark and prints the results'''
+    args = parse_args()
+    emulators = start_emulators(args)
+    with tempfile.TemporaryDirectory() as folder:
+        sites = [{'Location': f'Site {index}', 'Host': '127.0.0.1', 'Port': args.base_port + index,
+                  'Command': 'i20100'} for index in range(args.sites)]
+        with open(f'{folder}/sites.json', mode='w', encoding='utf-8') as f:
+            json.dump(sites, f)
+        Settings.MODE = Mode.PROD
+        Settings.RUN_MODE = RunMode.ONCE
+        Settings.DATA_FOLDER = folder
+        Settings.PROD_FILE = 'sites.json'
+        Settings.EXPORT_FOLDER = folder
+        Settings.JSON_EXPORT_FOLDER = folder
+        Settings.LOG_FOLDER = folder
+        Settings.LOG_MAX_BYTES = 1024 ** 3
+        Settings.HISTORY_FILE = None
+        Settings.FLEET_EXPORT_FILE = None
+        Settings.METRICS_FILE = None
+        Settings.CHANGE_DETECTION = False
+        Settings.CIRCUIT_BREAKER = False
+        Settings.MAX_CONCURRENT_SITES = args.concurrency
+        print(f"{args.sites} sites x {args.tanks} tanks, concurrency {args.concurrency}, {args.sweeps} sweeps each")
+        for level, use_queue in CONFIGURATIONS:
+            walls, cpus, lines = run_sweeps(args.sweeps, level, use_queue)
+            print(f"{level:7s} {'queued' if use_queue else 'direct':6s}  "
+                  f"wall p50 {statistics.median(walls) * 1000:7.1f}ms  "
+                  f"cpu p50 {statistics.median(cpus) * 1000:7.1f}ms  "
+                  f"{lines / args.sweeps:8.0f} lines/sweep")
+    for emulator in emulators:
+        emulator.terminate()
+
+
+if __name__ == '__main__':
+    main()
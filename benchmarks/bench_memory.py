@@ -0,0 +1,48 @@
+'''
+Benchmark of the memory held by parsed readings for 10,000 tanks.
+
+Compares the per-tank dictionaries the parser used to build with TankReading objects.
+
+Run from the project root with: python -m benchmarks.bench_memory
+'''
+import tracemalloc
+
+from benchmarks.bench_decoder import build_data_section
+from util.DataLoader.data_loader import DataLoader
+
+TANKS = 10000
+TANKS_PER_SITE = 10
+
+
+def measure(build) -> int:
+    '''Bytes still allocated by the objects build() returns'''
+    tracemalloc.start()
+    result = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def main():
+    '''Runs the benchmark and prints the results'''
+    dl = DataLoader()
+    sections = [build_data_section(TANKS_PER_SITE) for _ in range(TANKS // TANKS_PER_SITE)]
+
+    def as_dicts():
+        return [{'date': '2405161517', 'data': [tank.to_dict() for tank in dl.parse_data_section(section)]}
+                for section in sections]
+
+    def as_readings():
+        return [dl.parse_full_string('2405161517' + section, 'i20100') for section in sections]
+
+    dicts = measure(as_dicts)
+    readings = measure(as_readings)
+    print(f"{TANKS} tanks in {len(sections)} sites")
+    print(f"dictionaries:  {dicts / 1024:8.1f} KiB  ({dicts / TANKS:6.1f} bytes per tank)")
+    print(f"TankReading:   {readings / 1024:8.1f} KiB  ({readings / TANKS:6.1f} bytes per tank)")
+    print(f"saved:         {(1 - readings / dicts) * 100:8.1f}%")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+'''
+Benchmark of the readings index and query server as the fleet grows.
+
+Fills a ReadingsIndex with synthetic sites, then times incremental updates and queries answered
+over local HTTP, both straight after an update (uncached) and repeated (cached).
+
+Run from the project root with: python -m benchmarks.bench_query
+'''
+import asyncio
+import random
+import statistics
+import time
+
+from util.Models.tank_reading import SiteSnapshot, TankReading
+from util.Query.query_server import QueryServer
+from util.Query.readings_index import ReadingsIndex
+
+FLEET_SIZES = (100, 1000, 10000)
+TANKS = 8
+QUERIES = 200
+PORT = 17060
+
+
+def build_snapshot(site: str, generator: random.Random) -> SiteSnapshot:
+    '''A site whose tanks have random volumes and water levels'''
+    tanks = []
+    for tank in range(1, TANKS + 1):
+        volume = generator.uniform(0, 10000)
+        tanks.append(TankReading(f'{tank:02d}', str(tank % 4 + 1), '0000', volume, volume * 0.99,
+                                 10000 - volume, volume / 250, generator.uniform(0, 2.5), 56.0, 0.0))
+    return SiteSnapshot('2405161517', tanks, site=site)
+
+
+async def query(path: str) -> float:
+    '''Seconds taken to answer one request'''
+    start = time.perf_counter()
+    reader, writer = await asyncio.open_connection('127.0.0.1', PORT)
+    writer.write(f"GET {path} HTTP/1.0\r\n\r\n".encode())
+    await reader.read()
+    writer.close()
+    return time.perf_counter() - start
+
+
+async def run() -> None:
+    '''Runs the benchmark and prints the results'''
+    generator = random.Random(0)
+    for sites in FLEET_SIZES:
+        index = ReadingsIndex()
+        snapshots = [build_snapshot(f'Site {number}', generator) for number in range(sites)]
+        start = time.perf_counter()
+        for snapshot in snapshots:
+            index.update(snapshot)
+        update = (time.perf_counter() - start) / sites
+        server = QueryServer(index, port=PORT)
+        await server.start()
+        for path in ('/totals', '/low-inventory', '/summary'):
+            uncached = []
+            for _ in range(QUERIES // 10):
+                index.update(snapshots[generator.randrange(sites)])
+                uncached.append(await query(path))
+            cached = [await query(path) for _ in range(QUERIES)]
+            print(f"{sites:6d} sites  {path:15s} update {update * 1e6:6.1f}us/site  "
+                  f"uncached p50 {statistics.median(uncached) * 1000:6.2f}ms  "
+                  f"cached p50 {statistics.median(cached) * 1000:6.2f}ms  max {max(cached) * 1000:6.2f}ms")
+        await server.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(run())
@@ -0,0 +1,62 @@
+'''
+Benchmark of sharded polling throughput against the number of worker processes.
+
+Starts emulated TLS consoles on localhost, then sweeps them with ShardedPoller using an increasing
+number of workers.
+
+Run from the project root with: python -m benchmarks.bench_sharding
+'''
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import time
+
+from benchmarks.bench_end_to_end import wait_for_port
+from conf import Settings
+from util.Emulator.tls_emulator import serve_emulators
+from util.Poller.sharded_poller import ShardedPoller
+
+SITES = 400
+TANKS = 24
+BASE_PORT = 17100
+SERVER_PROCESSES = 4
+
+
+def main():
+    '''Runs the benchmark and prints the results'''
+    per_server = SITES // SERVER_PROCESSES
+    servers = [multiprocessing.Process(target=serve_emulators, daemon=True,
+                                       args=('127.0.0.1', list(range(BASE_PORT + index * per_server,
+                                                                     BASE_PORT + (index + 1) * per_server))),
+                                       kwargs={'tanks': TANKS})
+               for index in range(SERVER_PROCESSES)]
+    for server in servers:
+        server.start()
+    for index in range(SERVER_PROCESSES):
+        wait_for_port('127.0.0.1', BASE_PORT + (index + 1) * per_server - 1)
+    sites = [{'Location': f'Site {index}', 'Host': '127.0.0.1', 'Port': BASE_PORT + index, 'Command': 'i20100'}
+             for index in range(per_server * SERVER_PROCESSES)]
+    with tempfile.TemporaryDirectory() as folder:
+        Settings.EXPORT_FOLDER = folder
+        Settings.JSON_EXPORT_FOLDER = folder
+        Settings.HISTORY_FILE = None
+        Settings.CHANGE_DETECTION = False
+        Settings.CIRCUIT_BREAKER = False
+        Settings.MAX_CONCURRENT_SITES = 50
+        baseline = None
+        workers = 1
+        while workers <= (os.cpu_count() or 1):
+            start = time.perf_counter()
+            summary = asyncio.run(ShardedPoller(workers).sweep(sites))
+            elapsed = time.perf_counter() - start
+            baseline = baseline or elapsed
+            print(f"{workers:3d} workers: {elapsed:6.2f}s  {len(sites) / elapsed:8.1f} sites/s  "
+                  f"speed-up {baseline / elapsed:4.1f}x  ({summary.success_count}/{summary.total} ok)")
+            workers *= 2
+    for server in servers:
+        server.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+'''
+Benchmark of connect-to-first-byte latency over the telnet and raw TCP transports.
+
+Starts an emulated TLS console on localhost and, for each transport, repeatedly opens a new session,
+sends i20100 and waits for the first byte of the response. Also reports how long a cold import of
+telnetlib3 takes, which raw-only runs no longer pay.
+
+Run from the project root with: python -m benchmarks.bench_transport
+'''
+import asyncio
+import statistics
+import subprocess
+import sys
+import time
+
+from util.Emulator.tls_emulator import TLSEmulator
+from util.Enums.transport import Transport
+from util.TelnetConnetor.telnet_connector import TelnetConnector
+
+PORT = 17050
+CONNECTIONS = 200
+
+
+async def first_byte_latencies(transport: Transport) -> list:
+    '''Seconds from starting to connect until the first byte of the response, per connection'''
+    connector = TelnetConnector(connect_timeout=10, read_timeout=10, keep_alive=False)
+    latencies = []
+    for _ in range(CONNECTIONS):
+        start = time.perf_counter()
+        session = await connector.open_connection('127.0.0.1', PORT, transport)
+        session.send('\x01i20100')
+        await connector._read_chunk(session, None)
+        latencies.append(time.perf_counter() - start)
+        await connector.close_connection(session)
+    return latencies
+
+
+def telnetlib3_import_time() -> float:
+    '''Seconds a fresh interpreter takes to import telnetlib3'''
+    script = "import time; start = time.perf_counter(); import telnetlib3; print(time.perf_counter() - start)"
+    return float(subprocess.run([sys.executable, '-c', script], check=True,
+                                capture_output=True, text=True).stdout)
+
+
+async def run() -> None:
+    '''Runs the benchmark and prints the results'''
+    server = await TLSEmulator(tanks=8).start('127.0.0.1', PORT)
+    for transport in (Transport.TELNET, Transport.RAW):
+        latencies = await first_byte_latencies(transport)
+        print(f"{transport.value:>6}: first byte p50 {statistics.median(latencies) * 1000:7.2f}ms  "
+              f"mean {statistics.mean(latencies) * 1000:7.2f}ms  max {max(latencies) * 1000:7.2f}ms")
+    server.close()
+    await server.wait_closed()
+    print(f"telnetlib3 cold import: {telnetlib3_import_time() * 1000:.1f}ms")
+
+
+if __name__ == '__main__':
+    asyncio.run(run())
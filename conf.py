@@ -3,6 +3,8 @@ Configuration file for the project. Contains the settings for the project.
 '''
 import logging
 from util.Enums.mode import Mode
+from util.Enums.run_mode import RunMode
+from util.Enums.transport import Transport
 
 
 class Settings:
@@ -10,8 +12,108 @@ class Settings:
     EXPORT_FOLDER = 'exports'
     LOG_FOLDER = 'logs'
     LOG_LEVEL = logging.INFO
+    # Hand log records to a listener thread so writing them never blocks the event loop
+    LOG_QUEUE = True
+    # The log file rolls over once it reaches LOG_MAX_BYTES, keeping LOG_BACKUP_COUNT old files
+    LOG_MAX_BYTES = 10 * 1024 * 1024
+    LOG_BACKUP_COUNT = 5
+    # "text" for one line of columns per record or "json" for one JSON object per record
+    LOG_FORMAT = 'text'
+    # File the latency histograms and counters are written to after each run. Set to None to disable
+    METRICS_FILE = 'logs/metrics.json'
+    # "json" for a JSON snapshot or "prometheus" for a node exporter textfile
+    METRICS_FORMAT = 'json'
     DATA_FOLDER = 'data'
     MODE = Mode.PROD
+    # ONCE polls every site a single time and exits, DAEMON keeps polling on each site's interval,
+    # SHARDED polls every site once split across WORKER_PROCESSES processes
+    RUN_MODE = RunMode.ONCE
+    WORKER_PROCESSES = 4
     PROD_FILE = 'fb_tanks.json'
     TEST_FILE = 'test_tanks.json'
     JSON_EXPORT_FOLDER = 'json_exports'
+    # Write one JSON file per site to JSON_EXPORT_FOLDER
+    PER_SITE_EXPORTS = True
+    # File the latest readings of every site are written to after each sweep. Set to None to disable
+    FLEET_EXPORT_FILE = 'json_exports/fleet.ndjson'
+    # "ndjson" for one site per line or "json" for a single array
+    FLEET_EXPORT_FORMAT = 'ndjson'
+    # Use orjson for the fleet export when it is installed
+    FAST_JSON = True
+    # Threads that write exports, captures and history off the event loop
+    WRITER_THREADS = 2
+    # Writes that may wait for a writer thread before polling waits for the disk to catch up
+    MAX_PENDING_WRITES = 100
+    # Skip writing exports and history for sites whose readings have not changed since the last write
+    CHANGE_DETECTION = True
+    # How far each reading may move before it counts as changed. Readings not listed must match exactly
+    CHANGE_DEADBANDS = {
+        'volume': 5,
+        'tc_volume': 5,
+        'ullage': 5,
+        'height': 0.05,
+        'water': 0.05,
+        'temperature': 0.2,
+        'water_volume': 1
+    }
+    # Seconds after which unchanged readings are written anyway to show the site is still reporting
+    HEARTBEAT_INTERVAL = 3600
+    # File the last written readings are kept in between runs
+    CHANGE_CACHE_FILE = 'data/last_readings.json'
+    # Always write the raw response of each site to EXPORT_FOLDER. When False, it is only written
+    # for responses that fail to parse
+    WRITE_TEXT_CAPTURE = False
+    # SQLite database every reading is appended to. Set to None to disable the history
+    HISTORY_FILE = 'data/history.db'
+    # Maximum number of sites polled at the same time during a sweep
+    MAX_CONCURRENT_SITES = 10
+    # Transport for sites without a "Transport" key. Transport.RAW skips telnet option negotiation
+    DEFAULT_TRANSPORT = Transport.TELNET
+    # Stop polling sites that keep failing until a probe shows they answer again
+    CIRCUIT_BREAKER = True
+    # Failures in a row after which a site's circuit opens
+    CIRCUIT_FAILURE_THRESHOLD = 3
+    # Seconds until the first probe of a site with an open circuit. Doubles after every failed probe
+    CIRCUIT_PROBE_INTERVAL = 900
+    # Longest time in seconds between probes
+    CIRCUIT_MAX_PROBE_INTERVAL = 86400
+    # File the health of every site is kept in between runs
+    HEALTH_FILE = 'data/site_health.json'
+    # Fraction of the sites in a sweep that may be retried once after failing to answer
+    SWEEP_RETRY_BUDGET = 0.1
+    # Seconds to wait before retrying a site
+    RETRY_DELAY = 1
+    # Times a command is sent again on the same session when its response fails the checksum
+    CORRUPT_FRAME_RETRIES = 2
+    # Seconds allowed to establish a connection to a site
+    CONNECT_TIMEOUT = 10
+    # Seconds allowed to receive a full response from a site
+    READ_TIMEOUT = 30
+    # Keep sessions to sites open between polls instead of reconnecting every time
+    KEEP_SESSIONS_ALIVE = True
+    # Seconds an unused session is kept open before it is closed. Longer than DEFAULT_POLL_INTERVAL plus
+    # its jitter, so a daemon reuses each site's session on its next poll
+    SESSION_IDLE_TIMEOUT = 1200
+    # Seconds between polls of a site in daemon mode when the site has no "Interval" set
+    DEFAULT_POLL_INTERVAL = 900
+    # Fraction of the interval poll times are randomly spread by
+    POLL_JITTER = 0.1
+    # Longest delay in seconds between polls of a failing site
+    MAX_BACKOFF = 3600
+    # Seconds between status reports in daemon mode
+    SCHEDULER_REPORT_INTERVAL = 300
+    # Seconds between checks of the site file for added, removed or changed sites in daemon mode
+    SITE_RELOAD_INTERVAL = 30
+    # Serve fleet-wide queries on the latest readings while running as a daemon
+    QUERY_SERVER = True
+    # Address the query server listens on
+    QUERY_HOST = '127.0.0.1'
+    QUERY_PORT = 8420
+    # Unix socket the query server listens on instead of QUERY_HOST and QUERY_PORT, when set
+    QUERY_SOCKET = None
+    # Tanks whose volume is below this fraction of their capacity are listed as low on inventory
+    LOW_INVENTORY_FRACTION = 0.2
+    # Tanks with more water than this height (inches) are listed as water alarms
+    WATER_ALARM_LEVEL = 2.0
+    # Names of the product numbers reported by the consoles, used to total readings per product
+    PRODUCT_NAMES = {}
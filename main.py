@@ -2,119 +2,173 @@
 import sys
 import logging
 import asyncio
+import signal
 
 from conf import Settings
-from util.Exceptions.custom_exceptions import CriticalError, SimpleError
+from util.Exceptions.custom_exceptions import CriticalError
 from util.DataLoader.data_loader import DataLoader
-from util.TelnetConnetor.telnet_connector import TelnetConnector
+from util.Logging.log_pipeline import LogPipeline
+from util.Metrics.metrics import get_metrics
+from util.Poller.sharded_poller import ShardedPoller
+from util.Query.query_server import QueryServer
+from util.Query.readings_index import ReadingsIndex
+from util.Poller.site_poller import SitePoller, SweepSummary, export_fleet
+from util.Registry.site_registry import SiteRegistry
+from util.Scheduler.poll_scheduler import PollScheduler
 from util.Enums.mode import Mode
+from util.Enums.run_mode import RunMode
 
 
-async def main():
-    '''Main Function'''
+async def main(log_pipeline: LogPipeline = None) -> SweepSummary:
+    '''Main Function. Returns the summary of the sweep when polling once'''
     logger = logging.getLogger()
     logger.debug("Starting main process")
     logger.info("Running in mode: %s",
                 "Production" if Settings.MODE == Mode.PROD
                 else "Debug" if Settings.MODE == Mode.DEBUG
                 else "Unknown")
+    get_metrics().configure(Settings.METRICS_FILE, Settings.METRICS_FORMAT)
     dl = DataLoader()
     file = f'{Settings.DATA_FOLDER}/{Settings.PROD_FILE}'\
         if Settings.MODE == Mode.PROD \
         else f'{Settings.DATA_FOLDER}/{Settings.TEST_FILE}' \
         if Settings.MODE == Mode.DEBUG \
         else ''
+    registry = SiteRegistry(file)
     try:
-        tank_data = dl.load_json_file(file)
+        tank_data = registry.load()
     except CriticalError:
         logger.critical("Critical Error loading data. Exiting.")
         sys.exit(1)
     logger.debug("Iterating over data.")
-    telnet_connector = TelnetConnector()
-    success_count = 0
-    failed_list = []
-    for tank in tank_data:
-        logger.info("Retrieving data from %s....", tank['Location'])
-        export_text_file = f"{Settings.EXPORT_FOLDER}/{tank['Location']}.txt"
-        export_json_file = f"{Settings.JSON_EXPORT_FOLDER}/{tank['Location']}.json"
-
-        # Get Tank Data
+    if Settings.RUN_MODE == RunMode.SHARDED:
         try:
-            response_content = await telnet_connector.get_tank_data(host=tank['Host'],
-                                                                    port=tank['Port'],
-                                                                    command=tank['Command'])
+            return await run_sharded(dl, tank_data, log_pipeline)
         except CriticalError as e:
             logger.critical("Critical Error: %s", e)
             logger.critical("Exiting...")
             sys.exit(1)
-        except SimpleError:
-            logger.error(
-                "Failed to retrieve data from %s at %s on port %s with command %s. Skipping...",
-                tank['Location'],
-                tank['Host'],
-                tank['Port'],
-                tank['Command'])
-            failed_list.append(tank['Location'])
-            continue
-        try:
-            # data = response_content.split('\r\n')
-            # data = data[2:len(data)-2]
-            # dl.write_list_to_file(response_content,
-            #                       f"{Settings.EXPORT_FOLDER}/{tank['Location']}.txt")
-            dl.write_string_to_file(response_content,
-                                    export_text_file)
-        except SimpleError as e:
-            logger.error("Failed to write data to file: %s", e)
-            failed_list.append(tank['Location'])
-            continue
-        except CriticalError as e:
-            logger.critical("Critical Error: %s", e)
-            failed_list.append(tank['Location'])
-            continue
-        logger.info("Successfully wrote data for %s.", tank['Location'])
-        logger.info("Writing data to JSON file...")
+        finally:
+            await asyncio.to_thread(get_metrics().export)
+    try:
+        site_poller = SitePoller.from_settings(dl)
+    except CriticalError:
+        logger.critical("Critical Error opening history. Exiting.")
+        sys.exit(1)
+    try:
+        if Settings.RUN_MODE == RunMode.DAEMON:
+            await run_daemon(site_poller, registry)
+            return None
+        return await run_once(site_poller, tank_data)
+    except CriticalError as e:
+        logger.critical("Critical Error: %s", e)
+        logger.critical("Exiting...")
+        sys.exit(1)
+    finally:
+        await site_poller.close()
+        await asyncio.to_thread(get_metrics().export)
+
+
+def log_summary(summary: SweepSummary):
+    '''Logs the outcome of a sweep'''
+    logger = logging.getLogger()
+    logger.info("Successfully polled %s out of %s tanks.", summary.success_count, summary.total)
+    logger.info("Wrote changed readings for %s tanks. Skipped %s unchanged tanks.",
+                len(summary.written_list), len(summary.skipped_list))
+    for location, rate in summary.corruption_rates().items():
+        frames, corrupt_frames = summary.frames[location]
+        logger.warning("%s: %s of %s frames failed their checksum (%.1f%%).",
+                       location, corrupt_frames, frames, rate * 100)
+    if len(summary.circuit_open_list) > 0:
+        logger.warning("Skipped %s tanks with open circuits: %s",
+                       len(summary.circuit_open_list), summary.circuit_open_list)
+    if len(summary.failed_list) > 0:
+        logger.warning("Failed to write data for %s tanks.", len(summary.failed_list))
+        logger.warning("Failed tanks: %s", summary.failed_list)
+        for location, reason in summary.failures.items():
+            logger.warning("%s: %s", location, reason)
+
 
-        # Write data to JSON file
+async def finish_sweep(site_poller: SitePoller, summary: SweepSummary, tank_data: list) -> None:
+    '''
+    Logs the summary of a single sweep and writes the fleet export. Like the daemon, the export keeps
+    the last snapshot of sites that did not answer this time, taken from the previous export
+    '''
+    log_summary(summary)
+    if len(summary.written_list) == 0 or not Settings.FLEET_EXPORT_FILE:
+        return
+    locations = {site['Location'] for site in tank_data}
+    previous = await asyncio.to_thread(site_poller.data_loader.read_fleet_export,
+                                       Settings.FLEET_EXPORT_FILE, Settings.FLEET_EXPORT_FORMAT)
+    snapshots = {snapshot.site: snapshot for snapshot in previous if snapshot.site in locations}
+    snapshots.update(summary.snapshots)
+    await export_fleet(site_poller.writer, site_poller.data_loader, snapshots.values())
+
+
+async def run_once(site_poller: SitePoller, tank_data: list) -> SweepSummary:
+    '''Polls every site once and logs the summary'''
+    summary = await site_poller.sweep(tank_data)
+    await finish_sweep(site_poller, summary, tank_data)
+    return summary
+
+
+async def run_sharded(data_loader: DataLoader, tank_data: list, log_pipeline: LogPipeline = None) -> SweepSummary:
+    '''
+    Polls every site once across worker processes and logs the summary. The last written readings
+    and health the shards report are saved once, by a poller opened after the workers are done
+    '''
+    log_queue = None if log_pipeline is None else log_pipeline.worker_queue()
+    summary = await ShardedPoller(Settings.WORKER_PROCESSES, log_queue).sweep(tank_data)
+    site_poller = SitePoller.from_settings(data_loader)
+    try:
+        site_poller.absorb(summary)
+        await finish_sweep(site_poller, summary, tank_data)
+    finally:
+        await site_poller.close()
+    return summary
+
+
+async def run_daemon(site_poller: SitePoller, registry: SiteRegistry):
+    '''Keeps polling every site on its own interval until the process is stopped, following changes to the site file'''
+    logger = logging.getLogger()
+    scheduler = PollScheduler(site_poller, registry.sites,
+                              default_interval=Settings.DEFAULT_POLL_INTERVAL,
+                              jitter=Settings.POLL_JITTER,
+                              max_backoff=Settings.MAX_BACKOFF,
+                              report_interval=Settings.SCHEDULER_REPORT_INTERVAL,
+                              registry=registry,
+                              reload_interval=Settings.SITE_RELOAD_INTERVAL)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
         try:
-            with open(export_text_file, "r", encoding='utf-8') as file:
-                content = file.read()
-                parsed_json = dl.parse_full_string(content, tank['Command'])
-                added_args = {"site": tank['Location']}
-                added_args.update(parsed_json)
-                dl.write_to_json_from_dict(added_args, export_json_file)
-            # dl.write_to_json(f"{Settings.EXPORT_FOLDER}/{tank['Location']}.txt",
-            #                  f"{Settings.JSON_EXPORT_FOLDER}/{tank['Location']}.json")
-            success_count += 1
-        except CriticalError as e:
-            logger.critical("Critical Error: %s", e)
-            failed_list.append(tank['Location'])
-            continue
-        except SimpleError as e:
-            logger.error("Failed to write data to JSON file: %s", e)
-            failed_list.append(tank['Location'])
-            continue
-    logger.info("Successfully wrote data for %s out of %s tanks.", success_count, len(tank_data))
-    if len(failed_list) > 0:
-        logger.warning("Failed to write data for %s tanks.", len(tank_data) - success_count)
-        logger.warning("Failed tanks: %s", failed_list)
+            loop.add_signal_handler(sig, scheduler.stop)
+        except NotImplementedError:
+            logger.debug("Signal handlers are not supported on this platform.")
+    query_server = None
+    if Settings.QUERY_SERVER:
+        site_poller.readings_index = ReadingsIndex.from_settings()
+        query_server = QueryServer(site_poller.readings_index,
+                                   host=Settings.QUERY_HOST,
+                                   port=Settings.QUERY_PORT,
+                                   socket_path=Settings.QUERY_SOCKET)
+        await query_server.start()
+    try:
+        await scheduler.run()
+    finally:
+        if query_server is not None:
+            await query_server.close()
+    logger.info("Scheduler stopped.")
 
 
 if __name__ == '__main__':
-    logger_formatter = logging.Formatter(
-        '%(levelname)s::%(module)s::%(filename)s::%(funcName)s::%(message)s'
-        )
-    stream_logger = logging.StreamHandler(sys.stdout)
-    file_logger = logging.FileHandler(
-        filename=f'{Settings.LOG_FOLDER}/log.log',
-        mode='w')
-    stream_logger.formatter = logger_formatter
-    file_logger.formatter = logger_formatter
+    pipeline = LogPipeline.from_settings()
+    pipeline.start()
     root_logger = logging.getLogger()
-    root_logger.addHandler(stream_logger)
-    root_logger.addHandler(file_logger)
-    root_logger.level = Settings.LOG_LEVEL
     root_logger.debug("Provided Arguments: %s", list(sys.argv))
     root_logger.debug("Log Folder: %s", Settings.LOG_FOLDER)
     root_logger.debug("Export Folder: %s", Settings.EXPORT_FOLDER)
-    asyncio.run(main())
-    root_logger.info("Process complete.")
+    try:
+        asyncio.run(main(pipeline))
+        root_logger.info("Process complete.")
+    finally:
+        pipeline.stop()
@@ -0,0 +1,16 @@
+'''Builds TLS console response frames for the tests'''
+from util.DataLoader.checksum import frame_checksum
+from util.Emulator.tls_emulator import TLSEmulator
+
+DATE = '2405161517'
+
+
+def build_frame(command: str, records: str, date: str = DATE) -> bytes:
+    '''A complete frame with a valid checksum'''
+    body = f"\x01{command}{date}{records}&&".encode()
+    return body + frame_checksum(body) + b'\x03'
+
+
+def emulator() -> TLSEmulator:
+    '''An emulator whose readings do not drift, so every tank reads BASE_READING'''
+    return TLSEmulator(tanks=3, drift=0, seed=0)
@@ -0,0 +1,118 @@
+'''Tests of the change detector'''
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from util.Models.tank_reading import SiteSnapshot, TankReading
+from util.Poller.change_detector import ChangeDetector
+
+
+def snapshot(volume: float = 1000.0, temperature: float = 60.0, reports: dict = None) -> SiteSnapshot:
+    '''A site with a single tank'''
+    tank = TankReading('01', '1', '0000', volume=volume, tc_volume=volume, ullage=500.0, height=40.0,
+                       water=0.0, temperature=temperature, water_volume=0.0)
+    return SiteSnapshot('2405161517', [tank], site='Site', reports=reports)
+
+
+class ChangeDetectorTest(unittest.TestCase):
+    '''Readings only count as changed once they move past their deadband'''
+    def setUp(self):
+        self.detector = ChangeDetector({'volume': 5, 'tc_volume': 5, 'temperature': 0.2})
+        self.detector.update(snapshot())
+
+    def test_new_site(self):
+        self.assertTrue(ChangeDetector().has_changed(snapshot()))
+
+    def test_within_deadband(self):
+        self.assertFalse(self.detector.has_changed(snapshot(volume=1004.0, temperature=60.1)))
+
+    def test_past_deadband(self):
+        self.assertTrue(self.detector.has_changed(snapshot(volume=1006.0)))
+        self.assertTrue(self.detector.has_changed(snapshot(temperature=60.3)))
+
+    def test_no_deadband(self):
+        changed = snapshot()
+        changed.tanks[0].height = 40.01
+        self.assertTrue(self.detector.has_changed(changed))
+
+    def test_none_fields(self):
+        missing = snapshot(volume=None)
+        self.assertTrue(self.detector.has_changed(missing))
+        self.detector.update(missing)
+        self.assertFalse(self.detector.has_changed(snapshot(volume=None)))
+        self.assertTrue(self.detector.has_changed(snapshot()))
+
+    def test_non_finite_fields(self):
+        self.assertTrue(self.detector.has_changed(snapshot(volume=float('nan'))))
+        self.detector.update(snapshot(volume=float('nan')))
+        self.assertTrue(self.detector.has_changed(snapshot(volume=5000.0)))
+        self.assertFalse(self.detector.has_changed(snapshot(volume=None)))
+        self.assertFalse(self.detector.has_changed(snapshot(volume=float('inf'))))
+
+    def test_tank_added(self):
+        changed = snapshot()
+        changed.tanks.append(TankReading('02', '1', '0000'))
+        self.assertTrue(self.detector.has_changed(changed))
+
+    def test_status_changed(self):
+        changed = snapshot()
+        changed.tanks[0].tank_status = '0001'
+        self.assertTrue(self.detector.has_changed(changed))
+
+    def test_reports(self):
+        alarms = {'alarms': [{'tank_number': '01', 'alarms': [{'alarm_type': '05'}]}]}
+        self.assertTrue(self.detector.has_changed(snapshot(reports=alarms)))
+        self.detector.update(snapshot(reports=alarms))
+        self.assertFalse(self.detector.has_changed(snapshot(reports=alarms)))
+
+    def test_heartbeat(self):
+        detector = ChangeDetector(heartbeat_interval=60)
+        detector.update(snapshot())
+        self.assertFalse(detector.has_changed(snapshot()))
+        detector.sites['Site']['written_at'] = time.time() - 61
+        self.assertTrue(detector.has_changed(snapshot()))
+
+
+class SavedStateTest(unittest.TestCase):
+    '''The last written readings compare the same after being saved and loaded again'''
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.file = os.path.join(self.folder.name, 'last_readings.json')
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_round_trip(self):
+        delivery = {'start': '2401010800', 'Starting Volume': 1000.5}
+        deliveries = {'deliveries': [{'tank_number': '01', 'deliveries': [delivery]}]}
+        detector = ChangeDetector(file=self.file)
+        detector.update(snapshot(volume=None, reports=deliveries))
+        detector.save()
+        loaded = ChangeDetector(file=self.file)
+        self.assertFalse(loaded.has_changed(snapshot(volume=None, reports=deliveries)))
+        self.assertTrue(loaded.has_changed(snapshot(volume=None)))
+
+    def test_read_only(self):
+        detector = ChangeDetector(file=self.file, read_only=True)
+        detector.update(snapshot())
+        detector.save()
+        self.assertFalse(os.path.exists(self.file))
+
+    def test_unreadable_file(self):
+        with open(self.file, mode='w', encoding='utf-8') as f:
+            f.write('{')
+        with self.assertLogs(level='WARNING'):
+            self.assertEqual(ChangeDetector(file=self.file).sites, {})
+
+    def test_saved_as_json(self):
+        detector = ChangeDetector(file=self.file)
+        detector.update(snapshot())
+        detector.save()
+        with open(self.file, encoding='utf-8') as f:
+            self.assertIn('Site', json.load(f))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+'''Tests of the response frame checksum'''
+import unittest
+
+from tests.frames import build_frame, emulator
+from util.DataLoader.checksum import checksum_valid, frame_end
+
+
+class ChecksumValidTest(unittest.TestCase):
+    '''checksum_valid() only accepts intact frames and the unrecognized command reply'''
+    def setUp(self):
+        self.frame = build_frame('i20100', emulator().build_records())
+
+    def test_valid_frame(self):
+        self.assertTrue(checksum_valid(self.frame))
+
+    def test_lowercase_checksum(self):
+        self.assertTrue(checksum_valid(self.frame[:-5] + self.frame[-5:-1].lower() + b'\x03'))
+
+    def test_garbled_record(self):
+        self.assertFalse(checksum_valid(self.frame.replace(b'459C4', b'459C5', 1)))
+
+    def test_garbled_record_and_trailer(self):
+        frame = self.frame.replace(b'459C4', b'459C5', 1).replace(b'&&', b'&7')
+        self.assertFalse(checksum_valid(frame))
+
+    def test_truncated_frame(self):
+        self.assertFalse(checksum_valid(self.frame[:60] + b'\x03'))
+
+    def test_short_checksum(self):
+        self.assertFalse(checksum_valid(self.frame[:-3] + b'\x03'))
+
+    def test_missing_start_character(self):
+        self.assertFalse(checksum_valid(self.frame[1:]))
+
+    def test_unrecognized_command_reply(self):
+        self.assertTrue(checksum_valid(b'\x019999FF1B\x03'))
+
+
+class FrameEndTest(unittest.TestCase):
+    '''frame_end() ends a frame at its end character or right after its checksum'''
+    def setUp(self):
+        self.frame = build_frame('i20100', emulator().build_records())
+
+    def test_complete_frame(self):
+        self.assertEqual(frame_end(self.frame + b'\x01i202'), len(self.frame))
+
+    def test_missing_end_character(self):
+        self.assertEqual(frame_end(self.frame[:-1]), len(self.frame) - 1)
+
+    def test_garbled_end_character(self):
+        self.assertEqual(frame_end(self.frame[:-1] + b'\x83\x01i202'), len(self.frame) - 1)
+
+    def test_incomplete_checksum(self):
+        self.assertEqual(frame_end(self.frame[:-3]), -1)
+
+    def test_truncated_checksum(self):
+        self.assertEqual(frame_end(self.frame[:-3] + b'\x03\x01i202'), len(self.frame) - 2)
+
+    def test_truncated_frame(self):
+        self.assertEqual(frame_end(self.frame[:60] + b'\x03' + self.frame), 61)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+'''Tests of the report decoders'''
+import unittest
+
+from tests.frames import DATE, build_frame, emulator
+from util.DataLoader.decoders import get_decoder
+from util.DataLoader.stream_parser import FrameParser
+from util.Emulator.tls_emulator import DELIVERY, LEAK_TEST
+from util.Exceptions.custom_exceptions import SimpleError
+from util.Models.tank_reading import SiteSnapshot
+
+
+class DecoderTest(unittest.TestCase):
+    '''Every registered report decodes the frames the emulator builds'''
+    def setUp(self):
+        self.emulator = emulator()
+
+    def decode(self, command: str, records: str) -> list:
+        '''Decodes a frame with the registered decoder, checking its date'''
+        date, decoded = get_decoder(command).decode(build_frame(command, records).decode(), command)
+        self.assertEqual(date, DATE)
+        return decoded
+
+    def test_deliveries(self):
+        records = self.decode('i20200', self.emulator.build_deliveries())
+        self.assertEqual(len(records), 3)
+        self.assertEqual(records[0]['tank_number'], '01')
+        delivery = records[0]['deliveries'][0]
+        self.assertEqual((delivery['start'], delivery['end']), ('2401010800', '2401010830'))
+        self.assertEqual(delivery['Starting Volume'], DELIVERY[0])
+        self.assertEqual(delivery['Ending Height'], DELIVERY[9])
+
+    def test_alarms(self):
+        records = self.decode('i20500', self.emulator.build_alarms())
+        self.assertEqual(records[0], {'tank_number': '01', 'alarms': [{'alarm_type': '05'}]})
+        self.assertEqual(records[1], {'tank_number': '02', 'alarms': []})
+
+    def test_leak_tests(self):
+        records = self.decode('i20700', self.emulator.build_leak_tests())
+        test = records[2]['tests'][0]
+        self.assertEqual(test['result'], 'P')
+        self.assertEqual((test['Leak Rate'], test['Test Volume'], test['Test Hours']), LEAK_TEST)
+
+    def test_non_finite_values(self):
+        records = self.emulator.build_leak_tests()
+        records = records[:18] + '7FC00000' + '7F800000' + records[34:]
+        test = self.decode('i20700', records)[0]['tests'][0]
+        self.assertIsNone(test['Leak Rate'])
+        self.assertIsNone(test['Test Volume'])
+        self.assertEqual(test['Test Hours'], LEAK_TEST[2])
+
+    def test_unrecognized_command(self):
+        with self.assertRaises(SimpleError):
+            get_decoder('i20200').decode('\x019999FF1B\x03', 'i20200')
+
+    def test_response_to_another_command(self):
+        with self.assertRaises(SimpleError):
+            get_decoder('i20500').decode(build_frame('i20200', self.emulator.build_deliveries()).decode(), 'i20500')
+
+    def test_malformed_record(self):
+        with self.assertRaises(SimpleError):
+            get_decoder('i20200').decode(build_frame('i20200', '0120ZZ').decode(), 'i20200')
+
+    def test_short_float_block(self):
+        # Whitespace inside the hex leaves too few bytes for the float fields
+        records = '012012401010200P03' + '00000000459C4000'.ljust(24)
+        with self.assertRaises(SimpleError):
+            get_decoder('i20700').decode(build_frame('i20700', records).decode(), 'i20700')
+
+    def test_unknown_command(self):
+        with self.assertRaises(SimpleError):
+            get_decoder('i99900')
+
+    def test_frame_parser(self):
+        parser = get_decoder('i20500').create_parser(None, 'i20500')
+        self.assertIsInstance(parser, FrameParser)
+        for byte in build_frame('i20500', self.emulator.build_alarms()):
+            parser.feed(bytes([byte]))
+        self.assertTrue(parser.done)
+        self.assertTrue(parser.verify())
+        snapshot = SiteSnapshot(None)
+        parser.apply(snapshot)
+        self.assertEqual(snapshot.date, DATE)
+        self.assertEqual(len(snapshot.reports['alarms']), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
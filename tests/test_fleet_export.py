@@ -0,0 +1,73 @@
+'''Tests of the consolidated fleet export'''
+import asyncio
+import os
+import tempfile
+import unittest
+
+import main
+from conf import Settings
+from util.DataLoader.data_loader import DataLoader
+from util.Models.tank_reading import SiteSnapshot, TankReading
+from util.Poller.site_poller import SitePoller, SweepSummary
+
+
+def snapshot(site: str, volume: float) -> SiteSnapshot:
+    '''A site with a single tank'''
+    return SiteSnapshot('2405161517', [TankReading('01', '1', '0000', volume=volume, ullage=100.0)], site=site,
+                        reports={'alarms': [{'tank_number': '01', 'alarms': []}]})
+
+
+class FleetExportTest(unittest.TestCase):
+    '''Sites that did not answer keep their last entry in the export, as they do in daemon mode'''
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.settings = Settings.FLEET_EXPORT_FILE, Settings.FLEET_EXPORT_FORMAT
+        Settings.FLEET_EXPORT_FILE = os.path.join(self.folder.name, 'fleet.ndjson')
+        Settings.FLEET_EXPORT_FORMAT = 'ndjson'
+        self.data_loader = DataLoader()
+
+    def tearDown(self):
+        Settings.FLEET_EXPORT_FILE, Settings.FLEET_EXPORT_FORMAT = self.settings
+        self.folder.cleanup()
+
+    def sweep(self, snapshots: list, sites: list) -> None:
+        '''Finishes a sweep in which the given snapshots were written'''
+        summary = SweepSummary(total=len(sites))
+        for fresh in snapshots:
+            summary.record_written(fresh.site)
+            summary.record_success(fresh.site, fresh)
+
+        async def finish():
+            site_poller = SitePoller(self.data_loader, None)
+            await main.finish_sweep(site_poller, summary, [{'Location': site} for site in sites])
+            await site_poller.writer.close()
+
+        with self.assertLogs(level='INFO'):
+            asyncio.run(finish())
+
+    def exported(self) -> dict:
+        '''The snapshots in the export, by site'''
+        return {entry.site: entry.to_dict() for entry in
+                self.data_loader.read_fleet_export(Settings.FLEET_EXPORT_FILE, Settings.FLEET_EXPORT_FORMAT)}
+
+    def test_round_trip(self):
+        for file_format in ('ndjson', 'json'):
+            self.data_loader.write_fleet_export([snapshot('A', 50.0)], Settings.FLEET_EXPORT_FILE, file_format)
+            self.assertEqual(self.data_loader.read_fleet_export(Settings.FLEET_EXPORT_FILE, file_format)[0].to_dict(),
+                             snapshot('A', 50.0).to_dict())
+
+    def test_missing_site_keeps_last_entry(self):
+        self.sweep([snapshot('A', 50.0), snapshot('B', 60.0)], ['A', 'B'])
+        self.sweep([snapshot('A', 55.0)], ['A', 'B'])
+        exported = self.exported()
+        self.assertEqual(exported['A'], snapshot('A', 55.0).to_dict())
+        self.assertEqual(exported['B'], snapshot('B', 60.0).to_dict())
+
+    def test_removed_site_is_dropped(self):
+        self.sweep([snapshot('A', 50.0), snapshot('B', 60.0)], ['A', 'B'])
+        self.sweep([snapshot('A', 55.0)], ['A'])
+        self.assertEqual(list(self.exported()), ['A'])
+
+
+if __name__ == '__main__':
+    unittest.main()
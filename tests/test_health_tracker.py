@@ -0,0 +1,86 @@
+'''Tests of the circuit breaker and retry budget'''
+import time
+import unittest
+
+from util.Poller.health_tracker import HealthTracker, RetryBudget
+
+
+class HealthTrackerTest(unittest.TestCase):
+    '''Circuits open after failure_threshold failures in a row and close after a successful probe'''
+    def setUp(self):
+        self.tracker = HealthTracker(failure_threshold=3, probe_interval=60, max_probe_interval=200)
+
+    def record_failures(self, times: int) -> None:
+        '''Records failures of the site'''
+        for _ in range(times):
+            self.tracker.record_failure('Site', 'refused')
+
+    def test_closed_below_threshold(self):
+        self.record_failures(2)
+        self.assertTrue(self.tracker.allow('Site'))
+        self.assertEqual(self.tracker.failures('Site'), 2)
+
+    def test_opens_at_threshold(self):
+        with self.assertLogs(level='WARNING'):
+            self.record_failures(3)
+        self.assertFalse(self.tracker.allow('Site'))
+        self.assertEqual(self.tracker.sites['Site']['last_error'], 'refused')
+
+    def test_probe_once_due(self):
+        with self.assertLogs(level='WARNING'):
+            self.record_failures(3)
+        self.tracker.sites['Site']['next_probe'] = time.time() - 1
+        with self.assertLogs(level='INFO'):
+            self.assertTrue(self.tracker.allow('Site'))
+
+    def test_failed_probes_back_off(self):
+        with self.assertLogs(level='WARNING'):
+            self.record_failures(3)
+        first = self.tracker.sites['Site']['next_probe'] - time.time()
+        self.record_failures(1)
+        second = self.tracker.sites['Site']['next_probe'] - time.time()
+        self.record_failures(5)
+        longest = self.tracker.sites['Site']['next_probe'] - time.time()
+        self.assertAlmostEqual(first, 60, delta=1)
+        self.assertAlmostEqual(second, 120, delta=1)
+        self.assertAlmostEqual(longest, 200, delta=1)
+
+    def test_success_closes(self):
+        with self.assertLogs(level='WARNING'):
+            self.record_failures(3)
+        with self.assertLogs(level='INFO'):
+            self.tracker.record_success('Site')
+        self.assertTrue(self.tracker.allow('Site'))
+        self.assertEqual(self.tracker.failures('Site'), 0)
+
+    def test_success_resets_count(self):
+        self.record_failures(2)
+        self.tracker.record_success('Site')
+        self.record_failures(2)
+        self.assertTrue(self.tracker.allow('Site'))
+
+
+class RetryBudgetTest(unittest.TestCase):
+    '''Only sites that were healthy before the sweep are retried, once each, within the budget'''
+    def test_budget(self):
+        budget = RetryBudget(2)
+        self.assertTrue(budget.take('A', 0))
+        self.assertTrue(budget.take('B', 0))
+        self.assertFalse(budget.take('C', 0))
+
+    def test_once_per_site(self):
+        budget = RetryBudget(2)
+        self.assertTrue(budget.take('A', 0))
+        self.assertFalse(budget.take('A', 0))
+
+    def test_failing_sites_are_not_retried(self):
+        budget = RetryBudget(2)
+        self.assertFalse(budget.take('A', 1))
+        self.assertEqual(budget.retries, 2)
+
+    def test_no_budget(self):
+        self.assertFalse(RetryBudget(0).take('A', 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,242 @@
+'''Tests of the poll scheduler'''
+import asyncio
+import time
+import unittest
+
+from util.Poller.health_tracker import HealthTracker
+from util.Registry.site_registry import SiteChanges
+from util.Scheduler.poll_scheduler import PollScheduler, SiteSchedule
+
+
+class BackoffTest(unittest.TestCase):
+    '''Failing sites back off up to max_backoff but never poll more often than their interval'''
+    def setUp(self):
+        self.scheduler = PollScheduler(None, [], default_interval=900, jitter=0, max_backoff=3600)
+
+    def delay(self, interval: float, failures: int) -> float:
+        '''Delay before the next poll of a site with the given interval and failures in a row'''
+        schedule = SiteSchedule({'Location': 'Site'}, interval)
+        schedule.consecutive_failures = failures
+        return self.scheduler._next_delay(schedule)
+
+    def test_no_failures(self):
+        self.assertEqual(self.delay(900, 0), 900)
+
+    def test_doubles_after_failures(self):
+        self.assertEqual(self.delay(900, 1), 1800)
+
+    def test_capped_at_max_backoff(self):
+        self.assertEqual(self.delay(900, 5), 3600)
+
+    def test_interval_above_max_backoff(self):
+        self.assertEqual(self.delay(7200, 1), 7200)
+
+    def test_many_failures_with_float_interval(self):
+        self.assertEqual(self.delay(900.5, 5000), 3600)
+
+
+class FailingPoller:
+    '''Site poller whose polls raise an error the scheduler does not expect'''
+    def __init__(self):
+        self.polls = 0
+
+    async def bounded_poll_site(self, site: dict, summary) -> bool:
+        '''Counts the poll and fails it'''
+        self.polls += 1
+        raise OSError(113, 'No route to host')
+
+
+class UnexpectedErrorTest(unittest.TestCase):
+    '''An unexpected error fails the poll but keeps the site scheduled'''
+    def test_site_stays_scheduled(self):
+        poller = FailingPoller()
+        scheduler = PollScheduler(poller, [{'Location': 'Site', 'Interval': 0.05}], default_interval=0.05,
+                                  jitter=0, max_backoff=0.05, report_interval=60)
+
+        async def run_briefly():
+            asyncio.get_running_loop().call_later(0.5, scheduler.stop)
+            with self.assertLogs(level='ERROR'):
+                await scheduler.run()
+
+        asyncio.run(run_briefly())
+        self.assertGreater(poller.polls, 2)
+        self.assertEqual(scheduler.schedules['Site'].consecutive_failures, poller.polls)
+
+
+class OpenCircuitPoller:
+    '''Site poller whose site is always skipped with an open circuit'''
+    def __init__(self):
+        self.polls = 0
+
+    async def bounded_poll_site(self, site: dict, summary) -> None:
+        '''Counts the poll and skips it'''
+        self.polls += 1
+        summary.record_circuit_open(site['Location'])
+        return None
+
+
+class OpenCircuitTest(unittest.TestCase):
+    '''A site skipped with an open circuit keeps its interval rather than backing off'''
+    def test_no_backoff(self):
+        poller = OpenCircuitPoller()
+        scheduler = PollScheduler(poller, [{'Location': 'Site', 'Interval': 0.05}], default_interval=0.05,
+                                  jitter=0, max_backoff=60, report_interval=60)
+
+        async def run_briefly():
+            asyncio.get_running_loop().call_later(0.5, scheduler.stop)
+            with self.assertLogs(level='INFO'):
+                await scheduler.run()
+
+        asyncio.run(run_briefly())
+        self.assertGreater(poller.polls, 2)
+        self.assertEqual(scheduler.schedules['Site'].consecutive_failures, 0)
+
+
+class SlowPoller:
+    '''Site poller whose polls succeed once they are released'''
+    def __init__(self):
+        self.started = asyncio.Event()
+        self.release = asyncio.Event()
+        self.forgotten = []
+
+    async def bounded_poll_site(self, site: dict, summary) -> bool:
+        '''Waits to be released and records the site as polled'''
+        self.started.set()
+        await self.release.wait()
+        summary.record_success(site['Location'], 'snapshot')
+        return True
+
+    async def forget(self, site: dict) -> None:
+        '''Records the site'''
+        self.forgotten.append(site['Location'])
+
+
+class ReportTest(unittest.TestCase):
+    '''A poll still running at report time is counted in the next report'''
+    def test_poll_across_report(self):
+        async def run():
+            poller = SlowPoller()
+            scheduler = PollScheduler(poller, [{'Location': 'Site', 'Interval': 60}], default_interval=60,
+                                      jitter=0, report_interval=60)
+            scheduler.schedules['Site'].next_run = time.monotonic()
+            scheduler.schedules['Site'].missed_deadlines = 2
+            task = asyncio.create_task(scheduler.run())
+            await poller.started.wait()
+            with self.assertLogs(level='INFO') as logs:
+                await scheduler.report()
+            self.assertIn("Missed deadlines: 2", logs.output[0])
+            self.assertEqual(scheduler.schedules['Site'].missed_deadlines, 0)
+            poller.release.set()
+            await asyncio.sleep(0.01)
+            self.assertEqual(scheduler.summary.succeeded_list, ['Site'])
+            self.assertEqual(scheduler.summary.snapshots, {'Site': 'snapshot'})
+            scheduler.stop()
+            with self.assertLogs(level='INFO'):
+                await task
+            self.assertEqual(scheduler.latest_snapshots, {'Site': 'snapshot'})
+
+        asyncio.run(run())
+
+    def test_removed_while_polling(self):
+        async def run():
+            poller = SlowPoller()
+            scheduler = PollScheduler(poller, [{'Location': 'Site', 'Interval': 60}], default_interval=60,
+                                      jitter=0, report_interval=60)
+            scheduler.schedules['Site'].next_run = time.monotonic()
+            task = asyncio.create_task(scheduler.run())
+            await poller.started.wait()
+            with self.assertLogs(level='INFO'):
+                await scheduler.apply(SiteChanges([], [{'Location': 'Site'}], []))
+            self.assertEqual(len(scheduler.finishing), 1)
+            poller.release.set()
+            await asyncio.sleep(0.01)
+            self.assertEqual(poller.forgotten, ['Site'])
+            self.assertEqual(scheduler.finishing, set())
+            scheduler.stop()
+            with self.assertLogs(level='INFO'):
+                await task
+
+        asyncio.run(run())
+
+
+class RecordingConnector:
+    '''Telnet connector that records the sessions it is asked to discard'''
+    def __init__(self):
+        self.discarded = []
+
+    async def discard(self, host: str, port: int) -> None:
+        '''Records the address'''
+        self.discarded.append((host, port))
+
+
+class RecordingPoller:
+    '''Site poller that records the sites it is asked to forget'''
+    def __init__(self):
+        self.telnet_connector = RecordingConnector()
+        self.health_tracker = HealthTracker()
+        self.forgotten = []
+
+    async def forget(self, site: dict) -> None:
+        '''Records the site'''
+        self.forgotten.append(site['Location'])
+
+
+def site(number: int, **changes) -> dict:
+    '''An entry of the site file'''
+    return dict({'Location': f'Site {number}', 'Host': '127.0.0.1', 'Port': 10000 + number}, **changes)
+
+
+class ApplyTest(unittest.TestCase):
+    '''apply() only starts, stops and updates the sites that changed'''
+    def setUp(self):
+        self.poller = RecordingPoller()
+        self.scheduler = PollScheduler(self.poller, [site(1), site(2), site(3)], default_interval=900, jitter=0)
+
+    def apply(self, changes: SiteChanges) -> None:
+        '''Applies the changes to the scheduler with every site waiting for its next poll'''
+        async def run():
+            self.scheduler.stop_event = asyncio.Event()
+            for schedule in self.scheduler.schedules.values():
+                self.scheduler._start(schedule)
+            self.tasks = dict(self.scheduler.tasks)
+            with self.assertLogs(level='INFO'):
+                await self.scheduler.apply(changes)
+            await asyncio.sleep(0)
+            self.cancelled = {location for location, task in self.tasks.items() if task.cancelled()}
+            self.scheduler.stop()
+            await asyncio.gather(*self.scheduler.tasks.values())
+
+        asyncio.run(run())
+
+    def test_added_and_removed(self):
+        self.scheduler.latest_snapshots['Site 3'] = object()
+        self.apply(SiteChanges([site(4)], [site(3)], []))
+        self.assertEqual(sorted(self.scheduler.schedules), ['Site 1', 'Site 2', 'Site 4'])
+        self.assertEqual(sorted(self.scheduler.tasks), ['Site 1', 'Site 2', 'Site 4'])
+        self.assertEqual(self.cancelled, {'Site 3'})
+        self.assertEqual(self.poller.forgotten, ['Site 3'])
+        self.assertNotIn('Site 3', self.scheduler.latest_snapshots)
+        self.assertEqual(self.scheduler.summary.total, 3)
+
+    def test_moved_site(self):
+        self.poller.health_tracker.record_failure('Site 2', 'refused')
+        self.scheduler.schedules['Site 2'].consecutive_failures = 1
+        self.apply(SiteChanges([], [], [(site(2), site(2, Port=10009))]))
+        self.assertEqual(self.poller.telnet_connector.discarded, [('127.0.0.1', 10002)])
+        self.assertEqual(self.poller.health_tracker.failures('Site 2'), 0)
+        self.assertEqual(self.scheduler.schedules['Site 2'].consecutive_failures, 0)
+        self.assertEqual(self.scheduler.schedules['Site 2'].site['Port'], 10009)
+        # The task keeps running and picks up the new address on its next poll
+        self.assertEqual(self.cancelled, set())
+
+    def test_new_interval(self):
+        self.apply(SiteChanges([], [], [(site(1), site(1, Interval=60))]))
+        schedule = self.scheduler.schedules['Site 1']
+        self.assertEqual(schedule.interval, 60)
+        self.assertEqual(self.cancelled, {'Site 1'})
+        self.assertIsNot(self.scheduler.tasks['Site 1'], self.tasks['Site 1'])
+        self.assertEqual(self.poller.telnet_connector.discarded, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+'''Tests of the in-memory readings index'''
+import json
+import unittest
+
+from util.Models.tank_reading import SiteSnapshot, TankReading
+from util.Query.query_server import QueryServer
+from util.Query.readings_index import ReadingsIndex
+
+
+def snapshot(volume: float, water: float = 0.0) -> SiteSnapshot:
+    '''A site with a single tank of product 1'''
+    tank = TankReading('01', '1', '0000', volume=volume, tc_volume=volume, ullage=100.0, water=water)
+    return SiteSnapshot('2405161517', [tank], site='Site')
+
+
+class NonFiniteReadingTest(unittest.TestCase):
+    '''NaN and infinite readings are left out of the totals and answers stay valid JSON'''
+    def setUp(self):
+        self.index = ReadingsIndex(water_alarm_level=2.0)
+
+    def totals(self) -> dict:
+        '''The totals query, parsed as strict JSON'''
+        return json.loads(self.index.answer_json('totals'), parse_constant=self.fail)
+
+    def test_totals_recover(self):
+        self.index.update(snapshot(float('nan')))
+        self.assertEqual(self.totals()['1']['volume'], 0.0)
+        self.index.update(snapshot(50.0))
+        self.assertEqual(self.totals()['1']['volume'], 50.0)
+
+    def test_infinite_reading(self):
+        self.index.update(snapshot(float('inf'), water=3.0))
+        self.assertEqual(self.totals()['1']['volume'], 0.0)
+        listing = json.loads(self.index.answer_json('water-alarms'), parse_constant=self.fail)
+        self.assertIsNone(listing['tanks'][0]['volume'])
+        self.index.remove('Site')
+        self.assertEqual(self.totals(), {})
+
+    def test_site_readings(self):
+        self.index.update(snapshot(float('nan'), water=float('-inf')))
+        status, body = QueryServer(self.index).route('GET', '/sites/Site')
+        self.assertEqual(status, 200)
+        tank = json.loads(body, parse_constant=self.fail)['data'][0]
+        self.assertIsNone(tank['Volume'])
+        self.assertIsNone(tank['Water'])
+        self.assertEqual(tank['Ullage'], 100.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
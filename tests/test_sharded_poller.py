@@ -0,0 +1,22 @@
+'''Tests of splitting a sweep across worker processes'''
+import unittest
+
+from util.Poller.sharded_poller import ShardedPoller
+
+
+class SplitRetriesTest(unittest.TestCase):
+    '''The retry budget of the whole sweep is shared out between the shards'''
+    def test_budget_smaller_than_shards(self):
+        self.assertEqual(ShardedPoller.split_retries(1, 4), [1, 0, 0, 0])
+
+    def test_budget_is_kept(self):
+        retries = ShardedPoller.split_retries(10, 4)
+        self.assertEqual(retries, [3, 3, 2, 2])
+        self.assertEqual(sum(retries), 10)
+
+    def test_no_budget(self):
+        self.assertEqual(ShardedPoller.split_retries(0, 3), [0, 0, 0])
+
+
+if __name__ == '__main__':
+    unittest.main()
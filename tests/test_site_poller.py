@@ -0,0 +1,51 @@
+'''Tests of the site poller's failure handling'''
+import asyncio
+import socket
+import unittest
+
+from util.DataLoader.data_loader import DataLoader
+from util.Poller.health_tracker import HealthTracker
+from util.Poller.site_poller import SitePoller, SweepSummary
+from util.TelnetConnetor.telnet_connector import TelnetConnector
+
+
+def closed_port() -> int:
+    '''A local port nothing listens on, so connections to it are refused'''
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class RefusedSiteTest(unittest.TestCase):
+    '''A site that fails again after its retry counts as one failure of the sweep'''
+    def setUp(self):
+        self.health = HealthTracker(failure_threshold=2)
+        self.poller = SitePoller(DataLoader(), TelnetConnector(connect_timeout=1),
+                                 health_tracker=self.health, retry_fraction=1.0, retry_delay=0)
+        self.site = {'Location': 'Site', 'Host': '127.0.0.1', 'Port': closed_port(),
+                     'Command': 'i20100', 'Transport': 'raw'}
+
+    def sweep(self):
+        '''Polls the site once, returning the summary'''
+        with self.assertLogs(level='ERROR'):
+            return asyncio.run(self.poller.sweep([self.site]))
+
+    def test_one_failure_per_sweep(self):
+        summary = self.sweep()
+        self.assertEqual(summary.failed_list, ['Site'])
+        self.assertEqual(self.health.failures('Site'), 1)
+        self.assertTrue(self.health.allow('Site'))
+
+    def test_circuit_opens_after_threshold_sweeps(self):
+        self.sweep()
+        self.sweep()
+        self.assertEqual(self.health.failures('Site'), 2)
+        self.assertFalse(self.health.allow('Site'))
+        summary = SweepSummary()
+        with self.assertLogs(level='INFO'):
+            self.assertIsNone(asyncio.run(self.poller.poll_site(self.site, summary)))
+        self.assertEqual(summary.circuit_open_list, ['Site'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+'''Tests of the site registry'''
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from util.Exceptions.custom_exceptions import CriticalError
+from util.Registry.site_registry import SiteRegistry
+
+
+def site(number: int, **changes) -> dict:
+    '''A valid entry of the site file. It uses the raw transport, which does not need telnetlib3'''
+    return dict({'Location': f'Site {number}', 'Host': '127.0.0.1', 'Port': 10000 + number, 'Command': 'i20100',
+                 'Transport': 'raw'}, **changes)
+
+
+class ValidateTest(unittest.TestCase):
+    '''validate() names every problem in the site file'''
+    def setUp(self):
+        self.registry = SiteRegistry(None)
+
+    def test_valid(self):
+        sites = [site(1), site(2, Commands=['i20100', 'i20200'], Interval=60)]
+        self.assertEqual(self.registry.validate(sites), [])
+
+    def test_not_a_list(self):
+        self.assertEqual(len(self.registry.validate({'Location': 'Site 1'})), 1)
+        self.assertEqual(len(self.registry.validate([])), 1)
+
+    def test_duplicate_location(self):
+        errors = self.registry.validate([site(1), site(2, Location='Site 1')])
+        self.assertEqual(errors, ["Site 2 (Site 1): Location is already used by site 1"])
+
+    def test_duplicate_address(self):
+        errors = self.registry.validate([site(1), site(2, Port=10001)])
+        self.assertEqual(errors, ["Site 2 (Site 2): 127.0.0.1:10001 is already used by site 1"])
+
+    def test_types(self):
+        self.assertEqual(len(self.registry.validate([site(1, Port='10001')])), 1)
+        self.assertEqual(len(self.registry.validate([site(1, Port=True)])), 1)
+        self.assertEqual(len(self.registry.validate([site(1, Port=70000)])), 1)
+        self.assertEqual(len(self.registry.validate([site(1, Host='')])), 1)
+        self.assertEqual(len(self.registry.validate([site(1, Interval=0)])), 1)
+        self.assertEqual(len(self.registry.validate([site(1, Interval=False)])), 1)
+        self.assertEqual(len(self.registry.validate([site(1, Transport='serial')])), 1)
+        self.assertEqual(len(self.registry.validate(['Site 1'])), 1)
+
+    def test_telnet_without_telnetlib3(self):
+        with mock.patch('util.Registry.site_registry.telnet_available', return_value=False):
+            self.assertEqual(self.registry.validate([site(1)]), [])
+            self.assertEqual(len(self.registry.validate([site(1), site(2, Transport='telnet')])), 1)
+        with mock.patch('util.Registry.site_registry.telnet_available', return_value=True):
+            self.assertEqual(self.registry.validate([site(1), site(2, Transport='telnet')]), [])
+
+    def test_unknown_command(self):
+        self.assertEqual(len(self.registry.validate([site(1, Command='i99900')])), 1)
+        self.assertEqual(len(self.registry.validate([site(1, Commands='i20100')])), 1)
+
+
+class DiffTest(unittest.TestCase):
+    '''diff() sorts the sites of a new file into added, removed and changed by location'''
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.file = os.path.join(self.folder.name, 'sites.json')
+        self.write([site(1), site(2), site(3)])
+        self.registry = SiteRegistry(self.file)
+        with self.assertLogs(level='INFO'):
+            self.registry.load()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def write(self, sites) -> None:
+        '''Replaces the site file, making sure its modification time changes'''
+        with open(self.file, mode='w', encoding='utf-8') as f:
+            json.dump(sites, f)
+        stat = os.stat(self.file)
+        os.utime(self.file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    def test_diff(self):
+        changes = self.registry.diff([site(1), site(2, Port=10009), site(4)])
+        self.assertEqual(changes.added, [site(4)])
+        self.assertEqual(changes.removed, [site(3)])
+        self.assertEqual(changes.changed, [(site(2), site(2, Port=10009))])
+
+    def test_no_changes(self):
+        self.assertFalse(self.registry.diff([site(3), site(1), site(2)]))
+        self.assertFalse(self.registry.reload())
+
+    def test_reload(self):
+        self.write([site(1), site(2, Interval=60)])
+        with self.assertLogs(level='INFO'):
+            changes = self.registry.reload()
+        self.assertEqual((len(changes.added), len(changes.removed), len(changes.changed)), (0, 1, 1))
+        self.assertEqual(self.registry.by_location['Site 2']['Interval'], 60)
+        self.assertEqual([entry['Location'] for entry in self.registry.by_host['127.0.0.1']], ['Site 1', 'Site 2'])
+
+    def test_reload_invalid_file(self):
+        self.write([site(1), site(2, Port=10001)])
+        with self.assertLogs(level='ERROR') as logs:
+            self.assertFalse(self.registry.reload())
+        self.assertFalse(any(record.levelname == 'CRITICAL' for record in logs.records))
+        self.assertEqual(len(self.registry.sites), 3)
+
+    def test_reload_broken_json(self):
+        with open(self.file, mode='a', encoding='utf-8') as f:
+            f.write(',')
+        with self.assertLogs(level='ERROR') as logs:
+            self.assertFalse(self.registry.reload())
+        self.assertFalse(any(record.levelname == 'CRITICAL' for record in logs.records))
+        # The same broken file is not reported again
+        self.assertFalse(self.registry.reload())
+
+
+class LoadTest(unittest.TestCase):
+    '''load() reports every problem with the site file, not just the first'''
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.file = os.path.join(self.folder.name, 'sites.json')
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def load(self, content: str) -> list:
+        '''Loads a site file with the content and returns the logged messages'''
+        with open(self.file, mode='w', encoding='utf-8') as f:
+            f.write(content)
+        with self.assertLogs(level='ERROR') as logs:
+            with self.assertRaises(CriticalError):
+                SiteRegistry(self.file).load()
+        return [record.getMessage() for record in logs.records]
+
+    def test_every_problem(self):
+        missing_port = site(2)
+        del missing_port['Port']
+        messages = self.load(json.dumps([site(1), missing_port, site(3, Port=70000),
+                                         site(4, Location='Site 1', Command='i99900')]))
+        self.assertEqual(len(messages), 4)
+        self.assertIn("Site 2 (Site 2): Port", messages[0])
+        self.assertIn("Site 3 (Site 3): Port", messages[1])
+
+    def test_broken_json(self):
+        messages = self.load('[')
+        self.assertEqual(len(messages), 1)
+        self.assertIn("not a valid JSON file", messages[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+'''Tests of the incremental i20100 parser'''
+import unittest
+
+from tests.frames import DATE, build_frame, emulator
+from util.DataLoader.data_loader import DataLoader
+from util.DataLoader.stream_parser import StreamParser
+from util.Emulator.tls_emulator import BASE_READING
+from util.Exceptions.custom_exceptions import SimpleError
+from util.Models.tank_reading import SiteSnapshot
+
+
+def feed_bytes(parser: StreamParser, frame: bytes) -> list:
+    '''Feeds a frame one byte at a time and returns every tank the parser completed'''
+    tanks = []
+    for index in range(len(frame)):
+        tanks.extend(parser.feed(frame[index:index + 1]))
+    return tanks
+
+
+class StreamParserTest(unittest.TestCase):
+    '''StreamParser decodes frames however they are split and flags the ones it cannot trust'''
+    def setUp(self):
+        self.parser = StreamParser(DataLoader(), 'i20100')
+        self.frame = build_frame('i20100', emulator().build_records())
+
+    def test_whole_frame(self):
+        tanks = self.parser.feed(self.frame)
+        self.assertTrue(self.parser.done)
+        self.assertTrue(self.parser.verify())
+        self.assertEqual(self.parser.date, DATE)
+        self.assertEqual([tank.tank_number for tank in tanks], ['01', '02', '03'])
+        self.assertEqual(tanks[0].volume, BASE_READING[0])
+
+    def test_byte_at_a_time(self):
+        tanks = feed_bytes(self.parser, self.frame)
+        self.assertTrue(self.parser.done)
+        self.assertTrue(self.parser.verify())
+        self.assertEqual(self.parser.date, DATE)
+        self.assertEqual([tank.to_dict() for tank in tanks],
+                         [tank.to_dict() for tank in StreamParser(DataLoader(), 'i20100').feed(self.frame)])
+
+    def test_noise_in_record(self):
+        index = self.frame.index(b'459C4')
+        frame = self.frame[:index] + b'\xff' + self.frame[index + 1:]
+        tanks = feed_bytes(self.parser, frame)
+        self.assertTrue(self.parser.done)
+        self.assertIsNone(tanks[0].volume)
+        self.assertEqual(tanks[1].volume, BASE_READING[0])
+        self.assertFalse(self.parser.verify())
+        with self.assertRaises(SimpleError):
+            self.parser.apply(SiteSnapshot(None))
+
+    def test_non_finite_fields(self):
+        records = emulator().build_records()
+        # Volume of the first tank is NaN and its ullage is infinite
+        records = records[:9] + '7FC00000' + records[17:25] + '7F800000' + records[33:]
+        tanks = self.parser.feed(build_frame('i20100', records))
+        self.assertIsNone(tanks[0].volume)
+        self.assertIsNone(tanks[0].ullage)
+        self.assertEqual(tanks[0].tc_volume, BASE_READING[1])
+        self.assertTrue(SiteSnapshot(None, tanks).has_malformed_fields())
+        self.assertEqual(tanks[1].volume, BASE_READING[0])
+
+    def test_noise_in_date(self):
+        index = self.frame.index(DATE.encode())
+        self.parser.feed(self.frame[:index] + b'\xfe' + self.frame[index + 1:])
+        self.assertTrue(self.parser.done)
+        self.assertFalse(self.parser.verify())
+
+    def test_garbled_end_character(self):
+        tanks = feed_bytes(self.parser, self.frame[:-1] + b'\x83')
+        self.assertTrue(self.parser.done)
+        self.assertTrue(self.parser.verify())
+        self.assertEqual(len(tanks), 3)
+
+    def test_frame_end_after_checksum(self):
+        second = build_frame('i20100', emulator().build_records())
+        self.assertEqual(self.parser.frame_end(self.frame[:-1] + b'\x83' + second), len(self.frame) - 1)
+        self.parser.feed(self.frame[:-3])
+        self.assertFalse(self.parser.done)
+        self.assertEqual(self.parser.frame_end(self.frame[-3:-1]), 2)
+        self.assertEqual(self.parser.frame_end(self.frame[-3:]), 3)
+
+    def test_truncated_frame(self):
+        self.parser.feed(self.frame[:60] + b'\x03')
+        self.assertFalse(self.parser.done)
+        self.assertFalse(self.parser.verify())
+        snapshot = SiteSnapshot(None)
+        with self.assertRaises(SimpleError):
+            self.parser.apply(snapshot)
+        self.assertIsNone(snapshot.date)
+
+    def test_response_to_another_command(self):
+        with self.assertRaises(SimpleError):
+            feed_bytes(self.parser, build_frame('i20200', emulator().build_deliveries()))
+
+    def test_unrecognized_command(self):
+        with self.assertRaisesRegex(SimpleError, 'not recognized'):
+            feed_bytes(self.parser, b'\x019999FF1B\x03')
+
+    def test_reset(self):
+        self.parser.feed(self.frame.replace(b'459C4', b'459C5', 1))
+        self.assertFalse(self.parser.verify())
+        self.parser.reset()
+        self.parser.feed(self.frame)
+        self.assertTrue(self.parser.verify())
+        self.assertEqual((self.parser.frames, self.parser.corrupt_frames), (2, 1))
+        snapshot = SiteSnapshot(None)
+        self.parser.apply(snapshot)
+        self.assertEqual(snapshot.date, DATE)
+        self.assertEqual(len(snapshot.tanks), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,203 @@
+'''Tests of the telnet connector's reads'''
+import asyncio
+import sys
+import unittest
+from unittest import mock
+
+from tests.frames import build_frame, emulator
+from util.DataLoader.data_loader import DataLoader
+from util.DataLoader.decoders import get_decoder
+from util.Enums.transport import Transport
+from util.Exceptions.custom_exceptions import CriticalError, SimpleError
+from util.TelnetConnetor.telnet_connector import TelnetConnector
+
+
+class FailingReader:
+    '''Stream reader whose reads fail with the given error'''
+    def __init__(self, error: Exception):
+        self.error = error
+
+    async def read(self, size: int) -> bytes:
+        '''Raises the error'''
+        raise self.error
+
+
+class FailingSession:
+    '''Session to a host that has become unreachable'''
+    def __init__(self, error: Exception):
+        self.host = '192.0.2.1'
+        self.port = 10001
+        self.reader = FailingReader(error)
+
+
+class ReadChunkTest(unittest.TestCase):
+    '''Read errors fail only the site being read, as SimpleError'''
+    def read(self, error: Exception):
+        '''Reads a chunk from a session whose reads raise the error'''
+        connector = TelnetConnector(read_timeout=1)
+        with self.assertLogs(level='ERROR'):
+            asyncio.run(connector._read_chunk(FailingSession(error), None))
+
+    def test_unreachable(self):
+        with self.assertRaises(SimpleError):
+            self.read(OSError(113, 'No route to host'))
+
+    def test_aborted(self):
+        with self.assertRaises(SimpleError):
+            self.read(ConnectionAbortedError())
+
+    def test_broken_pipe(self):
+        with self.assertRaises(SimpleError):
+            self.read(BrokenPipeError())
+
+    def test_reset(self):
+        with self.assertRaisesRegex(SimpleError, 'reset'):
+            self.read(ConnectionResetError())
+
+
+class MissingTelnetlib3Test(unittest.TestCase):
+    '''A telnet session without telnetlib3 installed stops the run instead of failing every site'''
+    def test_open_connection(self):
+        connector = TelnetConnector(connect_timeout=1)
+        with mock.patch.dict(sys.modules, {'telnetlib3': None}):
+            with self.assertLogs(level='CRITICAL'):
+                with self.assertRaisesRegex(CriticalError, 'telnetlib3'):
+                    asyncio.run(connector.open_connection('192.0.2.1', 10001, Transport.TELNET))
+
+
+class ScriptedStreams:
+    '''
+    Reader and writer of a console that answers each send with the next scripted reply. A reply of
+    None hangs up, and a send without a reply is never answered
+    '''
+    def __init__(self, replies: list):
+        self.replies = list(replies)
+        self.sent = []
+        self.pending = bytearray()
+        self.arrived = asyncio.Event()
+        self.hung_up = False
+        self.closed = False
+
+    def write(self, data: bytes) -> None:
+        '''Records the commands and queues the next reply'''
+        self.sent.append(data)
+        if self.replies:
+            reply = self.replies.pop(0)
+            if reply is None:
+                self.hung_up = True
+            else:
+                self.pending += reply
+            self.arrived.set()
+
+    async def read(self, size: int) -> bytes:
+        '''Returns whatever has arrived, waiting for a reply if nothing has'''
+        while len(self.pending) == 0:
+            if self.hung_up:
+                return b''
+            self.arrived.clear()
+            await self.arrived.wait()
+        chunk = bytes(self.pending[:size])
+        del self.pending[:size]
+        return chunk
+
+    def at_eof(self) -> bool:
+        return False
+
+    def is_closing(self) -> bool:
+        return self.closed
+
+    def close(self) -> None:
+        self.closed = True
+
+
+class ScriptedConnector(TelnetConnector):
+    '''Connector whose sessions are the given ScriptedStreams, one per connection'''
+    def __init__(self, *streams: ScriptedStreams, **kwargs):
+        super().__init__(**kwargs)
+        self.streams = list(streams)
+        self.connections = 0
+
+    async def _open_streams(self, host: str, port: int, transport: Transport) -> tuple:
+        streams = self.streams[self.connections]
+        self.connections += 1
+        return streams, streams
+
+
+async def stream(connector: TelnetConnector, commands: list) -> list:
+    '''Streams the responses to the commands from a test site and returns the parsers'''
+    parsers = [get_decoder(command).create_parser(DataLoader(), command) for command in commands]
+    async for _ in connector.stream_responses('192.0.2.1', 10001, parsers, Transport.RAW):
+        pass
+    return parsers
+
+
+class GarbledEndCharacterTest(unittest.TestCase):
+    '''A frame whose end character was garbled ends at its checksum instead of failing the site'''
+    def setUp(self):
+        self.inventory = build_frame('i20100', emulator().build_records())
+        self.deliveries = build_frame('i20200', emulator().build_deliveries())
+
+    def stream(self, streams: ScriptedStreams, commands: list) -> list:
+        '''Streams the responses to the commands and returns the parsers'''
+        return asyncio.run(stream(ScriptedConnector(streams, read_timeout=1, frame_retries=1), commands))
+
+    def test_pipelined_frame(self):
+        streams = ScriptedStreams([self.inventory[:-1] + b'\x83' + self.deliveries])
+        inventory, deliveries = self.stream(streams, ['i20100', 'i20200'])
+        self.assertEqual(len(streams.sent), 1)
+        self.assertTrue(inventory.done and deliveries.done)
+        self.assertEqual((inventory.corrupt_frames, deliveries.corrupt_frames), (0, 0))
+        self.assertEqual(len(inventory.tanks), 3)
+
+    def test_last_frame(self):
+        streams = ScriptedStreams([self.inventory[:-1] + b'\x83'])
+        inventory, = self.stream(streams, ['i20100'])
+        self.assertEqual(len(streams.sent), 1)
+        self.assertTrue(inventory.done)
+        self.assertFalse(inventory.corrupt)
+
+    def test_corrupt_frame_is_resent(self):
+        garbled = self.inventory.replace(b'459C4', b'459C5', 1)[:-1] + b'\x83'
+        streams = ScriptedStreams([garbled + self.deliveries, self.inventory])
+        with self.assertLogs(level='WARNING'):
+            inventory, deliveries = self.stream(streams, ['i20100', 'i20200'])
+        self.assertEqual(streams.sent[1], b'\x01i20100')
+        self.assertEqual((inventory.frames, inventory.corrupt_frames), (2, 1))
+        self.assertFalse(inventory.corrupt or deliveries.corrupt)
+        self.assertEqual(len(inventory.tanks), 3)
+
+
+class StaleSessionTest(unittest.TestCase):
+    '''A reused session is only replaced when the host hung up, never after it timed out'''
+    def setUp(self):
+        self.inventory = build_frame('i20100', emulator().build_records())
+
+    def test_hung_up(self):
+        connector = ScriptedConnector(ScriptedStreams([self.inventory, None]), ScriptedStreams([self.inventory]),
+                                      read_timeout=1)
+
+        async def run():
+            await stream(connector, ['i20100'])
+            with self.assertLogs(level='INFO'):
+                return await stream(connector, ['i20100'])
+
+        inventory, = asyncio.run(run())
+        self.assertEqual(connector.connections, 2)
+        self.assertTrue(inventory.done)
+
+    def test_timed_out(self):
+        connector = ScriptedConnector(ScriptedStreams([self.inventory]), ScriptedStreams([self.inventory]),
+                                      read_timeout=0.05)
+
+        async def run():
+            await stream(connector, ['i20100'])
+            with self.assertLogs(level='ERROR'):
+                with self.assertRaisesRegex(SimpleError, 'timed out'):
+                    await stream(connector, ['i20100'])
+
+        asyncio.run(run())
+        self.assertEqual(connector.connections, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+'''Checksums of TLS console response frames'''
+
+# Reply of a console to a function code it does not support. It is the only frame without a checksum
+UNRECOGNIZED_COMMAND = '9999FF1B'
+
+# "&&" followed by the 4 hex digits of the checksum
+TRAILER_LENGTH = 6
+
+
+def frame_checksum(frame: bytes) -> bytes:
+    '''Checksum of a frame from the start character up to and including "&&", as 4 hex digits'''
+    return f"{-sum(frame) & 0xFFFF:04X}".encode()
+
+
+def checksum_valid(frame: bytes) -> bool:
+    '''
+    Checks the checksum that follows "&&" in a response frame. The start character, the "&&" and
+    every character in between add up to zero with the checksum, modulo 2**16.
+
+    Only the reply to an unrecognized command is valid without a checksum. Any other frame without
+    a start character or without "&&" and 4 hex digits, such as one whose trailer was garbled or
+    that was cut short by noise, is invalid.
+    '''
+    start = frame.find(b'\x01')
+    if start == -1:
+        return False
+    if frame.startswith(UNRECOGNIZED_COMMAND.encode(), start + 1):
+        return True
+    end = frame.find(b'&&', start)
+    if end == -1:
+        return False
+    end += 2
+    checksum = bytes(frame[end:end + 4])
+    return len(checksum) == 4 and checksum.upper() == frame_checksum(frame[start:end])
+
+
+def frame_end(frame: bytes, start: int = 0) -> int:
+    '''
+    Index just past the end of the first frame at or after start, or -1 while the frame is incomplete.
+
+    A frame ends at its end character or, when noise garbled the end character, once "&&" and the 4
+    checksum digits have arrived. The end character is taken along when it follows the checksum.
+    An end character before or inside the trailer ends a frame that was cut short.
+    '''
+    end = frame.find(b'\x03', start)
+    trailer = frame.find(b'&&', start)
+    if trailer == -1 or (end != -1 and end < trailer + TRAILER_LENGTH):
+        return -1 if end == -1 else end + 1
+    trailer += TRAILER_LENGTH
+    if trailer > len(frame):
+        return -1
+    return trailer + 1 if frame[trailer:trailer + 1] == b'\x03' else trailer
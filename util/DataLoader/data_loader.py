@@ -1,56 +1,118 @@
 '''Custom Data Loader Class to Handle Various Methods'''
 import json
 import logging
+import math
+import struct
+import time
 from typing import List
 
+from util.DataLoader.json_encoder import dumps_compact
 from util.Exceptions.custom_exceptions import CriticalError, SimpleError
+from util.Metrics.metrics import get_metrics
+from util.Models.tank_reading import SiteSnapshot, TankReading
+from util.Writer.atomic_file import write_atomic
+
+# Layout of a single tank record in an i20100 response
+TANK_RECORD_LENGTH = 65
+FLOAT_FIELDS_OFFSET = 9
+FLOAT_FIELD_LENGTH = 8
+FLOAT_FIELDS = [
+    'Volume',
+    'TC Volume',
+    'Ullage',
+    'Height',
+    'Water',
+    'Temperature',
+    'Water Volume'
+]
+# Big-endian float32 unpackers, keyed by the number of floats they decode
+_float_structs = {}
+
+
+def float_struct(count: int) -> struct.Struct:
+    '''Returns a cached unpacker for the given number of big-endian float32 values'''
+    unpacker = _float_structs.get(count)
+    if unpacker is None:
+        unpacker = _float_structs[count] = struct.Struct(f'>{count}f')
+    return unpacker
+
+
+def finite_values(values: tuple) -> tuple:
+    '''
+    Returns the unpacked values with NaN and infinities set to None. Consoles never report them, so
+    a field with an all ones exponent is malformed
+    '''
+    if all(map(math.isfinite, values)):
+        return values
+    return tuple(value if math.isfinite(value) else None for value in values)
 
 
 class DataLoader:
     '''Class to handle data loading'''
     def __init__(self):
         self.logger = logging.getLogger()
+        self.metrics = get_metrics()
 
-    def parse_full_string(self, content: str, command: str) -> dict:
+    def parse_full_string(self, content: str, command: str) -> SiteSnapshot:
         '''Parses the full string returned from the telnet command'''
         # command = "i20100"
         start_char = "\x01"
         end_char = "\x03"
-        fixed_data_length = 65
-        content = content.replace(start_char,
-                                  "").replace(end_char,
-                                              "").replace(command,
-                                                          "").split("&&")[0]
-        final_data = {'date': content[0:10], 'data': []}
-        content = content[10:]
-        data_strings = []
-        while len(content) > 0:
-            data_strings.append(content[0:fixed_data_length])
-            content = content[fixed_data_length:]
-        for data in data_strings:
-            json_data = self.parse_data_string(data)
-            final_data['data'].append(json_data)
-        return final_data
-
-    def parse_data_string(self, content: str) -> dict:
+        start = 1 if content.startswith(start_char) else 0
+        if content.startswith(command, start):
+            start += len(command)
+        end = content.find("&&", start)
+        if end == -1:
+            end = content.find(end_char, start)
+        if end == -1:
+            end = len(content)
+        return SiteSnapshot(content[start:start + 10], self.parse_data_section(content[start + 10:end]))
+
+    def parse_data_section(self, content: str) -> List[TankReading]:
+        '''
+        Parses the tank records of a response in one pass.
+
+        The float fields of every record are joined and unpacked as a single block of big-endian
+        float32 values. If any field is malformed the records are decoded field by field instead,
+        and only the malformed fields are set to None. Fields that decode to NaN or infinity are
+        malformed too.
+        '''
+        start = time.perf_counter()
+        records = [content[index:index + TANK_RECORD_LENGTH]
+                   for index in range(0, len(content), TANK_RECORD_LENGTH)]
+        field_count = len(FLOAT_FIELDS)
+        values = None
+        if len(content) % TANK_RECORD_LENGTH == 0:
+            hex_block = ''.join(record[FLOAT_FIELDS_OFFSET:] for record in records)
+            try:
+                values = finite_values(float_struct(len(records) * field_count).unpack(bytes.fromhex(hex_block)))
+            except (ValueError, struct.error):
+                self.logger.warning("Malformed tank data received. Decoding fields individually.")
+        tanks = []
+        for index, record in enumerate(records):
+            fields = values[index * field_count:(index + 1) * field_count] if values is not None \
+                else self._parse_record_fields(record)
+            tanks.append(TankReading(record[0:2], record[2:3], record[3:7], *fields))
+        self.metrics.observe('parse', time.perf_counter() - start)
+        return tanks
+
+    def _parse_record_fields(self, record: str) -> List[float]:
+        '''Decodes the float fields of one record, setting malformed fields to None'''
+        fields = []
+        unpacker = float_struct(1)
+        for index, field in enumerate(FLOAT_FIELDS):
+            start = FLOAT_FIELDS_OFFSET + index * FLOAT_FIELD_LENGTH
+            ieee = record[start:start + FLOAT_FIELD_LENGTH]
+            try:
+                fields.append(finite_values(unpacker.unpack(bytes.fromhex(ieee)))[0])
+            except (ValueError, struct.error):
+                self.logger.error("Invalid hex number %r for %s on tank %s.", ieee, field, record[0:2])
+                fields.append(None)
+        return fields
+
+    def parse_data_string(self, content: str) -> TankReading:
         '''Parses a string from a single tank'''
-        tank_data = {}
-        data_fields = [
-            'Volume',
-            'TC Volume',
-            'Ullage',
-            'Height',
-            'Water',
-            'Temperature',
-            'Water Volume'
-        ]
-        tank_data['tank_number'] = content[0:2]
-        tank_data['product_number'] = content[2:3]
-        tank_data['tank_status'] = content[3:7]
-        for index, field in enumerate(data_fields):
-            ieee = content[9 + (index * 8): 9 + (index * 8) + 8]
-            tank_data[field] = self.parse_ascii_floating_point(ieee)
-        return tank_data
+        return self.parse_data_section(content[:TANK_RECORD_LENGTH])[0]
 
     def parse_ascii_floating_point(self, hex_num: str) -> float:
         '''
@@ -89,12 +151,13 @@ class DataLoader:
         The eight "nibbles" are transmitted in sequence from 1 through 8 as shown
         in section 6.3.1.2.
         '''
-        self.logger.debug("Hex Number received: %s", hex_num)
+        debug = self.logger.isEnabledFor(logging.DEBUG)
         try:
             bit_number = int(hex_num, 16)
-            self.logger.debug("Bit Number: %s", bit_number)
         except ValueError as e:
             raise CriticalError("Invalid hex number provided.") from e
+        if debug:
+            self.logger.debug("Hex Number received: %s Bit Number: %s", hex_num, bit_number)
 
         # Byte format. Shifting the bits to the right to get the value of the bits.
         format_b = {
@@ -106,57 +169,28 @@ class DataLoader:
         # S is the sign bit (0 if positive, 1 if negative).
         s_value = -1 if (bit_number >> format_b['S'][0]) & format_b['S'][1] == 1\
             else 1
-        self.logger.debug("Sign Value: %s", s_value)
         # EEE EEEE E represents the 2's exponent. It is a 2's complement value biased by 127 (7F
         # Hex). The exponent can be determined by subtracting 127 from the value of the E field and
         # raising 2 to the resulting power.
         e_value = (bit_number >> format_b['E'][0]) & format_b['E'][1]
-        self.logger.debug("Exponent Value: %s", e_value)
         # MMM MMMM MMMM MMMM MMMM MMMM represents the 23-bit mantissa. Since
         # the mantissa describes a value which is greater than or equal to 1.0 and less than 2.0,
         # the 24th bit is always assumed to be equal to 1 and is not transmitted or stored.
         m_value = (bit_number >> format_b['M'][0]) & format_b['M'][1]
-        self.logger.debug("Mantissa Value: %s", m_value)
 
         decimal_value = s_value * (2 ** (e_value - 127)) * (m_value / 8388608 + 1)
-        self.logger.debug("Decimal Value: %s", decimal_value)
+        if debug:
+            self.logger.debug("Sign: %s Exponent: %s Mantissa: %s Decimal Value: %s",
+                              s_value, e_value, m_value, decimal_value)
         return decimal_value
 
-    def verify_file_spec(self, data: dict) -> None:
-        '''Verifies that the data is in the correct format'''
-        assert 'Host' in data[0].keys()
-        assert 'Location' in data[0].keys()
-        assert 'Port' in data[0].keys()
-        assert 'Command' in data[0].keys()
-        self.logger.debug("Data format verified.")
-
-    def load_json_file(self, file: str) -> dict:
-        '''Reads a local json file and returns the data as a dictionary'''
-        self.logger.info("Loading data from file: %s", file)
-        try:
-            with open(file, mode='r', encoding="utf-8") as f:
-                tank_data = json.load(f)
-                try:
-                    self. verify_file_spec(tank_data)
-                except AssertionError as e:
-                    raise CriticalError("Data file is not in the correct format.") from e
-                self.logger.info("Successfully loaded and verified data from %s", file)
-                self.logger.debug("Loaded Data: %s", tank_data)
-                return tank_data
-        except FileNotFoundError as e:
-            self.logger.critical("Data file not found.")
-            raise CriticalError("Data file not found.") from e
-        except json.JSONDecodeError as e:
-            self.logger.critical("Data file is not a valid JSON file.")
-            raise CriticalError("Data file is not a valid JSON file.") from e
-
     def write_string_to_file(self, data: str, file_name: str) -> None:
         ''''Writes a string to a file'''
         self.logger.debug("Data received: %s", data)
         self.logger.info("Writing contents to %s...", file_name)
         try:
-            with open(f"{file_name}", mode='w', encoding='utf-8') as file:
-                file.write(data)
+            with self.metrics.timer('write_text'):
+                write_atomic(data, file_name)
             self.logger.info("Successfully wrote contents to %s", file_name)
         except PermissionError as e:
             self.logger.error("Permission denied to write to file: %s", file_name)
@@ -167,13 +201,11 @@ class DataLoader:
 
     def write_list_to_file(self, data: List[str], file_name: str) -> None:
         '''Writes a list of strings to a file'''
-        self.logger.debug("Begin listing rows received:")
-        for row in data:
-            self.logger.debug("%s", row)
-        self.logger.debug("End listing rows from response")
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("Rows received:\n%s", '\n'.join(data))
         self.logger.info("Writing contents to %s...", file_name)
         try:
-            with open(f"{file_name}", mode='w', encoding='utf-8') as file:
+            with self.metrics.timer('write_text'), open(f"{file_name}", mode='w', encoding='utf-8') as file:
                 for row in data:
                     file.write(row + '\n')
             self.logger.info("Successfully wrote contents to %s", file_name)
@@ -196,10 +228,8 @@ class DataLoader:
             self.logger.critical("Data file not found.")
             raise SimpleError("Data file not found.") from e
         self.logger.debug("Data loaded from file.")
-        self.logger.debug("Begin listing rows received:")
-        for row in data:
-            self.logger.debug("%s", row)
-        self.logger.debug("End listing rows from response")
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("Rows received:\n%s", ''.join(data))
         remove_rows = 0
         for j in data:
             if j[:4] == 'TANK':
@@ -207,10 +237,8 @@ class DataLoader:
                 break
             remove_rows += 1
         data = data[remove_rows:]
-        self.logger.debug("Data cleaned up. Begin listing rows in cleaned data:")
-        for row in data:
-            self.logger.debug("%s", row)
-        self.logger.debug("End listing rows from cleaned data")
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("Data cleaned up. Rows in cleaned data:\n%s", ''.join(data))
         try:
             header_row = data[0]
         except IndexError as e:
@@ -263,11 +291,67 @@ class DataLoader:
             self.logger.error("File path not found: %s", export_file_name)
             raise SimpleError("File path not found.") from e
 
+    def write_snapshot_to_json(self, snapshot: SiteSnapshot, export_file_name: str) -> None:
+        '''Writes a site snapshot to a json file in the same format as write_to_json_from_dict'''
+        self.logger.info("Writing data to JSON file: %s", export_file_name)
+        try:
+            with self.metrics.timer('write_json'):
+                write_atomic(snapshot.to_json(), export_file_name)
+            self.logger.info("Successfully wrote data to %s", export_file_name)
+        except PermissionError as e:
+            self.logger.error("Permission denied to write to file: %s", export_file_name)
+            raise CriticalError("Permission denied to write to file.") from e
+        except FileNotFoundError as e:
+            self.logger.error("File path not found: %s", export_file_name)
+            raise SimpleError("File path not found.") from e
+
+    def write_fleet_export(self, snapshots: List[SiteSnapshot], export_file_name: str,
+                           file_format: str = 'ndjson', fast: bool = True) -> None:
+        '''
+        Writes the snapshots of every site to one file, replacing it atomically.
+
+        The "ndjson" format writes one compact JSON object per site and line, "json" writes a compact
+        JSON array. fast uses orjson when it is installed.
+        '''
+        self.logger.info("Writing fleet export for %s sites to %s", len(snapshots), export_file_name)
+        try:
+            with self.metrics.timer('write_fleet'):
+                if file_format == 'ndjson':
+                    content = ''.join(dumps_compact(snapshot.to_dict(), fast) + '\n' for snapshot in snapshots)
+                else:
+                    content = dumps_compact([snapshot.to_dict() for snapshot in snapshots], fast)
+                write_atomic(content, export_file_name)
+            self.logger.info("Successfully wrote fleet export to %s", export_file_name)
+        except PermissionError as e:
+            self.logger.error("Permission denied to write to file: %s", export_file_name)
+            raise CriticalError("Permission denied to write to file.") from e
+        except FileNotFoundError as e:
+            self.logger.error("File path not found: %s", export_file_name)
+            raise SimpleError("File path not found.") from e
+
+    def read_fleet_export(self, export_file_name: str, file_format: str = 'ndjson') -> List[SiteSnapshot]:
+        '''
+        Reads the snapshots of the last fleet export written by write_fleet_export. A missing file
+        reads as empty, and so does one that cannot be read, after logging it
+        '''
+        try:
+            with open(export_file_name, mode='r', encoding='utf-8') as f:
+                if file_format == 'ndjson':
+                    entries = [json.loads(line) for line in f if line.strip()]
+                else:
+                    entries = json.load(f)
+            return [SiteSnapshot.from_dict(entry) for entry in entries]
+        except FileNotFoundError:
+            return []
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            self.logger.warning("Unable to read the last fleet export %s: %s", export_file_name, e)
+            return []
+
     def write_to_json_from_dict(self, data: dict, export_file_name: str) -> None:
         '''Writes a dictionary to a json file'''
         self.logger.info("Writing data to JSON file: %s", export_file_name)
         try:
-            with open(export_file_name, mode='w', encoding='utf-8') as f:
+            with self.metrics.timer('write_json'), open(export_file_name, mode='w', encoding='utf-8') as f:
                 json.dump(data, f, indent=4)
             self.logger.info("Successfully wrote data to %s", export_file_name)
         except FileNotFoundError as e:
@@ -0,0 +1,205 @@
+'''
+Registry of decoders for TLS console responses.
+
+Every decoder handles one function code, such as i201 for inventory or i202 for deliveries, and is
+looked up by the first four characters of a command so that the tank suffix ("00" for all tanks) does
+not matter. Layouts are compiled into slice offsets and float unpackers once, when the decoder is
+registered. New reports are supported by registering another ResponseDecoder.
+'''
+import logging
+import struct
+from typing import Callable, Dict, List, Tuple
+
+from util.DataLoader.checksum import UNRECOGNIZED_COMMAND
+from util.DataLoader.data_loader import DataLoader, finite_values, float_struct
+from util.DataLoader.stream_parser import DATE_LENGTH, FrameParser, StreamParser
+from util.Exceptions.custom_exceptions import SimpleError
+
+
+class Field:
+    '''A fixed width field of a record'''
+    def __init__(self, name: str, width: int, convert: Callable = str):
+        self.name = name
+        self.width = width
+        self.convert = convert
+
+
+class Floats:
+    '''A run of 8 digit hex float32 values whose count is given by an earlier field'''
+    def __init__(self, names: List[str], count_field: str):
+        self.names = names
+        self.count_field = count_field
+        self.unpacker = float_struct(len(names))
+
+    def decode(self, content: str, position: int, record: dict) -> int:
+        '''Decodes the values into the record and returns the position after them'''
+        count = record.pop(self.count_field)
+        end = position + count * 8
+        if len(content) < end:
+            raise ValueError("record is truncated")
+        unpacker = self.unpacker if count == len(self.names) else float_struct(count)
+        # NaN and infinities are malformed values, so they decode to None like in tank records
+        values = finite_values(unpacker.unpack(bytes.fromhex(content[position:end])))
+        # Consoles may report more or fewer fields than the layout names
+        for name, value in zip(self.names, values):
+            record[name] = value
+        return end
+
+
+class Repeat:
+    '''A nested record repeated as many times as an earlier field says'''
+    def __init__(self, name: str, count_field: str, layout: 'RecordLayout'):
+        self.name = name
+        self.count_field = count_field
+        self.layout = layout
+
+    def decode(self, content: str, position: int, record: dict) -> int:
+        '''Decodes the nested records into a list and returns the position after them'''
+        items = []
+        for _ in range(record.pop(self.count_field)):
+            item, position = self.layout.decode(content, position)
+            items.append(item)
+        record[self.name] = items
+        return position
+
+
+class FixedBlock:
+    '''Consecutive fixed width fields, compiled into offsets relative to the start of the block'''
+    def __init__(self, fields: List[Field]):
+        self.slices = []
+        offset = 0
+        for field in fields:
+            self.slices.append((field.name, offset, offset + field.width, field.convert))
+            offset += field.width
+        self.width = offset
+
+    def decode(self, content: str, position: int, record: dict) -> int:
+        '''Decodes the fields into the record and returns the position after them'''
+        if len(content) - position < self.width:
+            raise ValueError("record is truncated")
+        for name, start, end, convert in self.slices:
+            record[name] = convert(content[position + start:position + end])
+        return position + self.width
+
+
+class RecordLayout:
+    '''Layout of a record, compiled once into fixed blocks, float runs and repeats'''
+    def __init__(self, *items):
+        self.steps = []
+        fields = []
+        for item in items:
+            if isinstance(item, Field):
+                fields.append(item)
+                continue
+            if len(fields) > 0:
+                self.steps.append(FixedBlock(fields))
+                fields = []
+            self.steps.append(item)
+        if len(fields) > 0:
+            self.steps.append(FixedBlock(fields))
+
+    def decode(self, content: str, position: int) -> Tuple[dict, int]:
+        '''Decodes one record starting at position. Returns the record and the position after it'''
+        record = {}
+        for step in self.steps:
+            position = step.decode(content, position, record)
+        return record, position
+
+
+def hex_int(value: str) -> int:
+    '''Converts a hex count field'''
+    return int(value, 16)
+
+
+class ResponseDecoder:
+    '''Decodes the records of a response to one function code'''
+    def __init__(self, function_code: str, name: str, layout: RecordLayout = None):
+        self.logger = logging.getLogger()
+        self.function_code = function_code
+        self.name = name
+        self.layout = layout
+
+    def create_parser(self, data_loader: DataLoader, command: str):
+        '''Returns a parser to feed the response to the command into as it arrives'''
+        return FrameParser(self, command)
+
+    def decode(self, content: str, command: str) -> Tuple[str, List[dict]]:
+        '''Decodes a full response frame. Returns the date and the records'''
+        start = 1 if content.startswith('\x01') else 0
+        if content.startswith(UNRECOGNIZED_COMMAND, start):
+            raise SimpleError(f"Command {command} not recognized by console.")
+        if not content.startswith(command, start):
+            raise SimpleError(f"Response does not answer {command}.")
+        start += len(command)
+        end = content.find('&&', start)
+        if end == -1:
+            end = content.find('\x03', start)
+        if end == -1 or end - start < DATE_LENGTH:
+            raise SimpleError(f"Incomplete response to {command}.")
+        date = content[start:start + DATE_LENGTH]
+        position = start + DATE_LENGTH
+        body = content[:end]
+        records = []
+        try:
+            while position < end:
+                record, position = self.layout.decode(body, position)
+                records.append(record)
+        except (ValueError, KeyError, struct.error) as e:
+            raise SimpleError(f"Malformed {self.name} record in response to {command}: {e}") from e
+        return date, records
+
+
+class InventoryDecoder(ResponseDecoder):
+    '''Decodes i20100 inventory into TankReadings, streaming tanks as their records arrive'''
+    def create_parser(self, data_loader: DataLoader, command: str):
+        return StreamParser(data_loader, command)
+
+
+_decoders: Dict[str, ResponseDecoder] = {}
+
+
+def register_decoder(decoder: ResponseDecoder) -> None:
+    '''Adds a decoder to the registry, replacing any decoder for the same function code'''
+    _decoders[decoder.function_code] = decoder
+
+
+def get_decoder(command: str) -> ResponseDecoder:
+    '''Returns the decoder for a command. Raises SimpleError if no decoder handles it'''
+    decoder = _decoders.get(command[:4])
+    if decoder is None:
+        raise SimpleError(f"No decoder registered for command {command}.")
+    return decoder
+
+
+register_decoder(InventoryDecoder('i201', 'inventory'))
+register_decoder(ResponseDecoder('i202', 'deliveries', RecordLayout(
+    Field('tank_number', 2),
+    Field('product_number', 1),
+    Field('count', 2, hex_int),
+    Repeat('deliveries', 'count', RecordLayout(
+        Field('start', DATE_LENGTH),
+        Field('end', DATE_LENGTH),
+        Field('fields', 2, hex_int),
+        Floats(['Starting Volume', 'Starting TC Volume', 'Starting Water', 'Starting Temperature',
+                'Ending Volume', 'Ending TC Volume', 'Ending Water', 'Ending Temperature',
+                'Starting Height', 'Ending Height'], 'fields')
+    ))
+)))
+register_decoder(ResponseDecoder('i205', 'alarms', RecordLayout(
+    Field('tank_number', 2),
+    Field('count', 2, hex_int),
+    Repeat('alarms', 'count', RecordLayout(
+        Field('alarm_type', 2)
+    ))
+)))
+register_decoder(ResponseDecoder('i207', 'leak_tests', RecordLayout(
+    Field('tank_number', 2),
+    Field('product_number', 1),
+    Field('count', 2, hex_int),
+    Repeat('tests', 'count', RecordLayout(
+        Field('start', DATE_LENGTH),
+        Field('result', 1),
+        Field('fields', 2, hex_int),
+        Floats(['Leak Rate', 'Test Volume', 'Test Hours'], 'fields')
+    ))
+)))
@@ -0,0 +1,19 @@
+'''Compact JSON encoding that uses orjson when it is installed'''
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps_compact(data, fast: bool = True) -> str:
+    '''
+    Encodes data as JSON without whitespace.
+
+    orjson is used when fast is set and it is installed. It writes NaN and infinite values as null,
+    where the json module writes NaN and Infinity.
+    '''
+    if fast and orjson is not None:
+        return orjson.dumps(data).decode()
+    return json.dumps(data, separators=(',', ':'))
@@ -0,0 +1,176 @@
+'''Incremental parsers for TLS console responses'''
+import logging
+from typing import List
+
+from util.DataLoader.checksum import TRAILER_LENGTH, UNRECOGNIZED_COMMAND, checksum_valid, frame_end
+from util.DataLoader.data_loader import DataLoader, TANK_RECORD_LENGTH
+from util.Exceptions.custom_exceptions import SimpleError
+from util.Models.tank_reading import SiteSnapshot, TankReading
+
+DATE_LENGTH = 10
+UNRECOGNIZED_REPLY = UNRECOGNIZED_COMMAND.encode()
+
+
+class ResponseParser:
+    '''
+    Base of the parsers fed the response to a single command.
+
+    Keeps the received frame in a buffer and counts how many frames were received and how many of
+    them failed their checksum, across every time the command was sent.
+    '''
+    def __init__(self, command: str):
+        self.logger = logging.getLogger()
+        self.command = command
+        self.buffer = bytearray()
+        self.done = False
+        self.corrupt = False
+        self.frames = 0
+        self.corrupt_frames = 0
+
+    @property
+    def raw(self) -> str:
+        '''The response received so far. Bytes that are not ASCII, such as line noise, become U+FFFD'''
+        return self.buffer.decode('ascii', errors='replace')
+
+    def verify(self) -> bool:
+        '''Checks the checksum of the complete frame and counts the result'''
+        self.frames += 1
+        self.corrupt = not checksum_valid(self.buffer)
+        if self.corrupt:
+            self.corrupt_frames += 1
+        return not self.corrupt
+
+    def frame_end(self, chunk: bytes) -> int:
+        '''Index just past the end of the frame in the next chunk, or -1 if the frame does not end in it'''
+        # "&&" and part of the checksum may already be buffered
+        tail = bytes(self.buffer[-TRAILER_LENGTH:])
+        end = frame_end(tail + chunk)
+        return -1 if end == -1 else end - len(tail)
+
+    def reset(self) -> None:
+        '''Discards the received frame so the command can be sent again. The counts are kept'''
+        self.buffer = bytearray()
+        self.done = False
+        self.corrupt = False
+
+    def check(self) -> None:
+        '''Raises SimpleError if the frame failed its checksum'''
+        if self.corrupt:
+            raise SimpleError(f"Response to {self.command} failed its checksum.")
+
+
+class StreamParser(ResponseParser):
+    '''
+    Parses an i20100 response as it arrives.
+
+    Bytes are appended to a single buffer and read back by offset, so each record is only sliced
+    once no matter how many tanks the site has. Every call to feed() returns the tanks whose records
+    were completed by that chunk. The full frame stays available in raw for captures.
+    '''
+    def __init__(self, data_loader: DataLoader, command: str):
+        super().__init__(command)
+        self.data_loader = data_loader
+        self.echo = command.encode()
+        self.position = 0
+        self.date = None
+        self.tanks = []
+
+    def reset(self) -> None:
+        super().reset()
+        self.position = 0
+        self.date = None
+        self.tanks = []
+
+    def _parse_header(self) -> bool:
+        '''
+        Skips the start character and command echo and reads the date. Returns True when done.
+        Raises SimpleError if the response is not an answer to the parser's command
+        '''
+        buffer = self.buffer
+        position = self.position
+        if buffer[position:position + 1] == b'\x01':
+            position += 1
+        if len(buffer) - position < len(self.echo):
+            return False
+        if buffer[position:position + len(self.echo)] != self.echo:
+            received = bytes(buffer[position:position + len(UNRECOGNIZED_REPLY)])
+            if not UNRECOGNIZED_REPLY.startswith(received):
+                raise SimpleError(f"Response does not answer {self.command}.")
+            if len(received) < len(UNRECOGNIZED_REPLY):
+                return False
+            raise SimpleError(f"Command {self.command} not recognized by console.")
+        position += len(self.echo)
+        if len(buffer) - position < DATE_LENGTH:
+            return False
+        self.date = buffer[position:position + DATE_LENGTH].decode('ascii', errors='replace')
+        self.position = position + DATE_LENGTH
+        return True
+
+    def feed(self, chunk: bytes) -> List[TankReading]:
+        '''Adds a chunk of the response and returns the tanks completed by it'''
+        if self.done:
+            return []
+        self.buffer += chunk
+        if self.date is None and not self._parse_header():
+            self.done = frame_end(self.buffer, self.position) != -1
+            return []
+        records = []
+        buffer = self.buffer
+        while self.position < len(buffer):
+            # Records start with the tank number, so "&&" or the end character ends them. The frame is
+            # complete once the checksum has arrived, even if noise garbled the end character
+            if buffer[self.position] in b'&\x03':
+                self.done = frame_end(buffer, self.position) != -1
+                break
+            if len(buffer) - self.position < TANK_RECORD_LENGTH:
+                break
+            # Line noise becomes one U+FFFD per byte, so it only spoils the fields it landed in
+            records.append(buffer[self.position:self.position + TANK_RECORD_LENGTH].decode('ascii', errors='replace'))
+            self.position += TANK_RECORD_LENGTH
+        if len(records) == 0:
+            return []
+        tanks = self.data_loader.parse_data_section(''.join(records))
+        self.tanks.extend(tanks)
+        return tanks
+
+    def apply(self, snapshot: SiteSnapshot) -> None:
+        '''
+        Sets the date and tanks of a snapshot from the response. An incomplete response has no date.
+        Raises SimpleError if the response failed its checksum
+        '''
+        # An inventory that failed its checksum leaves the snapshot without a date
+        snapshot.date = None
+        self.check()
+        snapshot.date = self.date if self.done else None
+        snapshot.tanks = self.tanks
+
+
+class FrameParser(ResponseParser):
+    '''
+    Collects a whole response frame and decodes it with a ResponseDecoder once it is complete.
+
+    Used for reports that are small enough that nothing is gained by decoding them as they arrive.
+    '''
+    def __init__(self, decoder, command: str):
+        super().__init__(command)
+        self.decoder = decoder
+
+    def feed(self, chunk: bytes) -> list:
+        '''Adds a chunk of the response. Records are only decoded once the frame is complete'''
+        if self.done:
+            return []
+        self.buffer += chunk
+        self.done = frame_end(self.buffer) != -1
+        return []
+
+    def apply(self, snapshot: SiteSnapshot) -> None:
+        '''
+        Adds the decoded records to the reports of a snapshot. Takes the date of the response when
+        the snapshot does not have one yet. Raises SimpleError if the frame failed its checksum or
+        cannot be decoded.
+        '''
+        self.check()
+        date, records = self.decoder.decode(self.raw, self.command)
+        snapshot.reports[self.decoder.name] = records
+        if snapshot.date is None:
+            snapshot.date = date
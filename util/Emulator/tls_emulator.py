@@ -0,0 +1,162 @@
+'''TLS Console Emulator Class for local load testing'''
+import asyncio
+import logging
+import random
+import struct
+import time
+from typing import List
+
+from util.DataLoader.checksum import frame_checksum
+
+# Values reported for every tank before drift: volume, TC volume, ullage, height, water, temperature,
+# water volume
+BASE_READING = (5000.0, 4975.0, 7000.0, 40.5, 0.0, 56.0, 0.0)
+# Every tank reports the same last delivery: starting volume, TC volume, water and temperature,
+# ending volume, TC volume, water and temperature, starting and ending height
+DELIVERY = (2000.0, 1990.0, 0.0, 55.0, 8000.0, 7960.0, 0.0, 57.0, 18.5, 60.5)
+# Every tank reports the same passed leak test: leak rate, test volume and test hours
+LEAK_TEST = (0.0, 5000.0, 2.0)
+UNRECOGNIZED_COMMAND = b'\x019999FF1B\x03'
+
+
+class TLSEmulator:
+    '''
+    Emulates a Veeder-Root TLS console answering inventory (i20100), delivery (i20200), status
+    (i20500) and leak test (i20700) requests.
+
+    Responses are framed like a real console: start character, command echo, YYMMDDHHmm date, one
+    65-character record per tank, "&&", checksum and end character. Latency, bandwidth, dropped
+    connections, malformed replies and how far readings drift between requests can be configured to
+    load test the poller.
+    '''
+    def __init__(self, tanks: int = 4,
+                 latency: float = 0.0,
+                 bandwidth: int = None,
+                 drop_rate: float = 0.0,
+                 malformed_rate: float = 0.0,
+                 drift: float = 5.0,
+                 seed: int = None):
+        self.logger = logging.getLogger()
+        self.tanks = tanks
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.drop_rate = drop_rate
+        self.malformed_rate = malformed_rate
+        self.drift = drift
+        self.random = random.Random(seed)
+        self.requests = 0
+
+    def build_records(self) -> str:
+        '''Builds the tank records with readings that drift a little on every request'''
+        records = []
+        for tank in range(1, self.tanks + 1):
+            values = [value + self.random.uniform(-self.drift, self.drift) if value else value
+                      for value in BASE_READING]
+            fields = struct.pack('>7f', *values).hex().upper()
+            records.append(f"{tank:02d}{tank % 4 + 1}000007{fields}")
+        return ''.join(records)
+
+    def build_deliveries(self) -> str:
+        '''Builds i20200 delivery records with one delivery per tank'''
+        fields = struct.pack('>10f', *DELIVERY).hex().upper()
+        return ''.join(f"{tank:02d}{tank % 4 + 1}01" "2401010800" "2401010830" f"0A{fields}"
+                       for tank in range(1, self.tanks + 1))
+
+    def build_alarms(self) -> str:
+        '''Builds i20500 status records where only the first tank has an active alarm'''
+        return ''.join(f"{tank:02d}0105" if tank == 1 else f"{tank:02d}00"
+                       for tank in range(1, self.tanks + 1))
+
+    def build_leak_tests(self) -> str:
+        '''Builds i20700 leak test records with one passed test per tank'''
+        fields = struct.pack('>3f', *LEAK_TEST).hex().upper()
+        return ''.join(f"{tank:02d}{tank % 4 + 1}01" "2401010200" f"P03{fields}"
+                       for tank in range(1, self.tanks + 1))
+
+    def build_response(self, command: str) -> bytes:
+        '''Builds a framed response to a command'''
+        builders = {
+            'i201': self.build_records,
+            'i202': self.build_deliveries,
+            'i205': self.build_alarms,
+            'i207': self.build_leak_tests
+        }
+        builder = builders.get(command[:4])
+        if builder is None:
+            return UNRECOGNIZED_COMMAND
+        date = time.strftime('%y%m%d%H%M')
+        records = builder()
+        checksum = frame_checksum(f"\x01{command}{date}{records}&&".encode())
+        # Line noise garbles the frame after the console computed its checksum
+        if self.random.random() < self.malformed_rate:
+            records = self.garble(records)
+        return f"\x01{command}{date}{records}&&".encode() + checksum + b'\x03'
+
+    def garble(self, records: str) -> str:
+        '''Replaces one hex digit of the records the way line noise would'''
+        if len(records) == 0:
+            return records
+        index = self.random.randrange(len(records))
+        replacement = self.random.choice([digit for digit in '0123456789ABCDEF' if digit != records[index]])
+        return records[:index] + replacement + records[index + 1:]
+
+    async def send(self, writer: asyncio.StreamWriter, response: bytes) -> None:
+        '''Writes a response, throttled to the configured bandwidth in bytes per second'''
+        if not self.bandwidth:
+            writer.write(response)
+            await writer.drain()
+            return
+        chunk_size = max(1, self.bandwidth // 20)
+        for start in range(0, len(response), chunk_size):
+            writer.write(response[start:start + chunk_size])
+            await writer.drain()
+            await asyncio.sleep(chunk_size / self.bandwidth)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        '''Answers every command received on a connection until the client disconnects'''
+        buffer = b''
+        try:
+            while True:
+                chunk = await reader.read(1024)
+                if not chunk:
+                    break
+                buffer += chunk
+                # Commands are the start character followed by a 6 character function code. Anything
+                # else, such as telnet option negotiation, is ignored.
+                while True:
+                    start = buffer.find(b'\x01')
+                    if start == -1 or len(buffer) - start < 7:
+                        buffer = buffer[start:] if start != -1 else b''
+                        break
+                    command = buffer[start + 1:start + 7].decode(errors='replace')
+                    buffer = buffer[start + 7:]
+                    self.requests += 1
+                    if self.random.random() < self.drop_rate:
+                        return
+                    if self.latency:
+                        await asyncio.sleep(self.latency)
+                    await self.send(writer, self.build_response(command))
+        except (ConnectionError, asyncio.CancelledError):
+            # Clients hanging up and the server shutting down both end the connection
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host: str, port: int) -> asyncio.AbstractServer:
+        '''Starts listening on the given host and port'''
+        server = await asyncio.start_server(self.handle, host, port)
+        self.logger.debug("TLS emulator listening on %s port %s", host, port)
+        return server
+
+
+def serve_emulators(host: str, ports: List[int], **options) -> None:
+    '''Runs one emulator per port until the process is stopped. Options are passed to TLSEmulator'''
+    async def run():
+        servers = []
+        for index, port in enumerate(ports):
+            seed = options.get('seed')
+            emulator_options = dict(options, seed=None if seed is None else seed + index)
+            servers.append(await TLSEmulator(**emulator_options).start(host, port))
+        await asyncio.gather(*(server.serve_forever() for server in servers))
+
+    asyncio.run(run())
@@ -0,0 +1,9 @@
+'''Custom Enum for how the poller runs'''
+from enum import Enum
+
+
+class RunMode(Enum):
+    '''Enum for the poller run mode'''
+    ONCE = 1
+    DAEMON = 2
+    SHARDED = 3
@@ -0,0 +1,8 @@
+'''Custom Enum for how a site is connected to'''
+from enum import Enum
+
+
+class Transport(Enum):
+    '''Enum for the transport of a site, named the way it is written in the site file'''
+    TELNET = 'telnet'
+    RAW = 'raw'
@@ -0,0 +1,93 @@
+'''History Store Class to keep every tank reading'''
+import logging
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import List
+
+from util.Exceptions.custom_exceptions import CriticalError, SimpleError
+from util.Metrics.metrics import get_metrics
+from util.Models.tank_reading import FLOAT_ATTRIBUTES, SiteSnapshot
+
+# Columns stored for each reading, named after the TankReading attributes
+READING_COLUMNS = FLOAT_ATTRIBUTES
+
+
+class HistoryStore:
+    '''
+    Append-only history of tank readings in a SQLite database.
+
+    The database runs in WAL mode so each poll only appends one row per tank, and readers are not
+    blocked while the poller writes. Readings are indexed by site, tank and reading time.
+    '''
+    def __init__(self, file: str):
+        self.logger = logging.getLogger()
+        self.file = file
+        self.lock = threading.Lock()
+        self.metrics = get_metrics()
+        try:
+            self.connection = sqlite3.connect(file, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            columns = ', '.join(f"{column} REAL" for column in READING_COLUMNS)
+            with self.connection:
+                self.connection.execute(
+                    "CREATE TABLE IF NOT EXISTS readings ("
+                    "site TEXT NOT NULL, tank TEXT NOT NULL, product TEXT, "
+                    f"{columns}, read_at TEXT NOT NULL, polled_at REAL NOT NULL)")
+                self.connection.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_readings_site_tank_time ON readings (site, tank, read_at)")
+        except sqlite3.Error as e:
+            self.logger.critical("Unable to open history database %s: %s", file, e)
+            raise CriticalError("Unable to open history database.") from e
+        self.logger.debug("History Store Initialized")
+
+    @staticmethod
+    def parse_date(date: str, default: float) -> str:
+        '''Converts the YYMMDDHHmm date of an i20100 response to an ISO timestamp'''
+        try:
+            return datetime.strptime(date, '%y%m%d%H%M').isoformat(sep=' ')
+        except (TypeError, ValueError):
+            return datetime.fromtimestamp(default).isoformat(sep=' ', timespec='seconds')
+
+    def append(self, site: str, snapshot: SiteSnapshot) -> None:
+        '''Appends one row for every tank in a parsed response'''
+        polled_at = time.time()
+        read_at = self.parse_date(snapshot.date, polled_at)
+        rows = [(site, tank.tank_number, tank.product_number,
+                 *(getattr(tank, column) for column in READING_COLUMNS),
+                 read_at, polled_at)
+                for tank in snapshot.tanks]
+        placeholders = ', '.join('?' * (len(READING_COLUMNS) + 5))
+        try:
+            with self.lock, self.metrics.timer('write_history'), self.connection:
+                self.connection.executemany(f"INSERT INTO readings VALUES ({placeholders})", rows)
+        except sqlite3.Error as e:
+            self.logger.error("Failed to append history for %s: %s", site, e)
+            raise SimpleError("Failed to append history.") from e
+        self.logger.debug("Appended %s readings for %s", len(rows), site)
+
+    def query(self, site: str, tank: str = None, start: str = None, end: str = None) -> List[dict]:
+        '''Returns the readings of a site, optionally for one tank and between two ISO timestamps'''
+        query = "SELECT * FROM readings WHERE site = ?"
+        parameters = [site]
+        if tank is not None:
+            query += " AND tank = ?"
+            parameters.append(tank)
+        if start is not None:
+            query += " AND read_at >= ?"
+            parameters.append(start)
+        if end is not None:
+            query += " AND read_at <= ?"
+            parameters.append(end)
+        query += " ORDER BY read_at"
+        with self.lock:
+            cursor = self.connection.execute(query, parameters)
+            columns = [description[0] for description in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def close(self) -> None:
+        '''Closes the database'''
+        with self.lock:
+            self.connection.close()
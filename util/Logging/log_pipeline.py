@@ -0,0 +1,136 @@
+'''Log Pipeline Class to keep log output off the event loop'''
+import contextvars
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import sys
+import uuid
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from conf import Settings
+
+TEXT_FORMAT = '%(levelname)s::%(module)s::%(filename)s::%(funcName)s::%(site)s::%(host)s::%(cycle)s::%(message)s'
+
+# Site, host and cycle id of the poll the current task is running, or None outside a poll
+log_context = contextvars.ContextVar('log_context', default=None)
+NO_CONTEXT = ('-', '-', '-')
+
+
+def new_cycle_id() -> str:
+    '''A short id shared by every log line of one sweep or report period'''
+    return uuid.uuid4().hex[:8]
+
+
+class ContextFilter(logging.Filter):
+    '''
+    Adds the site, host and cycle of the running poll to every record.
+
+    Must run on the thread that logged the record, before it is queued, because context variables
+    are not visible from the listener thread.
+    '''
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.site, record.host, record.cycle = log_context.get() or NO_CONTEXT
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    '''Formats each record as one JSON object per line'''
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {'time': self.formatTime(record), 'level': record.levelname, 'module': record.module,
+                 'function': record.funcName, 'site': record.site, 'host': record.host, 'cycle': record.cycle,
+                 'message': record.getMessage()}
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+def attach_worker(log_queue, level: int) -> None:
+    '''Sends the logs of a worker process to the coordinator's pipeline through log_queue'''
+    root_logger = logging.getLogger()
+    # Forked workers start with copies of the coordinator's handlers, which nothing reads from
+    for handler in list(root_logger.handlers):
+        root_logger.removeHandler(handler)
+    handler = QueueHandler(log_queue)
+    handler.addFilter(ContextFilter())
+    root_logger.addHandler(handler)
+    root_logger.setLevel(level)
+
+
+class LogPipeline:
+    '''
+    Writes logs to stdout and a size-rotated file from a listener thread.
+
+    Loggers only put records on an in-memory queue, so a slow terminal or disk never blocks the
+    event loop. The log file rolls over at max_bytes and keeps backup_count old files instead of
+    being truncated at start. Every record carries the site, host and cycle id of the poll that
+    logged it, as text columns or as JSON fields when log_format is "json". With use_queue off the
+    handlers are attached directly, as before.
+    '''
+    def __init__(self, folder: str, level: int = logging.INFO, max_bytes: int = 10485760,
+                 backup_count: int = 5, log_format: str = 'text', use_queue: bool = True):
+        self.logger = logging.getLogger()
+        self.file = os.path.join(folder, 'log.log')
+        self.level = level
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.log_format = log_format
+        self.use_queue = use_queue
+        self.handlers = []
+        self.listeners = []
+        self.queue = None
+        self.worker_log_queue = None
+
+    @classmethod
+    def from_settings(cls) -> 'LogPipeline':
+        '''Builds a log pipeline configured from Settings'''
+        return cls(Settings.LOG_FOLDER,
+                   level=Settings.LOG_LEVEL,
+                   max_bytes=Settings.LOG_MAX_BYTES,
+                   backup_count=Settings.LOG_BACKUP_COUNT,
+                   log_format=Settings.LOG_FORMAT,
+                   use_queue=Settings.LOG_QUEUE)
+
+    def start(self) -> None:
+        '''Attaches the pipeline to the root logger'''
+        formatter = JsonFormatter() if self.log_format == 'json' else logging.Formatter(TEXT_FORMAT)
+        self.handlers = [logging.StreamHandler(sys.stdout),
+                         RotatingFileHandler(self.file, maxBytes=self.max_bytes, backupCount=self.backup_count,
+                                             encoding='utf-8')]
+        for handler in self.handlers:
+            handler.setFormatter(formatter)
+        root_logger = logging.getLogger()
+        root_logger.setLevel(self.level)
+        if not self.use_queue:
+            for handler in self.handlers:
+                handler.addFilter(ContextFilter())
+                root_logger.addHandler(handler)
+            return
+        self.queue = queue.SimpleQueue()
+        handler = QueueHandler(self.queue)
+        handler.addFilter(ContextFilter())
+        root_logger.addHandler(handler)
+        self.listeners.append(QueueListener(self.queue, *self.handlers))
+        self.listeners[-1].start()
+
+    def worker_queue(self):
+        '''
+        Queue that worker processes log to, read by a listener in this process. Workers attach to it
+        with attach_worker(). Returns None when the pipeline is not queued
+        '''
+        if not self.use_queue:
+            return None
+        if self.worker_log_queue is None:
+            self.worker_log_queue = multiprocessing.Queue()
+            self.listeners.append(QueueListener(self.worker_log_queue, *self.handlers))
+            self.listeners[-1].start()
+        return self.worker_log_queue
+
+    def stop(self) -> None:
+        '''Writes out the queued records and stops the listener threads'''
+        for listener in self.listeners:
+            listener.stop()
+        self.listeners = []
+        for handler in self.handlers:
+            handler.close()
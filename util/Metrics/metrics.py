@@ -0,0 +1,152 @@
+'''Metrics Class to record latency histograms and counters'''
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from util.Writer.atomic_file import write_atomic
+
+# Upper bounds in seconds of the latency histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+METRIC_PREFIX = 'tank_reader'
+
+
+class Histogram:
+    '''Latency histogram with fixed buckets'''
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        '''Adds a value to the histogram'''
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def to_dict(self) -> dict:
+        '''Returns the histogram as a dictionary'''
+        return {'buckets': list(self.buckets), 'counts': list(self.counts), 'sum': self.total, 'count': self.count}
+
+    def merge(self, data: dict) -> None:
+        '''Adds the counts of a histogram returned by to_dict'''
+        for index, count in enumerate(data['counts']):
+            self.counts[index] += count
+        self.total += data['sum']
+        self.count += data['count']
+
+
+class Metrics:
+    '''
+    Process-wide latency histograms per stage and labelled counters.
+
+    Recording a value is a bisect and a few additions under a lock, so the metrics can stay enabled
+    in production. Use get_metrics() rather than creating instances.
+    '''
+    def __init__(self):
+        self.logger = logging.getLogger()
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.counters = {}
+        self.file = None
+        self.format = 'json'
+
+    def configure(self, file: str, file_format: str = 'json') -> None:
+        '''Sets the file export() writes to and its format, "json" or "prometheus"'''
+        self.file = file
+        self.format = file_format
+
+    def observe(self, stage: str, seconds: float) -> None:
+        '''Records the latency of a stage'''
+        with self.lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, stage: str):
+        '''Records the time spent in the with block as the latency of a stage'''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def increment(self, name: str, label: str = None, amount: float = 1) -> None:
+        '''Adds to a counter, optionally split by a label such as the error type'''
+        with self.lock:
+            counter = self.counters.setdefault(name, {})
+            counter[label] = counter.get(label, 0) + amount
+
+    def reset(self) -> None:
+        '''Clears every metric'''
+        with self.lock:
+            self.stages = {}
+            self.counters = {}
+
+    def snapshot(self) -> dict:
+        '''Returns a copy of every metric'''
+        with self.lock:
+            return {
+                'timestamp': time.time(),
+                'stages': {stage: histogram.to_dict() for stage, histogram in self.stages.items()},
+                'counters': {name: {'' if label is None else label: value for label, value in counter.items()}
+                             for name, counter in self.counters.items()}
+            }
+
+    def merge(self, snapshot: dict) -> None:
+        '''Adds the metrics of a snapshot taken in another process'''
+        with self.lock:
+            for stage, data in snapshot['stages'].items():
+                histogram = self.stages.get(stage)
+                if histogram is None:
+                    histogram = self.stages[stage] = Histogram(tuple(data['buckets']))
+                histogram.merge(data)
+            for name, values in snapshot['counters'].items():
+                counter = self.counters.setdefault(name, {})
+                for label, value in values.items():
+                    label = label or None
+                    counter[label] = counter.get(label, 0) + value
+
+    def to_prometheus(self) -> str:
+        '''Formats the metrics in the Prometheus text exposition format'''
+        snapshot = self.snapshot()
+        lines = [f"# TYPE {METRIC_PREFIX}_stage_seconds histogram"]
+        for stage, data in snapshot['stages'].items():
+            cumulative = 0
+            for bound, count in zip(data['buckets'], data['counts']):
+                cumulative += count
+                lines.append(f'{METRIC_PREFIX}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'{METRIC_PREFIX}_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {data["count"]}')
+            lines.append(f'{METRIC_PREFIX}_stage_seconds_sum{{stage="{stage}"}} {data["sum"]}')
+            lines.append(f'{METRIC_PREFIX}_stage_seconds_count{{stage="{stage}"}} {data["count"]}')
+        for name, values in snapshot['counters'].items():
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name}_total counter")
+            for label, value in values.items():
+                labels = f'{{type="{label}"}}' if label else ''
+                lines.append(f"{METRIC_PREFIX}_{name}_total{labels} {value}")
+        return '\n'.join(lines) + '\n'
+
+    def export(self) -> None:
+        '''Writes the metrics to the configured file, replacing it atomically'''
+        if self.file is None:
+            return
+        content = self.to_prometheus() if self.format == 'prometheus' \
+            else json.dumps(self.snapshot(), indent=4)
+        try:
+            write_atomic(content, self.file)
+            self.logger.debug("Wrote metrics to %s", self.file)
+        except OSError as e:
+            self.logger.error("Failed to write metrics to %s: %s", self.file, e)
+
+
+_metrics = Metrics()
+
+
+def get_metrics() -> Metrics:
+    '''Returns the metrics of this process'''
+    return _metrics
@@ -0,0 +1,129 @@
+'''Tank Reading and Site Snapshot Classes'''
+import json
+import math
+from json.encoder import encode_basestring_ascii
+from typing import List
+
+# Attributes of a reading mapped to their keys in the JSON export, in export order
+FIELD_KEYS = (
+    ('tank_number', 'tank_number'),
+    ('product_number', 'product_number'),
+    ('tank_status', 'tank_status'),
+    ('volume', 'Volume'),
+    ('tc_volume', 'TC Volume'),
+    ('ullage', 'Ullage'),
+    ('height', 'Height'),
+    ('water', 'Water'),
+    ('temperature', 'Temperature'),
+    ('water_volume', 'Water Volume')
+)
+# Attributes holding the decoded float fields, in the order they appear in a tank record
+FLOAT_ATTRIBUTES = tuple(attribute for attribute, _ in FIELD_KEYS[3:])
+
+
+def _json_value(value) -> str:
+    '''Formats a single value the same way json.dump does'''
+    if value is None:
+        return 'null'
+    if isinstance(value, str):
+        return encode_basestring_ascii(value)
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return 'Infinity' if value > 0 else '-Infinity'
+    return float.__repr__(value)
+
+
+class TankReading:
+    '''A single tank's reading from an i20100 response'''
+    __slots__ = tuple(attribute for attribute, _ in FIELD_KEYS)
+
+    def __init__(self, tank_number: str, product_number: str, tank_status: str,
+                 volume: float = None, tc_volume: float = None, ullage: float = None,
+                 height: float = None, water: float = None, temperature: float = None,
+                 water_volume: float = None):
+        self.tank_number = tank_number
+        self.product_number = product_number
+        self.tank_status = tank_status
+        self.volume = volume
+        self.tc_volume = tc_volume
+        self.ullage = ullage
+        self.height = height
+        self.water = water
+        self.temperature = temperature
+        self.water_volume = water_volume
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, TankReading):
+            return NotImplemented
+        return all(getattr(self, attribute) == getattr(other, attribute) for attribute in self.__slots__)
+
+    def __repr__(self) -> str:
+        return f"TankReading(tank_number={self.tank_number!r}, volume={self.volume!r})"
+
+    def has_malformed_fields(self) -> bool:
+        '''Checks if any float field could not be decoded'''
+        return any(getattr(self, attribute) is None for attribute in FLOAT_ATTRIBUTES)
+
+    def to_dict(self) -> dict:
+        '''Returns the reading with the keys used in the JSON export'''
+        return {key: getattr(self, attribute) for attribute, key in FIELD_KEYS}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'TankReading':
+        '''Builds a reading from its JSON export'''
+        return cls(**{attribute: data.get(key) for attribute, key in FIELD_KEYS})
+
+    def to_json(self, indent: str = '', step: str = '    ') -> str:
+        '''Formats the reading as a JSON object, matching json.dump with the given indentation'''
+        inner = indent + step
+        fields = (f'{inner}"{key}": {_json_value(getattr(self, attribute))}' for attribute, key in FIELD_KEYS)
+        return '{\n' + ',\n'.join(fields) + f'\n{indent}}}'
+
+
+class SiteSnapshot:
+    '''The readings of every tank at a site from one response'''
+    __slots__ = ('site', 'date', 'tanks', 'reports')
+
+    def __init__(self, date: str, tanks: List[TankReading] = None, site: str = None, reports: dict = None):
+        self.site = site
+        self.date = date
+        self.tanks = tanks if tanks is not None else []
+        # Decoded records of any other reports requested from the site, keyed by report name
+        self.reports = reports if reports is not None else {}
+
+    def has_malformed_fields(self) -> bool:
+        '''Checks if any field of any tank could not be decoded'''
+        return any(tank.has_malformed_fields() for tank in self.tanks)
+
+    def to_dict(self) -> dict:
+        '''Returns the snapshot in the shape of the JSON export'''
+        data = {} if self.site is None else {'site': self.site}
+        data['date'] = self.date
+        data['data'] = [tank.to_dict() for tank in self.tanks]
+        if self.reports:
+            data['reports'] = self.reports
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'SiteSnapshot':
+        '''Builds a snapshot from its JSON export'''
+        return cls(data.get('date'), [TankReading.from_dict(tank) for tank in data.get('data', [])],
+                   site=data.get('site'), reports=data.get('reports'))
+
+    def to_json(self) -> str:
+        '''Formats the snapshot as JSON, matching json.dump(snapshot.to_dict(), f, indent=4)'''
+        step = '    '
+        lines = []
+        if self.site is not None:
+            lines.append(f'{step}"site": {_json_value(self.site)}')
+        lines.append(f'{step}"date": {_json_value(self.date)}')
+        if self.tanks:
+            tanks = ',\n'.join(step * 2 + tank.to_json(step * 2, step) for tank in self.tanks)
+            lines.append(f'{step}"data": [\n{tanks}\n{step}]')
+        else:
+            lines.append(f'{step}"data": []')
+        if self.reports:
+            reports = json.dumps(self.reports, indent=4).replace('\n', '\n' + step)
+            lines.append(f'{step}"reports": {reports}')
+        return '{\n' + ',\n'.join(lines) + '\n}'
@@ -0,0 +1,96 @@
+'''Change Detector Class to skip writing readings that have not moved'''
+import logging
+import math
+import time
+
+from conf import Settings
+from util.Models.tank_reading import FLOAT_ATTRIBUTES, SiteSnapshot
+from util.Writer.atomic_file import load_json_state, save_json_state
+
+
+class ChangeDetector:
+    '''
+    Remembers the last written readings of every site and tank.
+
+    A snapshot has changed when a tank was added or removed, its product or status changed, one of
+    its readings moved further than the deadband for that reading since the last write, or any other
+    report, such as deliveries or alarms, differs from the last one written. Readings
+    without a deadband must match exactly. Missing, NaN and infinite readings all count as missing,
+    so a reading changes when it goes missing or comes back. Unchanged snapshots are reported as changed anyway once
+    heartbeat_interval seconds have passed since the site was last written.
+    '''
+    def __init__(self, deadbands: dict = None, heartbeat_interval: float = None,
+                 file: str = None, read_only: bool = False):
+        self.logger = logging.getLogger()
+        self.deadbands = [(attribute, (deadbands or {}).get(attribute, 0)) for attribute in FLOAT_ATTRIBUTES]
+        self.heartbeat_interval = heartbeat_interval
+        self.file = file
+        self.read_only = read_only
+        self.sites = {}
+        if file is not None:
+            self.load()
+        self.logger.debug("Change Detector Initialized")
+
+    @classmethod
+    def from_settings(cls, read_only: bool = False) -> 'ChangeDetector':
+        '''Builds a change detector configured from Settings'''
+        return cls(Settings.CHANGE_DEADBANDS,
+                   heartbeat_interval=Settings.HEARTBEAT_INTERVAL,
+                   file=Settings.CHANGE_CACHE_FILE,
+                   read_only=read_only)
+
+    @staticmethod
+    def _tank_state(tank) -> list:
+        '''The values of a tank that are compared'''
+        return [tank.product_number, tank.tank_status, *(getattr(tank, attribute) for attribute in FLOAT_ATTRIBUTES)]
+
+    @staticmethod
+    def _missing(value: float) -> bool:
+        '''Checks if a reading is missing or cannot be compared, such as NaN'''
+        return value is None or not math.isfinite(value)
+
+    def _tank_changed(self, tank, state: list) -> bool:
+        '''Checks a tank against its last written state'''
+        if state is None or tank.product_number != state[0] or tank.tank_status != state[1]:
+            return True
+        for (attribute, deadband), last in zip(self.deadbands, state[2:]):
+            value = getattr(tank, attribute)
+            missing = self._missing(value)
+            if missing or self._missing(last):
+                if missing != self._missing(last):
+                    return True
+            elif abs(value - last) > deadband:
+                return True
+        return False
+
+    def has_changed(self, snapshot: SiteSnapshot) -> bool:
+        '''Checks if a snapshot needs to be written'''
+        site = self.sites.get(snapshot.site)
+        if site is None:
+            return True
+        if self.heartbeat_interval is not None and time.time() - site['written_at'] >= self.heartbeat_interval:
+            return True
+        if site.get('reports', {}) != snapshot.reports:
+            return True
+        tanks = site['tanks']
+        if len(tanks) != len(snapshot.tanks):
+            return True
+        return any(self._tank_changed(tank, tanks.get(tank.tank_number)) for tank in snapshot.tanks)
+
+    def update(self, snapshot: SiteSnapshot) -> None:
+        '''Remembers a snapshot as the last one written for its site'''
+        self.sites[snapshot.site] = {
+            'written_at': time.time(),
+            'tanks': {tank.tank_number: self._tank_state(tank) for tank in snapshot.tanks},
+            'reports': snapshot.reports
+        }
+
+    def load(self) -> None:
+        '''Loads the last written readings from the file. A missing or unreadable file starts empty'''
+        self.sites = load_json_state(self.file, 'last written readings')
+
+    def save(self) -> None:
+        '''Saves the last written readings to the file, replacing it atomically'''
+        if self.file is None or self.read_only:
+            return
+        save_json_state(self.sites, self.file, 'last written readings')
@@ -0,0 +1,114 @@
+'''Health Tracker Class to stop polling sites that keep failing'''
+import logging
+import time
+
+from conf import Settings
+from util.Metrics.metrics import get_metrics
+from util.Writer.atomic_file import load_json_state, save_json_state
+
+
+class HealthTracker:
+    '''
+    Keeps a circuit breaker per site.
+
+    A site's circuit opens after failure_threshold failures in a row. While it is open the site is
+    not polled, except for a probe once the probe interval has passed. The interval starts at
+    probe_interval and doubles after every failed probe up to max_probe_interval. A successful poll
+    closes the circuit again. The health of every site is kept in a file so it carries over between
+    runs.
+    '''
+    def __init__(self, failure_threshold: int = 3, probe_interval: float = 900,
+                 max_probe_interval: float = 86400, file: str = None, read_only: bool = False):
+        self.logger = logging.getLogger()
+        self.metrics = get_metrics()
+        self.failure_threshold = max(1, failure_threshold)
+        self.probe_interval = probe_interval
+        self.max_probe_interval = max_probe_interval
+        self.file = file
+        self.read_only = read_only
+        # Sites that failed their last poll, mapped to their failure count, last error and next probe
+        self.sites = {}
+        if file is not None:
+            self.load()
+        self.logger.debug("Health Tracker Initialized")
+
+    @classmethod
+    def from_settings(cls, read_only: bool = False) -> 'HealthTracker':
+        '''Builds a health tracker configured from Settings'''
+        return cls(failure_threshold=Settings.CIRCUIT_FAILURE_THRESHOLD,
+                   probe_interval=Settings.CIRCUIT_PROBE_INTERVAL,
+                   max_probe_interval=Settings.CIRCUIT_MAX_PROBE_INTERVAL,
+                   file=Settings.HEALTH_FILE,
+                   read_only=read_only)
+
+    def failures(self, location: str) -> int:
+        '''Number of failures in a row of a site'''
+        state = self.sites.get(location)
+        return 0 if state is None else state['failures']
+
+    def allow(self, location: str) -> bool:
+        '''Checks if a site may be polled. Sites with an open circuit may only be probed'''
+        state = self.sites.get(location)
+        if state is None or state['next_probe'] is None:
+            return True
+        if time.time() >= state['next_probe']:
+            self.logger.info("Probing %s after %s failures in a row.", location, state['failures'])
+            self.metrics.increment('circuit', 'probe')
+            return True
+        self.metrics.increment('circuit', 'skipped')
+        return False
+
+    def record_success(self, location: str) -> None:
+        '''Closes the circuit of a site'''
+        state = self.sites.pop(location, None)
+        if state is not None and state['next_probe'] is not None:
+            self.logger.info("%s recovered after %s failures in a row. Closing its circuit.",
+                             location, state['failures'])
+            self.metrics.increment('circuit', 'closed')
+
+    def record_failure(self, location: str, reason: str) -> None:
+        '''Counts a failure of a site, opening its circuit or pushing back its next probe'''
+        state = self.sites.setdefault(location, {'failures': 0, 'last_error': None, 'next_probe': None})
+        state['failures'] += 1
+        state['last_error'] = reason
+        if state['failures'] < self.failure_threshold:
+            return
+        probes = state['failures'] - self.failure_threshold
+        interval = min(self.probe_interval * (2 ** probes), self.max_probe_interval)
+        if state['next_probe'] is None:
+            self.logger.warning("%s failed %s times in a row. Opening its circuit.", location, state['failures'])
+            self.metrics.increment('circuit', 'opened')
+        state['next_probe'] = time.time() + interval
+
+    def load(self) -> None:
+        '''Loads the health of every site from the file. A missing or unreadable file starts empty'''
+        self.sites = load_json_state(self.file, 'health of failing sites')
+
+    def save(self) -> None:
+        '''Saves the health of every site to the file, replacing it atomically'''
+        if self.file is None or self.read_only:
+            return
+        save_json_state(self.sites, self.file, 'health of failing sites')
+
+
+class RetryBudget:
+    '''
+    Number of retries a whole sweep may spend on failed sites.
+
+    Only sites that were healthy before the failure are retried, and each only once, so sites that
+    are known to be down never use up the budget.
+    '''
+    def __init__(self, retries: int):
+        self.retries = retries
+        self.retried = set()
+
+    def take(self, location: str, failures: int) -> bool:
+        '''
+        Spends a retry on a site if it qualifies and the budget is not used up. failures is the
+        number of failures in a row of the site before this sweep
+        '''
+        if self.retries <= 0 or failures > 0 or location in self.retried:
+            return False
+        self.retries -= 1
+        self.retried.add(location)
+        return True
@@ -0,0 +1,74 @@
+'''Sharded Poller Class to split a sweep across worker processes'''
+import asyncio
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+
+from conf import Settings
+from util.DataLoader.data_loader import DataLoader
+from util.Logging.log_pipeline import attach_worker
+from util.Metrics.metrics import get_metrics
+from util.Poller.site_poller import SitePoller, SweepSummary
+
+
+def poll_shard(sites: List[dict], cycle: str, retries: int) -> tuple:
+    '''Polls a shard of sites on the worker's own event loop. Returns the summary and metrics'''
+    # Forked workers start with a copy of the coordinator's metrics
+    get_metrics().reset()
+
+    async def sweep_shard() -> SweepSummary:
+        site_poller = SitePoller.from_settings(DataLoader(), shard=True)
+        try:
+            return await site_poller.sweep(sites, cycle, retries)
+        finally:
+            await site_poller.close()
+
+    return asyncio.run(sweep_shard()), get_metrics().snapshot()
+
+
+class ShardedPoller:
+    '''
+    Splits the sites across a pool of worker processes.
+
+    Every worker runs its own SitePoller over its shard and the summaries and metrics of all shards
+    are merged into those of the coordinator. A CriticalError raised in any worker is passed on to
+    the caller. The retry budget is sized from the whole sweep and split between the shards. Workers
+    log to log_queue when it is set, so their logs go through the coordinator's
+    log pipeline and share the cycle id of the sweep.
+    '''
+    def __init__(self, workers: int, log_queue=None):
+        self.logger = logging.getLogger()
+        self.workers = max(1, workers)
+        self.log_queue = log_queue
+        self.logger.debug("Sharded Poller Initialized")
+
+    def shard(self, sites: List[dict]) -> List[List[dict]]:
+        '''Deals the sites round-robin into one shard per worker'''
+        shards = [sites[index::self.workers] for index in range(self.workers)]
+        return [shard for shard in shards if len(shard) > 0]
+
+    @staticmethod
+    def split_retries(retries: int, shards: int) -> List[int]:
+        '''Splits the retry budget of a sweep as evenly as possible between the shards'''
+        return [retries // shards + (1 if index < retries % shards else 0) for index in range(shards)]
+
+    async def sweep(self, sites: List[dict]) -> SweepSummary:
+        '''Polls every site once across the worker processes'''
+        shards = self.shard(sites)
+        self.logger.info("Polling %s sites across %s worker processes.", len(sites), len(shards))
+        summary = SweepSummary()
+        if len(shards) == 0:
+            return summary
+        loop = asyncio.get_running_loop()
+        retries = self.split_retries(int(Settings.SWEEP_RETRY_BUDGET * len(sites)), len(shards))
+        initializer = None if self.log_queue is None else attach_worker
+        with ProcessPoolExecutor(max_workers=len(shards), initializer=initializer,
+                                 initargs=(self.log_queue, logging.getLogger().level)) as executor:
+            results = await asyncio.gather(*(loop.run_in_executor(executor, poll_shard, shard, summary.cycle,
+                                                                  shard_retries)
+                                             for shard, shard_retries in zip(shards, retries)))
+        metrics = get_metrics()
+        for shard_summary, shard_metrics in results:
+            summary.merge(shard_summary)
+            metrics.merge(shard_metrics)
+        return summary
@@ -0,0 +1,378 @@
+'''Site Poller Class to poll a list of sites concurrently'''
+import asyncio
+import logging
+import time
+from typing import List, Optional
+
+from conf import Settings
+from util.DataLoader.data_loader import DataLoader
+from util.DataLoader.decoders import get_decoder
+from util.DataLoader.stream_parser import StreamParser
+from util.Enums.transport import Transport
+from util.Exceptions.custom_exceptions import CriticalError, SimpleError
+from util.History.history_store import HistoryStore
+from util.Logging.log_pipeline import log_context, new_cycle_id
+from util.Metrics.metrics import get_metrics
+from util.Poller.change_detector import ChangeDetector
+from util.Poller.health_tracker import HealthTracker, RetryBudget
+from util.Query.readings_index import ReadingsIndex
+from util.Models.tank_reading import SiteSnapshot
+from util.TelnetConnetor.telnet_connector import TelnetConnector
+from util.Writer.background_writer import BackgroundWriter
+
+
+async def export_fleet(writer: BackgroundWriter, data_loader: DataLoader, snapshots: List[SiteSnapshot]) -> None:
+    '''Writes the consolidated fleet export configured in Settings. Failures are only logged'''
+    if not Settings.FLEET_EXPORT_FILE:
+        return
+    try:
+        await writer.write(data_loader.write_fleet_export,
+                           sorted(snapshots, key=lambda snapshot: snapshot.site),
+                           Settings.FLEET_EXPORT_FILE,
+                           Settings.FLEET_EXPORT_FORMAT,
+                           Settings.FAST_JSON)
+    except (CriticalError, SimpleError) as e:
+        logging.getLogger().error("Failed to write fleet export: %s", e)
+
+
+class SweepSummary:
+    '''Outcome of a sweep over a list of sites'''
+    def __init__(self, total: int = 0, cycle: str = None):
+        self.total = total
+        # Id shared by the log lines of every poll recorded in this summary
+        self.cycle = cycle or new_cycle_id()
+        self.success_count = 0
+        self.succeeded_list = []
+        self.failed_list = []
+        self.failures = {}
+        self.durations = {}
+        self.snapshots = {}
+        self.written_list = []
+        self.skipped_list = []
+        self.circuit_open_list = []
+        # Frames received from each site and how many of them failed their checksum
+        self.frames = {}
+        # Health of the polled sites after the sweep, None for healthy sites
+        self.site_health = {}
+
+    def record_success(self, location: str, snapshot: SiteSnapshot = None) -> None:
+        '''Records a site that was polled and exported successfully along with its readings'''
+        self.success_count += 1
+        self.succeeded_list.append(location)
+        if snapshot is not None:
+            self.snapshots[location] = snapshot
+
+    def record_written(self, location: str) -> None:
+        '''Records a site whose readings changed and were written'''
+        self.written_list.append(location)
+
+    def record_skipped(self, location: str) -> None:
+        '''Records a site whose readings had not changed, so nothing was written'''
+        self.skipped_list.append(location)
+
+    def record_frames(self, location: str, frames: int, corrupt_frames: int) -> None:
+        '''Adds to the frames received from a site and how many of them were corrupted'''
+        total, corrupt = self.frames.get(location, (0, 0))
+        self.frames[location] = (total + frames, corrupt + corrupt_frames)
+
+    def corruption_rates(self) -> dict:
+        '''Fraction of the frames from each site that failed their checksum, for sites with any'''
+        return {location: corrupt / total for location, (total, corrupt) in self.frames.items() if corrupt > 0}
+
+    def record_circuit_open(self, location: str) -> None:
+        '''Records a site that was not polled because its circuit is open'''
+        self.circuit_open_list.append(location)
+
+    def record_failure(self, location: str, reason: str) -> None:
+        '''Records a site that failed along with the reason'''
+        self.failed_list.append(location)
+        self.failures[location] = reason
+
+    def merge(self, other: 'SweepSummary') -> None:
+        '''Adds the outcome of another sweep, such as one run by a separate worker'''
+        self.total += other.total
+        self.success_count += other.success_count
+        self.succeeded_list.extend(other.succeeded_list)
+        self.failed_list.extend(other.failed_list)
+        self.failures.update(other.failures)
+        self.durations.update(other.durations)
+        self.snapshots.update(other.snapshots)
+        self.written_list.extend(other.written_list)
+        self.skipped_list.extend(other.skipped_list)
+        self.circuit_open_list.extend(other.circuit_open_list)
+        for location, (frames, corrupt_frames) in other.frames.items():
+            self.record_frames(location, frames, corrupt_frames)
+        self.site_health.update(other.site_health)
+
+
+class SitePoller:
+    '''Polls sites for tank data and exports the results'''
+    def __init__(self, data_loader: DataLoader,
+                 telnet_connector: TelnetConnector,
+                 max_concurrency: int = 1,
+                 write_captures: bool = False,
+                 history_store: HistoryStore = None,
+                 per_site_exports: bool = True,
+                 change_detector: ChangeDetector = None,
+                 writer: BackgroundWriter = None,
+                 health_tracker: HealthTracker = None,
+                 retry_fraction: float = 0.0,
+                 retry_delay: float = 1.0,
+                 readings_index: ReadingsIndex = None):
+        self.logger = logging.getLogger()
+        self.data_loader = data_loader
+        self.telnet_connector = telnet_connector
+        self.max_concurrency = max(1, max_concurrency)
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.write_captures = write_captures
+        self.history_store = history_store
+        self.per_site_exports = per_site_exports
+        self.change_detector = change_detector
+        self.writer = writer or BackgroundWriter()
+        self.metrics = get_metrics()
+        self.health_tracker = health_tracker
+        self.retry_fraction = retry_fraction
+        self.retry_delay = retry_delay
+        self.readings_index = readings_index
+        self.logger.debug("Site Poller Initialized")
+
+    @classmethod
+    def from_settings(cls, data_loader: DataLoader, shard: bool = False) -> 'SitePoller':
+        '''
+        Builds a poller configured from Settings. A shard poller does not save the last written
+        readings or the health of its sites, the coordinator of the shards does.
+        '''
+        telnet_connector = TelnetConnector(connect_timeout=Settings.CONNECT_TIMEOUT,
+                                           read_timeout=Settings.READ_TIMEOUT,
+                                           keep_alive=Settings.KEEP_SESSIONS_ALIVE,
+                                           idle_timeout=Settings.SESSION_IDLE_TIMEOUT,
+                                           frame_retries=Settings.CORRUPT_FRAME_RETRIES)
+        history_store = HistoryStore(Settings.HISTORY_FILE) if Settings.HISTORY_FILE else None
+        change_detector = ChangeDetector.from_settings(read_only=shard) if Settings.CHANGE_DETECTION else None
+        health_tracker = HealthTracker.from_settings(read_only=shard) if Settings.CIRCUIT_BREAKER else None
+        return cls(data_loader, telnet_connector,
+                   max_concurrency=Settings.MAX_CONCURRENT_SITES,
+                   write_captures=Settings.WRITE_TEXT_CAPTURE,
+                   history_store=history_store,
+                   per_site_exports=Settings.PER_SITE_EXPORTS,
+                   change_detector=change_detector,
+                   writer=BackgroundWriter(workers=Settings.WRITER_THREADS,
+                                           max_pending=Settings.MAX_PENDING_WRITES),
+                   health_tracker=health_tracker,
+                   retry_fraction=Settings.SWEEP_RETRY_BUDGET,
+                   retry_delay=Settings.RETRY_DELAY)
+
+    @staticmethod
+    def site_transport(site: dict) -> Transport:
+        '''The transport of a site, from its "Transport" key or the default in Settings'''
+        if 'Transport' not in site:
+            return Settings.DEFAULT_TRANSPORT
+        try:
+            return Transport(site['Transport'])
+        except ValueError as e:
+            raise SimpleError(f"Unknown transport {site['Transport']}.") from e
+
+    async def retrieve(self, site: dict, commands: List[str]) -> list:
+        '''
+        Sends every command to a site on one session, decoding each tank as soon as its record
+        arrives. Returns the parsers holding the responses
+        '''
+        parsers = [get_decoder(command).create_parser(self.data_loader, command) for command in commands]
+        # Checked once per site rather than once per tank
+        debug = self.logger.isEnabledFor(logging.DEBUG)
+        async for item in self.telnet_connector.stream_responses(host=site['Host'],
+                                                                 port=site['Port'],
+                                                                 parsers=parsers,
+                                                                 transport=self.site_transport(site)):
+            if debug:
+                self.logger.debug("Received tank %s", item.tank_number)
+        return parsers
+
+    async def poll_site(self, site: dict, summary: SweepSummary, retry_budget: RetryBudget = None) -> Optional[bool]:
+        '''
+        Retrieves, stores and exports the tank data for a single site. A site that fails to answer
+        is retried once if the retry budget of the sweep allows it. Returns True if the site was
+        polled, False if it failed and None if it was skipped because its circuit is open.
+        '''
+        dl = self.data_loader
+        location = site['Location']
+        export_text_file = f"{Settings.EXPORT_FOLDER}/{location}.txt"
+        export_json_file = f"{Settings.JSON_EXPORT_FOLDER}/{location}.json"
+        health = self.health_tracker
+        if health is not None and not health.allow(location):
+            self.logger.info("Circuit for %s is open. Skipping...", location)
+            summary.record_circuit_open(location)
+            return None
+
+        # Get Tank Data
+        self.logger.info("Retrieving data from %s....", location)
+        commands = site.get('Commands') or [site['Command']]
+        # Failures in a row before this sweep. A retried site still counts as one failure per sweep
+        failures = 0 if health is None else health.failures(location)
+        while True:
+            try:
+                parsers = await self.retrieve(site, commands)
+                break
+            except SimpleError as e:
+                self.logger.error(
+                    "Failed to retrieve data from %s at %s on port %s with commands %s.",
+                    location,
+                    site['Host'],
+                    site['Port'],
+                    ', '.join(commands))
+                if retry_budget is None or not retry_budget.take(location, failures):
+                    self.logger.error("Skipping %s...", location)
+                    if health is not None:
+                        health.record_failure(location, str(e))
+                    summary.record_failure(location, str(e))
+                    return False
+            self.logger.info("Retrying %s in %s seconds...", location, self.retry_delay)
+            self.metrics.increment('retries')
+            await asyncio.sleep(self.retry_delay)
+        summary.record_frames(location,
+                              sum(parser.frames for parser in parsers),
+                              sum(parser.corrupt_frames for parser in parsers))
+        response_content = ''.join(parser.raw for parser in parsers)
+        snapshot = SiteSnapshot(None, site=location)
+        undecoded = False
+        reason = "Incomplete response received."
+        # Reports go first so the inventory sets the date of the snapshot when it was requested
+        for parser in sorted(parsers, key=lambda parser: isinstance(parser, StreamParser)):
+            try:
+                parser.apply(snapshot)
+            except SimpleError as e:
+                self.logger.error("Failed to decode the response to %s from %s: %s",
+                                  parser.command, location, e)
+                self.metrics.increment('errors', 'decode')
+                undecoded = True
+                if isinstance(parser, StreamParser):
+                    reason = str(e)
+        if snapshot.date is None:
+            self.logger.error("No usable response received from %s: %s", location, reason)
+            await self.write_capture(response_content, export_text_file)
+            if health is not None:
+                health.record_failure(location, reason)
+            summary.record_failure(location, reason)
+            return False
+        # Only a response that could be used closes the circuit
+        if health is not None:
+            health.record_success(location)
+        if self.write_captures or undecoded or snapshot.has_malformed_fields():
+            await self.write_capture(response_content, export_text_file)
+        self.logger.info("Successfully parsed data for %s.", location)
+        if self.readings_index is not None:
+            self.readings_index.update(snapshot)
+        if self.change_detector is not None and not self.change_detector.has_changed(snapshot):
+            self.logger.info("Readings for %s have not changed. Skipping writes.", location)
+            summary.record_skipped(location)
+            summary.record_success(location, snapshot)
+            return True
+        self.logger.info("Writing data to JSON file...")
+
+        # Write data to JSON file
+        if self.per_site_exports:
+            try:
+                await self.writer.write(dl.write_snapshot_to_json, snapshot, export_json_file)
+            except CriticalError as e:
+                self.logger.critical("Critical Error: %s", e)
+                summary.record_failure(location, str(e))
+                return False
+            except SimpleError as e:
+                self.logger.error("Failed to write data to JSON file: %s", e)
+                summary.record_failure(location, str(e))
+                return False
+
+        # Append the readings to the history
+        if self.history_store is not None:
+            try:
+                await self.writer.write(self.history_store.append, location, snapshot)
+            except SimpleError as e:
+                self.logger.error("Failed to append history: %s", e)
+                summary.record_failure(location, str(e))
+                return False
+        if self.change_detector is not None:
+            self.change_detector.update(snapshot)
+        summary.record_written(location)
+        summary.record_success(location, snapshot)
+        return True
+
+    async def write_capture(self, response_content: str, export_text_file: str) -> None:
+        '''Writes the raw response to a text file off the event loop. Failures are only logged'''
+        try:
+            await self.writer.write(self.data_loader.write_string_to_file, response_content, export_text_file)
+        except (CriticalError, SimpleError) as e:
+            self.logger.error("Failed to write raw response to %s: %s", export_text_file, e)
+
+    async def bounded_poll_site(self, site: dict, summary: SweepSummary,
+                                retry_budget: RetryBudget = None) -> Optional[bool]:
+        '''Polls a single site once a slot is free under the poller's concurrency limit, like poll_site()'''
+        async with self.semaphore:
+            start = time.perf_counter()
+            context = log_context.set((site['Location'], site['Host'], summary.cycle))
+            try:
+                return await self.poll_site(site, summary, retry_budget)
+            finally:
+                log_context.reset(context)
+                summary.durations[site['Location']] = time.perf_counter() - start
+
+    async def sweep(self, sites: List[dict], cycle: str = None, retries: int = None) -> SweepSummary:
+        '''
+        Polls every site, running up to max_concurrency sites at once. Up to retry_fraction of the
+        sites may be retried once when they fail to answer, or the given number of retries when the
+        sites are a shard of a larger sweep.
+
+        A CriticalError raised while retrieving data from any site cancels the remaining sites and
+        is passed on to the caller.
+        '''
+        summary = SweepSummary(total=len(sites), cycle=cycle)
+        self.logger.debug("Polling %s sites with a concurrency of %s", len(sites), self.max_concurrency)
+        retry_budget = RetryBudget(int(self.retry_fraction * len(sites)) if retries is None else retries)
+        tasks = [asyncio.create_task(self.bounded_poll_site(site, summary, retry_budget)) for site in sites]
+        try:
+            await asyncio.gather(*tasks)
+        except CriticalError:
+            for task in tasks:
+                task.cancel()
+            raise
+        await self.telnet_connector.close_idle_sessions()
+        if self.health_tracker is not None:
+            summary.site_health = {site['Location']: self.health_tracker.sites.get(site['Location'])
+                                   for site in sites}
+        return summary
+
+    def absorb(self, summary: SweepSummary) -> None:
+        '''
+        Takes over the last written readings and health of the sites in a sweep run by shard
+        pollers, which do not save them, so close() saves them for all shards
+        '''
+        if self.change_detector is not None:
+            for location in summary.written_list:
+                self.change_detector.update(summary.snapshots[location])
+        if self.health_tracker is not None:
+            for location, state in summary.site_health.items():
+                if state is None:
+                    self.health_tracker.sites.pop(location, None)
+                else:
+                    self.health_tracker.sites[location] = state
+
+    async def forget(self, site: dict) -> None:
+        '''Drops everything the poller holds about a site that was removed or moved to another address'''
+        location = site['Location']
+        if self.readings_index is not None:
+            self.readings_index.remove(location)
+        if self.change_detector is not None:
+            self.change_detector.sites.pop(location, None)
+        if self.health_tracker is not None:
+            self.health_tracker.sites.pop(location, None)
+        await self.telnet_connector.discard(site['Host'], site['Port'])
+
+    async def close(self) -> None:
+        '''Finishes the queued writes and closes every session and store held open by the poller'''
+        await self.telnet_connector.close_all()
+        if self.change_detector is not None:
+            await self.writer.write(self.change_detector.save)
+        if self.health_tracker is not None:
+            await self.writer.write(self.health_tracker.save)
+        await self.writer.close()
+        if self.history_store is not None:
+            self.history_store.close()
@@ -0,0 +1,87 @@
+'''Query Server Class to serve the readings index over local HTTP'''
+import asyncio
+import json
+import logging
+from urllib.parse import unquote
+
+from util.Exceptions.custom_exceptions import CriticalError
+from util.Metrics.metrics import get_metrics
+from util.Query.readings_index import ReadingsIndex
+
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed'}
+
+
+class QueryServer:
+    '''
+    Answers GET requests from the readings index with JSON over HTTP/1.0.
+
+    Listens on a Unix socket when socket_path is set and on host and port otherwise. The paths are
+    /totals, /low-inventory, /water-alarms, /summary and /sites/<Location>. Every connection
+    answers a single request.
+    '''
+    def __init__(self, index: ReadingsIndex, host: str = '127.0.0.1', port: int = 8420,
+                 socket_path: str = None, request_timeout: float = 5):
+        self.logger = logging.getLogger()
+        self.metrics = get_metrics()
+        self.index = index
+        self.host = host
+        self.port = port
+        self.socket_path = socket_path
+        self.request_timeout = request_timeout
+        self.server = None
+        self.logger.debug("Query Server Initialized")
+
+    def route(self, method: str, path: str) -> tuple:
+        '''Returns the status and JSON body answering a request'''
+        if method != 'GET':
+            return 405, b'{"error": "Only GET is supported."}'
+        path = unquote(path.split('?', 1)[0]).strip('/')
+        if path.startswith('sites/'):
+            site = self.index.site(path[len('sites/'):])
+            if site is None:
+                return 404, b'{"error": "Unknown site."}'
+            return 200, json.dumps(site).encode()
+        content = self.index.answer_json(path)
+        if content is None:
+            return 404, b'{"error": "Unknown query."}'
+        return 200, content
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        '''Reads one request from a connection and writes the answer'''
+        try:
+            with self.metrics.timer('query'):
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout=self.request_timeout)
+                    method, path, _ = head.split(b'\r\n', 1)[0].decode('latin-1').split(' ', 2)
+                    status, body = self.route(method, path)
+                except ValueError:
+                    status, body = 400, b'{"error": "Malformed request."}'
+                writer.write(f"HTTP/1.0 {status} {STATUS_TEXT[status]}\r\n"
+                             f"Content-Type: application/json\r\n"
+                             f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.exceptions.TimeoutError,
+                ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self) -> None:
+        '''Starts listening. Raises CriticalError if the socket cannot be opened'''
+        try:
+            if self.socket_path is not None:
+                self.server = await asyncio.start_unix_server(self.handle, path=self.socket_path)
+                self.logger.info("Serving queries on %s", self.socket_path)
+            else:
+                self.server = await asyncio.start_server(self.handle, self.host, self.port)
+                self.logger.info("Serving queries on http://%s:%s", self.host, self.port)
+        except OSError as e:
+            self.logger.critical("Unable to start the query server: %s", e)
+            raise CriticalError("Unable to start the query server.") from e
+
+    async def close(self) -> None:
+        '''Stops listening'''
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
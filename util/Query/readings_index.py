@@ -0,0 +1,149 @@
+'''Readings Index Class to answer fleet-wide questions from memory'''
+import json
+import logging
+import math
+
+from conf import Settings
+from util.Models.tank_reading import SiteSnapshot, TankReading
+
+# Readings summed per product
+TOTAL_ATTRIBUTES = ('volume', 'tc_volume', 'ullage', 'water_volume')
+
+
+class ReadingsIndex:
+    '''
+    Keeps the latest reading of every tank at every site.
+
+    Per-product totals and the low inventory and water alarm lists are updated incrementally each
+    time a site is parsed, by taking out the site's previous readings and adding the new ones, so
+    queries never walk the whole fleet. A tank is low on inventory when its volume is below
+    low_inventory_fraction of its capacity (volume plus ullage), and has a water alarm when its
+    water height is above water_alarm_level. Listed tanks are kept as JSON from the moment they
+    are added, and answers are cached until the next update, so a query only joins bytes.
+    '''
+    def __init__(self, low_inventory_fraction: float = 0.2, water_alarm_level: float = 2.0,
+                 product_names: dict = None):
+        self.logger = logging.getLogger()
+        self.low_inventory_fraction = low_inventory_fraction
+        self.water_alarm_level = water_alarm_level
+        self.product_names = product_names or {}
+        self.sites = {}
+        self.dates = {}
+        self.totals = {}
+        self.low_inventory = {}
+        self.water_alarms = {}
+        self.tank_count = 0
+        self.cache = {}
+        self.logger.debug("Readings Index Initialized")
+
+    @classmethod
+    def from_settings(cls) -> 'ReadingsIndex':
+        '''Builds an index configured from Settings'''
+        return cls(low_inventory_fraction=Settings.LOW_INVENTORY_FRACTION,
+                   water_alarm_level=Settings.WATER_ALARM_LEVEL,
+                   product_names=Settings.PRODUCT_NAMES)
+
+    def product(self, tank: TankReading) -> str:
+        '''Name of the product in a tank, falling back to its product number'''
+        return self.product_names.get(tank.product_number, tank.product_number)
+
+    @staticmethod
+    def _finite(value: float) -> float:
+        '''A reading, or None if it is missing, NaN or infinite and so cannot be summed or compared'''
+        return value if value is not None and math.isfinite(value) else None
+
+    def _entry(self, site: str, tank: TankReading) -> bytes:
+        '''A tank as listed in the answers, as JSON'''
+        return json.dumps({'site': site, 'tank_number': tank.tank_number, 'product': self.product(tank),
+                           'volume': self._finite(tank.volume), 'ullage': self._finite(tank.ullage),
+                           'water': self._finite(tank.water)}).encode()
+
+    def _add(self, site: str, tank: TankReading, sign: int) -> None:
+        '''Adds a tank to the totals and lists, or takes it out again with a sign of -1'''
+        product = self.product(tank)
+        totals = self.totals.get(product)
+        if totals is None:
+            totals = self.totals[product] = dict.fromkeys(TOTAL_ATTRIBUTES, 0.0)
+            totals['tanks'] = 0
+        totals['tanks'] += sign
+        # NaN and infinite readings are left out, as they could never be taken back out of a total
+        for attribute in TOTAL_ATTRIBUTES:
+            value = self._finite(getattr(tank, attribute))
+            if value is not None:
+                totals[attribute] += sign * value
+        key = (site, tank.tank_number)
+        if sign < 0:
+            self.low_inventory.pop(key, None)
+            self.water_alarms.pop(key, None)
+            return
+        volume, ullage, water = self._finite(tank.volume), self._finite(tank.ullage), self._finite(tank.water)
+        if volume is not None and ullage is not None and volume + ullage > 0 \
+                and volume / (volume + ullage) < self.low_inventory_fraction:
+            self.low_inventory[key] = self._entry(site, tank)
+        if water is not None and water > self.water_alarm_level:
+            self.water_alarms[key] = self._entry(site, tank)
+
+    def update(self, snapshot: SiteSnapshot) -> None:
+        '''Replaces the readings of a site with those of a new snapshot'''
+        previous = self.sites.get(snapshot.site, {})
+        for tank in previous.values():
+            self._add(snapshot.site, tank, -1)
+        tanks = self.sites[snapshot.site] = {tank.tank_number: tank for tank in snapshot.tanks}
+        self.dates[snapshot.site] = snapshot.date
+        for tank in tanks.values():
+            self._add(snapshot.site, tank, 1)
+        self.tank_count += len(tanks) - len(previous)
+        self.cache = {}
+
+    def remove(self, location: str) -> None:
+        '''Takes a site out of the index'''
+        tanks = self.sites.pop(location, None)
+        if tanks is None:
+            return
+        self.dates.pop(location, None)
+        for tank in tanks.values():
+            self._add(location, tank, -1)
+        self.tank_count -= len(tanks)
+        self.cache = {}
+
+    @staticmethod
+    def _listing(threshold: float, entries: dict) -> bytes:
+        '''JSON of a list of tanks along with the threshold they were listed by'''
+        return b'{"threshold": %s, "tanks": [%s]}' % (json.dumps(threshold).encode(), b', '.join(entries.values()))
+
+    def answer(self, name: str) -> bytes:
+        '''The answer to one of the precomputed queries as JSON, or None if there is no such query'''
+        if name == 'totals':
+            return json.dumps({product: totals for product, totals in self.totals.items()
+                               if totals['tanks'] > 0}).encode()
+        if name == 'low-inventory':
+            return self._listing(self.low_inventory_fraction, self.low_inventory)
+        if name == 'water-alarms':
+            return self._listing(self.water_alarm_level, self.water_alarms)
+        if name == 'summary':
+            return json.dumps({'sites': len(self.sites), 'tanks': self.tank_count,
+                               'low_inventory': len(self.low_inventory),
+                               'water_alarms': len(self.water_alarms)}).encode()
+        return None
+
+    def site(self, location: str) -> dict:
+        '''
+        The latest readings of a site, or None if the site has not been polled. NaN and infinite
+        readings are None, so the readings can be answered as JSON
+        '''
+        tanks = self.sites.get(location)
+        if tanks is None:
+            return None
+        data = SiteSnapshot(self.dates[location], list(tanks.values()), site=location).to_dict()
+        data['data'] = [{key: self._finite(value) if isinstance(value, float) else value for key, value in tank.items()}
+                        for tank in data['data']]
+        return data
+
+    def answer_json(self, name: str) -> bytes:
+        '''The answer to a precomputed query as JSON, cached until the next update'''
+        content = self.cache.get(name)
+        if content is None:
+            content = self.answer(name)
+            if content is not None:
+                self.cache[name] = content
+        return content
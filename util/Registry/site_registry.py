@@ -0,0 +1,202 @@
+'''Site Registry Class to validate, index and reload the site file'''
+import json
+import logging
+import os
+from typing import List
+
+from conf import Settings
+from util.DataLoader.decoders import get_decoder
+from util.Enums.transport import Transport
+from util.Exceptions.custom_exceptions import CriticalError, SimpleError
+from util.TelnetConnetor.telnet_connector import TELNET_MISSING, telnet_available
+
+# Number of problems listed when a site file is rejected
+MAX_REPORTED_ERRORS = 20
+
+
+class SiteChanges:
+    '''Sites added, removed and changed between two versions of the site file'''
+    def __init__(self, added: List[dict], removed: List[dict], changed: List[tuple]):
+        self.added = added
+        self.removed = removed
+        # Pairs of the old and new entry of every changed site
+        self.changed = changed
+
+    def __bool__(self) -> bool:
+        return len(self.added) + len(self.removed) + len(self.changed) > 0
+
+    def __repr__(self) -> str:
+        return f"SiteChanges(added={len(self.added)}, removed={len(self.removed)}, changed={len(self.changed)})"
+
+
+class SiteRegistry:
+    '''
+    Holds the validated list of sites from the site file.
+
+    Every entry is checked when the file is loaded: required keys and their types, the port range,
+    known commands and transports, that telnetlib3 is installed when any site uses the telnet
+    transport, and that no location or host and port appears twice. Sites are indexed by location
+    and by host. reload() notices when the file has changed on disk and returns only the sites that
+    were added, removed or changed. A file that fails validation on reload is logged as an error and
+    ignored, so the sites already loaded keep running. reload() reads the file, so callers on an
+    event loop run it in a thread.
+    '''
+    def __init__(self, file: str):
+        self.logger = logging.getLogger()
+        self.file = file
+        self.sites = []
+        self.by_location = {}
+        # Sites sharing a host, such as the consoles behind one serial-to-Ethernet converter
+        self.by_host = {}
+        self.file_state = None
+        self.logger.debug("Site Registry Initialized")
+
+    @staticmethod
+    def validate_site(site) -> List[str]:
+        '''Returns the problems with a single entry of the site file'''
+        if not isinstance(site, dict):
+            return ["entry is not an object"]
+        errors = []
+        for key in ('Location', 'Host'):
+            if not isinstance(site.get(key), str) or site[key].strip() == '':
+                errors.append(f"{key} must be a non-empty string")
+        port = site.get('Port')
+        if not isinstance(port, int) or isinstance(port, bool) or not 1 <= port <= 65535:
+            errors.append("Port must be a whole number from 1 to 65535")
+        commands = site.get('Commands') or [site.get('Command')]
+        if not isinstance(commands, list):
+            errors.append("Commands must be a list of commands")
+            commands = []
+        for command in commands:
+            if not isinstance(command, str):
+                errors.append("Command must be a string")
+                continue
+            try:
+                get_decoder(command)
+            except SimpleError as e:
+                errors.append(str(e))
+        interval = site.get('Interval')
+        if interval is not None and (not isinstance(interval, (int, float)) or isinstance(interval, bool)
+                                     or interval <= 0):
+            errors.append("Interval must be a positive number of seconds")
+        if 'Transport' in site and site['Transport'] not in [transport.value for transport in Transport]:
+            errors.append(f"Transport must be one of {', '.join(transport.value for transport in Transport)}")
+        return errors
+
+    def validate(self, sites) -> List[str]:
+        '''Returns the problems with every entry of the site file, naming the entry of each'''
+        if not isinstance(sites, list) or len(sites) == 0:
+            return ["Site file must contain a list of sites"]
+        errors = []
+        locations = {}
+        addresses = {}
+        for number, site in enumerate(sites, start=1):
+            name = f"Site {number}"
+            if isinstance(site, dict) and 'Location' in site:
+                name += f" ({site['Location']})"
+            errors.extend(f"{name}: {error}" for error in self.validate_site(site))
+            if not isinstance(site, dict):
+                continue
+            location = site.get('Location')
+            if isinstance(location, str):
+                if location in locations:
+                    errors.append(f"{name}: Location is already used by site {locations[location]}")
+                locations.setdefault(location, number)
+            address = (site.get('Host'), site.get('Port'))
+            if isinstance(address[0], str) and isinstance(address[1], int):
+                if address in addresses:
+                    errors.append(f"{name}: {address[0]}:{address[1]} is already used by site {addresses[address]}")
+                addresses.setdefault(address, number)
+        uses_telnet = any(isinstance(site, dict) and site.get('Transport', Settings.DEFAULT_TRANSPORT.value)
+                          == Transport.TELNET.value for site in sites)
+        if uses_telnet and not telnet_available():
+            errors.append(TELNET_MISSING)
+        return errors
+
+    def _file_state(self) -> tuple:
+        '''Modification time and size of the site file, used to notice changes'''
+        stat = os.stat(self.file)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _load_json(self) -> list:
+        '''
+        Reads the site file. Nothing is checked or logged here, so that validate() can report every
+        problem with the file and a file that cannot be reloaded leaves the current sites running.
+        Raises SimpleError
+        '''
+        try:
+            with open(self.file, mode='r', encoding='utf-8') as f:
+                return json.load(f)
+        except OSError as e:
+            raise SimpleError(f"Unable to read site file: {e}") from e
+        except json.JSONDecodeError as e:
+            raise SimpleError(f"Site file is not a valid JSON file: {e}") from e
+
+    def _read(self) -> List[dict]:
+        '''Reads and validates the site file. Raises CriticalError listing the problems found'''
+        file_state = self._file_state()
+        sites = self._load_json()
+        errors = self.validate(sites)
+        if len(errors) > 0:
+            for error in errors[:MAX_REPORTED_ERRORS]:
+                self.logger.error("Invalid site file %s: %s", self.file, error)
+            if len(errors) > MAX_REPORTED_ERRORS:
+                self.logger.error("... and %s more problems", len(errors) - MAX_REPORTED_ERRORS)
+            raise CriticalError(f"Site file has {len(errors)} problems.")
+        self.file_state = file_state
+        return sites
+
+    def _index(self, sites: List[dict]) -> None:
+        '''Replaces the sites and rebuilds the indexes'''
+        self.sites = sites
+        self.by_location = {site['Location']: site for site in sites}
+        self.by_host = {}
+        for site in sites:
+            self.by_host.setdefault(site['Host'], []).append(site)
+
+    def load(self) -> List[dict]:
+        '''Loads the site file. Raises CriticalError if it is missing or invalid'''
+        try:
+            self._index(self._read())
+        except OSError as e:
+            self.logger.critical("Unable to read site file %s: %s", self.file, e)
+            raise CriticalError("Data file not found.") from e
+        except SimpleError as e:
+            self.logger.critical("Unable to load site file %s: %s", self.file, e)
+            raise CriticalError(str(e)) from e
+        self.logger.info("Loaded %s sites from %s", len(self.sites), self.file)
+        return self.sites
+
+    def diff(self, sites: List[dict]) -> SiteChanges:
+        '''Compares a new list of sites against the loaded one by location'''
+        new_sites = {site['Location']: site for site in sites}
+        added = [site for location, site in new_sites.items() if location not in self.by_location]
+        removed = [site for location, site in self.by_location.items() if location not in new_sites]
+        changed = [(self.by_location[location], site) for location, site in new_sites.items()
+                   if location in self.by_location and self.by_location[location] != site]
+        return SiteChanges(added, removed, changed)
+
+    def reload(self) -> SiteChanges:
+        '''
+        Loads the site file again if it changed on disk. Returns the changes, which are empty when
+        the file did not change or could not be loaded
+        '''
+        try:
+            if self._file_state() == self.file_state:
+                return SiteChanges([], [], [])
+            sites = self._read()
+        except (OSError, CriticalError, SimpleError) as e:
+            self.logger.error("Keeping the current %s sites. Unable to reload %s: %s",
+                              len(self.sites), self.file, e)
+            try:
+                # Do not report the same broken file again until it changes
+                self.file_state = self._file_state()
+            except OSError:
+                pass
+            return SiteChanges([], [], [])
+        changes = self.diff(sites)
+        self._index(sites)
+        if changes:
+            self.logger.info("Reloaded %s: %s sites added, %s removed, %s changed", self.file,
+                             len(changes.added), len(changes.removed), len(changes.changed))
+        return changes
@@ -0,0 +1,252 @@
+'''Poll Scheduler Class to keep polling sites on their own intervals'''
+import asyncio
+import logging
+import random
+import time
+from typing import List
+
+from util.Exceptions.custom_exceptions import CriticalError
+from util.Metrics.metrics import get_metrics
+from util.Poller.site_poller import SitePoller, SweepSummary, export_fleet
+from util.Registry.site_registry import SiteChanges, SiteRegistry
+
+# Failures beyond this many no longer double the backoff, so it cannot overflow
+MAX_BACKOFF_DOUBLINGS = 32
+
+
+class SiteSchedule:
+    '''Scheduling state for a single site'''
+    def __init__(self, site: dict, interval: float):
+        self.site = site
+        self.interval = interval
+        self.next_run = 0.0
+        self.consecutive_failures = 0
+        self.runs = 0
+        self.missed_deadlines = 0
+        self.polling = False
+        self.removed = False
+
+
+class PollScheduler:
+    '''
+    Polls every site on its own interval until stopped.
+
+    Each site runs in its own task so a site is never polled twice at the same time. The interval is
+    taken from the site's "Interval" key (seconds) and falls back to default_interval. Poll times are
+    spread by +/- jitter (a fraction of the interval) and failing sites back off exponentially up to
+    max_backoff seconds, but are never polled more often than their interval. Sites skipped because
+    their circuit is open do not back off, since the health tracker already spaces out their probes.
+    A poll that could not start before the following one was due counts as a missed deadline.
+    Reports cover the polls that finished and the deadlines that were missed since the previous
+    report.
+
+    With a registry, the site file is checked for changes every reload_interval seconds and only
+    the sites that were added, removed or changed are started, stopped or updated. The other sites
+    keep their schedules and sessions.
+    '''
+    def __init__(self, site_poller: SitePoller, sites: List[dict],
+                 default_interval: float,
+                 jitter: float = 0.1,
+                 max_backoff: float = 3600,
+                 report_interval: float = 300,
+                 registry: SiteRegistry = None,
+                 reload_interval: float = 30):
+        self.logger = logging.getLogger()
+        self.site_poller = site_poller
+        self.default_interval = default_interval
+        self.jitter = jitter
+        self.max_backoff = max_backoff
+        self.report_interval = report_interval
+        self.registry = registry
+        self.reload_interval = reload_interval
+        self.schedules = {site['Location']: SiteSchedule(site, site.get('Interval', default_interval))
+                          for site in sites}
+        self.summary = SweepSummary(total=len(self.schedules))
+        self.latest_snapshots = {}
+        self.tasks = {}
+        # Tasks of removed sites that are finishing their last poll
+        self.finishing = set()
+        self.stop_event = None
+        self.critical_error = None
+        self.logger.debug("Poll Scheduler Initialized")
+
+    def _jittered(self, delay: float) -> float:
+        '''Spreads a delay by the configured jitter'''
+        if self.jitter <= 0:
+            return delay
+        return max(0.0, delay * (1 + random.uniform(-self.jitter, self.jitter)))
+
+    def _next_delay(self, schedule: SiteSchedule) -> float:
+        '''Delay until the next poll, backing off exponentially after failures'''
+        if schedule.consecutive_failures == 0:
+            return self._jittered(schedule.interval)
+        backoff = schedule.interval * (2 ** min(schedule.consecutive_failures, MAX_BACKOFF_DOUBLINGS))
+        return self._jittered(max(schedule.interval, min(backoff, self.max_backoff)))
+
+    async def _wait(self, seconds: float) -> bool:
+        '''Sleeps for the given time. Returns True if the scheduler was stopped in the meantime'''
+        try:
+            await asyncio.wait_for(self.stop_event.wait(), timeout=max(0.0, seconds))
+        except asyncio.exceptions.TimeoutError:
+            return False
+        return True
+
+    async def _run_site(self, schedule: SiteSchedule) -> None:
+        '''Polls a site on its schedule until the scheduler is stopped'''
+        location = schedule.site['Location']
+        if schedule.next_run == 0.0:
+            # Start each site at a random point within its first interval so polls are spread out
+            schedule.next_run = time.monotonic() + random.uniform(0, schedule.interval)
+        while not self.stop_event.is_set():
+            if await self._wait(schedule.next_run - time.monotonic()):
+                return
+            schedule.polling = True
+            # A report may start a new summary while the poll runs, so the outcome is added to the
+            # summary that is current once the poll is done
+            outcome = SweepSummary(cycle=self.summary.cycle)
+            try:
+                success = await self.site_poller.bounded_poll_site(schedule.site, outcome)
+            except CriticalError as e:
+                self.logger.critical("Critical Error polling %s: %s", location, e)
+                self.critical_error = e
+                self.stop()
+                return
+            except Exception as e:
+                # Anything else only fails this poll, so the site stays scheduled
+                self.logger.exception("Unexpected error polling %s: %s", location, e)
+                outcome.record_failure(location, f"Unexpected error: {e}")
+                success = False
+            finally:
+                schedule.polling = False
+                self.summary.merge(outcome)
+            if schedule.removed:
+                # The site was taken out of the site file while this poll was running
+                await self.site_poller.forget(schedule.site)
+                return
+            schedule.runs += 1
+            # A site skipped with an open circuit is already spaced out by the health tracker, so it
+            # keeps its interval instead of backing off a second time
+            schedule.consecutive_failures = 0 if success is not False else schedule.consecutive_failures + 1
+            scheduled = schedule.next_run
+            schedule.next_run = scheduled + self._next_delay(schedule)
+            now = time.monotonic()
+            if schedule.next_run < now:
+                schedule.missed_deadlines += 1
+                self.logger.warning("Polling %s fell behind schedule by %.1f seconds.",
+                                    location, now - schedule.next_run)
+                schedule.next_run = now
+            if success is False:
+                self.logger.warning("%s has failed %s times in a row. Next poll in %.0f seconds.",
+                                    location, schedule.consecutive_failures, schedule.next_run - now)
+
+    def _start(self, schedule: SiteSchedule) -> None:
+        '''Starts the task polling a site'''
+        self.tasks[schedule.site['Location']] = asyncio.create_task(self._run_site(schedule))
+
+    def _stop_idle(self, location: str) -> bool:
+        '''Cancels the task of a site if it is waiting for its next poll. Returns True if it was cancelled'''
+        schedule = self.schedules.get(location)
+        task = self.tasks.get(location)
+        if task is None or (schedule is not None and schedule.polling):
+            return False
+        task.cancel()
+        del self.tasks[location]
+        return True
+
+    async def apply(self, changes: SiteChanges) -> None:
+        '''Starts, stops and updates only the sites that changed in the site file'''
+        for site in changes.removed:
+            location = site['Location']
+            schedule = self.schedules.pop(location)
+            schedule.removed = True
+            if schedule.polling:
+                # Let the running poll finish. The site is forgotten once it is done
+                task = self.tasks.pop(location)
+                self.finishing.add(task)
+                task.add_done_callback(self.finishing.discard)
+            else:
+                self._stop_idle(location)
+                await self.site_poller.forget(site)
+            self.latest_snapshots.pop(location, None)
+        for old, new in changes.changed:
+            schedule = self.schedules[new['Location']]
+            schedule.site = new
+            if (old['Host'], old['Port'], old.get('Transport')) != (new['Host'], new['Port'], new.get('Transport')):
+                # The site moved, so its pooled session and failure history belong to the old address
+                await self.site_poller.telnet_connector.discard(old['Host'], old['Port'])
+                if self.site_poller.health_tracker is not None:
+                    self.site_poller.health_tracker.sites.pop(new['Location'], None)
+                schedule.consecutive_failures = 0
+            interval = new.get('Interval', self.default_interval)
+            if interval != schedule.interval:
+                schedule.interval = interval
+                schedule.next_run = min(schedule.next_run, time.monotonic() + self._jittered(interval))
+                # A waiting task would sleep until the old time, so restart it on the new one
+                if self._stop_idle(new['Location']):
+                    self._start(schedule)
+        for site in changes.added:
+            schedule = self.schedules[site['Location']] = SiteSchedule(site, site.get('Interval',
+                                                                                      self.default_interval))
+            self._start(schedule)
+        self.summary.total = len(self.schedules)
+        self.logger.info("Now scheduling %s sites.", len(self.schedules))
+
+    async def _reload_loop(self) -> None:
+        '''Periodically applies the changes to the site file until the scheduler is stopped'''
+        while not await self._wait(self.reload_interval):
+            # Reading the site file blocks, so it is done off the event loop
+            changes = await asyncio.to_thread(self.registry.reload)
+            if changes:
+                await self.apply(changes)
+
+    async def report(self) -> None:
+        '''Logs the outcome of polls since the last report and starts a new one'''
+        summary = self.summary
+        missed = sum(schedule.missed_deadlines for schedule in self.schedules.values())
+        for schedule in self.schedules.values():
+            schedule.missed_deadlines = 0
+        self.logger.info("Polls since last report: %s succeeded (%s written, %s unchanged), %s failed, "
+                         "%s skipped with open circuits. Missed deadlines: %s", summary.success_count,
+                         len(summary.written_list), len(summary.skipped_list), len(summary.failed_list),
+                         len(summary.circuit_open_list), missed)
+        if len(summary.failed_list) > 0:
+            self.logger.warning("Failed tanks: %s", summary.failed_list)
+        for location, rate in summary.corruption_rates().items():
+            self.logger.warning("%s: %.1f%% of frames failed their checksum.", location, rate * 100)
+        self.latest_snapshots.update({location: snapshot for location, snapshot in summary.snapshots.items()
+                                      if location in self.schedules})
+        if len(summary.written_list) > 0:
+            await export_fleet(self.site_poller.writer, self.site_poller.data_loader, self.latest_snapshots.values())
+        self.summary = SweepSummary(total=len(self.schedules))
+        # Writing the metrics file blocks, so it is done off the event loop
+        await asyncio.to_thread(get_metrics().export)
+
+    async def _report_loop(self) -> None:
+        '''Periodically logs a report until the scheduler is stopped'''
+        while not await self._wait(self.report_interval):
+            await self.report()
+            await self.site_poller.telnet_connector.close_idle_sessions()
+
+    def stop(self) -> None:
+        '''Asks the scheduler to stop after the polls that are currently running'''
+        if self.stop_event is not None:
+            self.stop_event.set()
+
+    async def run(self) -> None:
+        '''Runs until stop() is called. Raises the CriticalError that stopped it, if any'''
+        self.stop_event = asyncio.Event()
+        self.logger.info("Scheduling %s sites.", len(self.schedules))
+        for schedule in self.schedules.values():
+            self._start(schedule)
+        background = [asyncio.create_task(self._report_loop())]
+        if self.registry is not None:
+            background.append(asyncio.create_task(self._reload_loop()))
+        try:
+            await self.stop_event.wait()
+            await asyncio.gather(*self.tasks.values(), *self.finishing, *background)
+        finally:
+            for task in [*self.tasks.values(), *self.finishing, *background]:
+                task.cancel()
+        await self.report()
+        if self.critical_error is not None:
+            raise self.critical_error
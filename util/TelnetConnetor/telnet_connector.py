@@ -1,94 +1,281 @@
 '''Telnet Connection Class'''
 import asyncio
+import importlib.util
 import logging
-import telnetlib3
+from typing import AsyncIterator, List
 
+from util.Enums.transport import Transport
 from util.Exceptions.custom_exceptions import CriticalError, SimpleError
+from util.Metrics.metrics import get_metrics
+from util.TelnetConnetor.telnet_session import TelnetSession
+
+TELNET_MISSING = "telnetlib3 is not installed. Install it or set the Transport of the sites to raw."
+
+
+def telnet_available() -> bool:
+    '''Checks that telnetlib3 can be imported, without importing it'''
+    return importlib.util.find_spec('telnetlib3') is not None
 
 
 class TelnetConnector:
-    '''Telnet Connector Class'''
-    def __init__(self):
+    '''
+    Telnet Connector Class
+
+    Keeps a pool of open sessions keyed by (host, port). Sessions are reused between polls as long as
+    they are still open and have not been idle longer than idle_timeout. A reused session that the
+    host closed or reset is assumed to have gone stale and is replaced by a new connection once.
+
+    Sites are reached over telnet by default. Sites behind serial-to-Ethernet converters can use the
+    raw TCP transport, which skips telnet option negotiation. telnetlib3 is only imported once a
+    telnet session is opened.
+    '''
+    def __init__(self, connect_timeout: float = None, read_timeout: float = None,
+                 keep_alive: bool = True, idle_timeout: float = None, frame_retries: int = 0):
         self.logger = logging.getLogger()
-        self.reader = None
-        self.writer = None
+        self.sessions = {}
+        self.locks = {}
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.keep_alive = keep_alive
+        self.idle_timeout = idle_timeout
+        self.frame_retries = max(0, frame_retries)
+        self.metrics = get_metrics()
         self.logger.debug("Telnet Connector Initialized")
 
-    async def open_connection(self, host: str, port: int):
-        '''Opens a new telnet connection'''
-        if self.reader and self.writer:
-            self.logger.debug("Closing existing connection")
-            self.reader.close()
-            self.writer.close()
+    def _session_expired(self, session: TelnetSession) -> bool:
+        '''Checks if a session has been idle longer than the idle timeout'''
+        return self.idle_timeout is not None and session.idle_time() > self.idle_timeout
+
+    async def _open_streams(self, host: str, port: int, transport: Transport) -> tuple:
+        '''
+        Opens the reader and writer of a new session over the given transport. Raises CriticalError
+        if telnetlib3 is needed but not installed
+        '''
+        if transport == Transport.RAW:
+            return await asyncio.open_connection(host, port)
+        # Imported here so runs that only use raw sessions do not pay for importing telnetlib3
+        try:
+            import telnetlib3
+        except ImportError as e:
+            self.logger.critical(TELNET_MISSING)
+            raise CriticalError(TELNET_MISSING) from e
+        return await telnetlib3.open_connection(host, port)
+
+    async def open_connection(self, host: str, port: int, transport: Transport = Transport.TELNET) -> TelnetSession:
+        '''Returns an open session to the host, reusing a pooled session when it is still usable'''
+        session = self.sessions.get((host, port))
+        if session is not None:
+            if session.transport == transport and session.is_alive() and not self._session_expired(session):
+                self.logger.debug("Reusing connection to %s on port %s", host, port)
+                self.metrics.increment('connections', 'reused')
+                return session
+            self.logger.debug("Closing stale connection to %s on port %s", host, port)
+            await self.close_connection(session)
         try:
             self.logger.debug("Establishing Telnet connection")
-            self.logger.debug("HOST: %s PORT: %s", host, port)
-            self.reader, self.writer = await telnetlib3.open_connection(host, port)
+            self.logger.debug("HOST: %s PORT: %s TRANSPORT: %s", host, port, transport.value)
+            with self.metrics.timer('connect'):
+                reader, writer = await asyncio.wait_for(self._open_streams(host, port, transport),
+                                                        timeout=self.connect_timeout)
+            self.metrics.increment('connections', 'opened')
             self.logger.info("Successfully established connection to %s", host)
         except KeyboardInterrupt as e:
             self.logger.critical("Process Canceled by user. Exiting.")
             raise CriticalError("Process Canceled by user. Exiting.") from e
         except ConnectionRefusedError as e:
             self.logger.error("Connection refused by host %s on port %s", host, port)
-            raise SimpleError from e
-
-    async def close_connection(self, host):
-        '''Closes the current telnet connection'''
-        if not self.reader or not self.writer:
-            self.logger.warning("No connection to close.")
-            return
-        self.reader.close()
-        self.writer.close()
-        self.reader, self.writer = None, None
-        self.logger.debug("Connection to %s closed", host)
-
-    async def retrieve_data(self, command: str) -> bytes:
-        '''Get tank data from established connection'''
-        if not self.reader or not self.writer:
-            self.logger.error("No connection established.")
-            raise SimpleError("No connection established.")
+            self.metrics.increment('errors', 'refused')
+            raise SimpleError("Connection refused by host.") from e
+        except asyncio.exceptions.TimeoutError as e:
+            self.logger.error("Connection to host %s on port %s timed out", host, port)
+            self.metrics.increment('errors', 'connect_timeout')
+            raise SimpleError("Connection timed out.") from e
+        except OSError as e:
+            self.logger.error("Unable to connect to host %s on port %s: %s", host, port, e)
+            self.metrics.increment('errors', 'unreachable')
+            raise SimpleError("Unable to connect to host.") from e
+        session = TelnetSession(host, port, reader, writer, transport)
+        self.sessions[session.key] = session
+        return session
+
+    async def close_connection(self, session: TelnetSession) -> None:
+        '''Closes a telnet session and removes it from the pool'''
+        if self.sessions.get(session.key) is session:
+            del self.sessions[session.key]
+        session.close()
+        self.logger.debug("Connection to %s closed", session.host)
+
+    async def close_idle_sessions(self) -> None:
+        '''Closes pooled sessions that are no longer open or have been idle past the idle timeout'''
+        for session in list(self.sessions.values()):
+            lock = self.locks.get(session.key)
+            if lock is not None and lock.locked():
+                continue
+            if not session.is_alive() or self._session_expired(session):
+                await self.close_connection(session)
+
+    async def discard(self, host: str, port: int) -> None:
+        '''Closes the pooled session to a host, unless a poll is using it right now'''
+        session = self.sessions.get((host, port))
+        lock = self.locks.get((host, port))
+        if lock is not None and not lock.locked():
+            del self.locks[(host, port)]
+        if session is not None and (lock is None or not lock.locked()):
+            await self.close_connection(session)
+
+    async def close_all(self) -> None:
+        '''Closes every pooled session'''
+        for session in list(self.sessions.values()):
+            await self.close_connection(session)
+
+    async def _read_chunk(self, session: TelnetSession, deadline: float) -> bytes:
+        '''Reads the next chunk of a response, failing once the deadline has passed'''
+        timeout = None if deadline is None else max(0.0, deadline - asyncio.get_running_loop().time())
         try:
-            action = f"\x01{command}"
-            self.logger.debug("Command sent to host: %s", action)
-            self.writer.write(action)
-            response = await self.reader.readuntil(b'\x03')
-            self.logger.info("Successfully received response received from host.")
-            return response
+            chunk = await asyncio.wait_for(session.reader.read(4096), timeout=timeout)
         except KeyboardInterrupt as e:
             self.logger.critical("Process Canceled by user. Exiting.")
             raise CriticalError("Process Canceled by user. Exiting.") from e
-        except asyncio.exceptions.IncompleteReadError as e:
-            self.logger.error("Failed to receive a response from host.")
-            raise SimpleError("Failed to receive a response from host.") from e
         except ConnectionResetError as e:
             self.logger.error("Connection reset by host.")
+            self.metrics.increment('errors', 'reset')
             raise SimpleError("Connection reset by host.") from e
         except asyncio.exceptions.TimeoutError as e:
             self.logger.error("Connection timed out.")
+            self.metrics.increment('errors', 'read_timeout')
             raise SimpleError("Connection timed out.") from e
-        except AssertionError as e:
-            self.logger.error("Assertion Error: %s", e)
-            raise SimpleError("Assertion Error.") from e
+        except OSError as e:
+            self.logger.error("Connection to host %s on port %s failed: %s", session.host, session.port, e)
+            self.metrics.increment('errors', 'connection_lost')
+            raise SimpleError("Connection to host failed.") from e
+        if not chunk:
+            self.logger.error("Failed to receive a response from host.")
+            self.metrics.increment('errors', 'incomplete_read')
+            raise SimpleError("Failed to receive a response from host.")
+        # telnetlib3 returns str from read() when the session has an encoding, raw sessions return bytes
+        chunk = chunk.encode() if isinstance(chunk, str) else chunk
+        self.metrics.increment('bytes_received', amount=len(chunk))
+        return chunk
+
+    async def _start_stream(self, host: str, port: int, commands: List[str], transport: Transport) -> tuple:
+        '''
+        Sends the commands back-to-back and waits for the first chunk of the responses, reconnecting
+        once if a reused session is stale. Returns the session, the first chunk and the time the
+        commands were first sent.
 
-    async def get_tank_data(self, host, port, command) -> str:
-        '''Gets tank data'''
-        self.logger.info("Getting tank data for host %s on port %s", host, port)
+        A session is only stale if the host closed or reset it. A host that timed out is not
+        reconnected to, and the reconnect has to answer before the read timeout of the first attempt
+        runs out, so a hung gauge still fails within its read timeout.
+        '''
+        sent_at, deadline = None, None
+        for attempt in range(2):
+            session = await self.open_connection(host, port, transport)
+            reused = session.uses > 0
+            if sent_at is None:
+                sent_at = asyncio.get_running_loop().time()
+                deadline = None if self.read_timeout is None else sent_at + self.read_timeout
+            try:
+                session.send(''.join(f"\x01{command}" for command in commands))
+                return session, await self._read_chunk(session, deadline), sent_at
+            except SimpleError as e:
+                await self.close_connection(session)
+                if not reused or attempt == 1 or isinstance(e.__cause__, asyncio.exceptions.TimeoutError):
+                    raise
+            self.logger.info("Reused connection to %s on port %s went stale. Reconnecting...", host, port)
+        raise SimpleError("No connection established.")
+
+    def _feed(self, parser, chunk: bytes) -> list:
+        '''Feeds a chunk to a parser. Any error the parser raises is raised as a SimpleError'''
         try:
-            await self.open_connection(host, port)
+            return parser.feed(chunk)
+        except SimpleError:
+            raise
+        except Exception as e:
+            self.logger.error("Unable to decode the response to %s: %s", parser.command, e)
+            self.metrics.increment('errors', 'decode')
+            raise SimpleError(f"Unable to decode the response to {parser.command}.") from e
+
+    async def stream_responses(self, host: str, port: int, parsers: list,
+                               transport: Transport = Transport.TELNET) -> AsyncIterator:
+        '''
+        Sends the command of every parser on one session and yields each item, such as a tank, as
+        soon as it has been decoded.
+
+        The console answers the commands in the order they were sent, so the responses are split at
+        the end of each frame and fed to the parsers in turn. A frame ends at its end character or,
+        if noise garbled the end character, right after its checksum. Parsers raise SimpleError for
+        a response that does not echo their command, so a missing or extra frame fails the site
+        instead of being decoded as the wrong report. A parser must return the items completed by a
+        chunk from feed(), find the end of its frame with frame_end() and set done once its whole
+        response has been read. Every response has read_timeout seconds to arrive.
+
+        Every frame is checked with the parser's verify(), including frames cut short by an early
+        end character. The commands whose responses failed their checksum are sent again on the same
+        session, up to frame_retries times, after resetting their parsers. Bytes that arrive before
+        the start character of a frame are dropped, so the rest of a frame that was cut short is not
+        taken for the next response.
+        '''
+        self.logger.info("Streaming %s responses from host %s on port %s", len(parsers), host, port)
+        lock = self.locks.setdefault((host, port), asyncio.Lock())
+        async with lock:
+            session = None
             try:
-                response = await self.retrieve_data(command)
-                content = response.decode()
-                content = content.replace('\x01' + command, '').replace('\x03', '')
-                self.logger.debug("Response decoded")
-                return content
-            except CriticalError as e:
-                raise CriticalError from e
+                session, chunk, sent_at = await self._start_stream(host, port,
+                                                                   [parser.command for parser in parsers],
+                                                                   transport)
+                loop = asyncio.get_running_loop()
+                deadline = None if self.read_timeout is None else sent_at + self.read_timeout
+                pending = parsers
+                for attempt in range(self.frame_retries + 1):
+                    if attempt > 0:
+                        self.logger.warning("Resending %s to host %s after corrupted responses.",
+                                            ', '.join(parser.command for parser in pending), host)
+                        self.metrics.increment('frames', 'resent', len(pending))
+                        for parser in pending:
+                            parser.reset()
+                        session.send(''.join(f"\x01{parser.command}" for parser in pending))
+                        deadline = None if self.read_timeout is None else loop.time() + self.read_timeout
+                    for parser in pending:
+                        while True:
+                            if len(chunk) == 0:
+                                chunk = await self._read_chunk(session, deadline)
+                            end = parser.frame_end(chunk)
+                            head, chunk = (chunk, b'') if end == -1 else (chunk[:end], chunk[end:])
+                            if len(parser.buffer) == 0:
+                                # Every frame starts with the start character. Anything before it, such as
+                                # the rest of a frame that noise cut short, or a garbled or late end
+                                # character, is dropped
+                                start = head.find(b'\x01')
+                                if start == -1:
+                                    if end != -1 and head != b'\x03':
+                                        self.metrics.increment('frames', 'discarded')
+                                    continue
+                                head = head[start:]
+                            for item in self._feed(parser, head):
+                                yield item
+                            # A frame that ended where the parser did not expect it is left incomplete
+                            if parser.done or end != -1:
+                                break
+                        parser.verify()
+                        if self.read_timeout is not None:
+                            deadline = loop.time() + self.read_timeout
+                    self.metrics.increment('frames', 'received', len(pending))
+                    pending = [parser for parser in pending if parser.corrupt]
+                    if len(pending) == 0:
+                        break
+                    self.metrics.increment('frames', 'corrupt', len(pending))
+                session.touch()
+                self.metrics.observe('response', asyncio.get_running_loop().time() - sent_at)
+                self.logger.info("Successfully received response received from host.")
             except KeyboardInterrupt as e:
-                raise CriticalError from e
+                raise CriticalError("Process Canceled by user. Exiting.") from e
             except SimpleError as e:
-                raise SimpleError from e
+                if session is not None:
+                    await self.close_connection(session)
+                self.logger.error("Failed to retreive data.")
+                raise SimpleError(f"Failed to retrieve data: {e}") from e
             finally:
-                await self.close_connection(host)
-        except SimpleError as e:
-            self.logger.error("Failed to retreive data.")
-            raise SimpleError from e
+                session = self.sessions.get((host, port))
+                done = all(parser.done for parser in parsers)
+                if session is not None and (not self.keep_alive or not done):
+                    await self.close_connection(session)
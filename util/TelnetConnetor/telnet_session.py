@@ -0,0 +1,55 @@
+'''Telnet Session Class'''
+import time
+
+from util.Enums.transport import Transport
+
+
+class TelnetSession:
+    '''
+    An open session to a single host and port.
+
+    The reader and writer are telnetlib3 streams for telnet sessions and plain asyncio streams for
+    raw TCP sessions.
+    '''
+    def __init__(self, host: str, port: int, reader, writer, transport: Transport = Transport.TELNET):
+        self.host = host
+        self.port = port
+        self.reader = reader
+        self.writer = writer
+        self.transport = transport
+        self.uses = 0
+        self.last_used = time.monotonic()
+
+    @property
+    def key(self) -> tuple:
+        '''Key of the session in the connection pool'''
+        return (self.host, self.port)
+
+    def idle_time(self) -> float:
+        '''Seconds since the session was last used'''
+        return time.monotonic() - self.last_used
+
+    def touch(self) -> None:
+        '''Marks the session as used'''
+        self.uses += 1
+        self.last_used = time.monotonic()
+
+    def is_alive(self) -> bool:
+        '''Checks that the underlying connection is still open without sending anything'''
+        if self.reader is None or self.writer is None:
+            return False
+        if self.reader.at_eof():
+            return False
+        return not self.writer.is_closing()
+
+    def send(self, data: str) -> None:
+        '''Writes to the session. Raw streams only take bytes, telnet streams encode for themselves'''
+        self.writer.write(data.encode() if self.transport == Transport.RAW else data)
+
+    def close(self) -> None:
+        '''Closes the underlying connection'''
+        if self.reader is not None and self.transport == Transport.TELNET:
+            self.reader.close()
+        if self.writer is not None:
+            self.writer.close()
+        self.reader, self.writer = None, None
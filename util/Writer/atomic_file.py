@@ -0,0 +1,42 @@
+'''Atomic writes and JSON state files'''
+import json
+import logging
+import os
+
+
+def write_atomic(data: str, file_name: str) -> None:
+    '''
+    Writes a string to a temporary file and renames it over file_name, so readers never see a
+    partly written file. The temporary file is removed if the write fails. Raises OSError
+    '''
+    temp_file = f"{file_name}.{os.getpid()}.tmp"
+    try:
+        with open(temp_file, mode='w', encoding='utf-8') as file:
+            file.write(data)
+        os.replace(temp_file, file_name)
+    except OSError:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+
+
+def load_json_state(file_name: str, description: str) -> dict:
+    '''Loads state kept between runs. A missing file, or one that cannot be read, starts empty'''
+    try:
+        with open(file_name, mode='r', encoding='utf-8') as f:
+            state = json.load(f)
+        logging.getLogger().debug("Loaded %s for %s sites", description, len(state))
+        return state
+    except FileNotFoundError:
+        return {}
+    except (OSError, json.JSONDecodeError) as e:
+        logging.getLogger().warning("Unable to load %s from %s: %s", description, file_name, e)
+        return {}
+
+
+def save_json_state(state: dict, file_name: str, description: str) -> None:
+    '''Saves state kept between runs, replacing the file atomically. Failures are only logged'''
+    try:
+        write_atomic(json.dumps(state), file_name)
+    except OSError as e:
+        logging.getLogger().error("Unable to save %s to %s: %s", description, file_name, e)
@@ -0,0 +1,93 @@
+'''Background Writer Class to keep blocking file writes off the event loop'''
+import asyncio
+import contextvars
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from util.Exceptions.custom_exceptions import SimpleError
+from util.Metrics.metrics import get_metrics
+
+
+class BackgroundWriter:
+    '''
+    Runs blocking writes on a small pool of writer threads.
+
+    Writes wait in a queue of at most max_pending entries. Once the queue is full, write() waits for
+    a free entry, so polling slows down to the speed of the disk instead of piling up data in memory.
+    The SimpleError or CriticalError raised by a write is raised again from write() so callers can
+    handle it for the site it belongs to. Any other OSError is raised as a SimpleError. Writes run
+    in the context of the task that queued them, so their log lines keep its site and cycle.
+    '''
+    def __init__(self, workers: int = 2, max_pending: int = 100):
+        self.logger = logging.getLogger()
+        self.metrics = get_metrics()
+        self.workers = max(1, workers)
+        self.max_pending = max(1, max_pending)
+        self.queue = None
+        self.executor = None
+        self.tasks = []
+        self.closed = False
+        self.logger.debug("Background Writer Initialized")
+
+    def start(self) -> None:
+        '''Starts the writer threads on the running event loop'''
+        if self.queue is not None:
+            return
+        self.queue = asyncio.Queue(maxsize=self.max_pending)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='writer')
+        self.tasks = [asyncio.create_task(self._drain()) for _ in range(self.workers)]
+
+    @staticmethod
+    def _run(context: contextvars.Context, function: Callable, args: tuple) -> Any:
+        '''Runs a single write on a writer thread'''
+        try:
+            return context.run(function, *args)
+        except OSError as e:
+            raise SimpleError(f"Background write failed: {e}") from e
+
+    async def _drain(self) -> None:
+        '''Takes writes off the queue and runs them until the writer is closed'''
+        loop = asyncio.get_running_loop()
+        while True:
+            context, function, args, future = await self.queue.get()
+            try:
+                result = await loop.run_in_executor(self.executor, self._run, context, function, args)
+            except Exception as e:
+                if not future.cancelled():
+                    future.set_exception(e)
+            else:
+                if not future.cancelled():
+                    future.set_result(result)
+            finally:
+                self.queue.task_done()
+
+    async def write(self, function: Callable, *args) -> Any:
+        '''Queues function(*args) and waits for it to finish, returning its result'''
+        if self.closed:
+            raise SimpleError("Background writer is closed.")
+        self.start()
+        if self.queue.full():
+            self.metrics.increment('writer', 'backpressure')
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((contextvars.copy_context(), function, args, future))
+        self.metrics.increment('writer', 'queued')
+        return await future
+
+    async def flush(self) -> None:
+        '''Waits until every queued write has finished'''
+        if self.queue is not None:
+            await self.queue.join()
+
+    async def close(self) -> None:
+        '''Finishes the queued writes and stops the writer threads'''
+        if self.closed:
+            return
+        self.closed = True
+        await self.flush()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+        self.logger.debug("Background Writer Closed")